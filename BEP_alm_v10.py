@@ -9,6 +9,8 @@ from PySpice.Spice.Netlist import Circuit
 from PySpice.Unit import u_F, u_H, u_Ω, u_V, u_A, u_s, u_ms, u_us, u_Ts, u_ns, u_mΩ
 import numpy as np
 from scipy.integrate import cumulative_trapezoid
+from ngspice_pool import pooled_transient
+from rate_path import add_rate_path
 
 
 dt = 0.1
@@ -47,32 +49,23 @@ R_{name}_dt {name}_dt 0 1Meg
 """
         circuit.B(f'{name}_output_dt', circuit.gnd, circuit.gnd, current_expression=f'V({name}_dt)')
 
-def steps(circuit, name, rates, times):
-    i = 0 
-    incentive_nodes = []
-
-    for interest_rate in rates:
+def step_pulses(rates, times):
+    """(rate, delay_time, pulse_width) in seconds for each step of the rate path."""
+    pulses = []
+    for i, interest_rate in enumerate(rates):
         if times == None:
             width = 20
             delay = 20*i
         else:
             width = times[i] - times[i-1] if i > 0 else 20
             delay = times[i-1] if i > 0 else 0 
+        pulses.append((interest_rate, delay + dt, width - dt))
+    return pulses
 
-        circuit.PulseVoltageSource(f"variable_source_{i}_{name}", f"incentive_{i}_{name}", circuit.gnd,
-            initial_value=0, pulsed_value=interest_rate,
-            delay_time=delay + dt@u_s, rise_time=0@u_ns,
-            fall_time=0@u_ns, pulse_width= width - dt@u_s, period=1@u_Ts)
-                
-        incentive_nodes.append(f"V(incentive_{i}_{name})")
-
-        i += 1
-
-            # Join all incentive node names into a single sum string
-        sum_string = " + ".join(incentive_nodes)
-
-            # Use the sum string in the behavioral voltage source
-    circuit.B(f"sum_pulses_{name}", f'{name}_preset', circuit.gnd, voltage_expression =sum_string)
+def steps(circuit, name, rates, times):
+    # one PWL source for the whole rate path, ramping over the .tran step like the
+    # zero rise/fall pulses it replaces (see rate_path.py)
+    add_rate_path(circuit, name, step_pulses(rates, times), ramp=dt)
 
 
 def ALM(
@@ -429,8 +422,7 @@ def ALM(
 
 
 def run_transient(circuit, step_time=dt @ u_s, end_time=300 @ u_s):
-    simulator = circuit.simulator()
-    return simulator.transient(step_time=dt, end_time=end_time, use_initial_condition=True)
+    return pooled_transient(circuit, step_time=dt, end_time=end_time, use_initial_condition=True)
 
 
 def plotting(circuit, analysis, plot_1 = 'N013', plot_2 ='v_bloan-to-deposit_ratio1', plot_3 ='BIncentive_to_Borrow'):
@@ -9,6 +9,8 @@ from PySpice.Spice.Netlist import Circuit
 from PySpice.Unit import u_F, u_H, u_Ω, u_V, u_A, u_s, u_ms, u_us, u_Ts, u_ns, u_mΩ
 import numpy as np
 from scipy.integrate import cumulative_trapezoid
+from ngspice_pool import pooled_transient
+from rate_path import add_rate_path
 
 
 dt = 0.1
@@ -48,34 +50,68 @@ R_{name}_dt {name}_dt 0 1Meg
 """
         circuit.B(f'{name}_output_dt', circuit.gnd, circuit.gnd, current_expression=f'V({name}_dt)')
 
-def steps(circuit, name, rates, times):
-    i = 0 
-    incentive_nodes = []
-
-    for interest_rate in rates:
+def step_pulses(rates, times):
+    """(rate, delay_time, pulse_width) in seconds for each step of the rate path."""
+    pulses = []
+    for i, interest_rate in enumerate(rates):
         if times == None:
             width = 20
             delay = 20*i
         else:
             width = times[i] - times[i-1] if i > 0 else 20
             delay = times[i-1] if i > 0 else 0 
+        pulses.append((interest_rate, delay + dt, width - dt))
+    return pulses
 
-        circuit.PulseVoltageSource(f"variable_source_{i}_{name}", f"incentive_{i}_{name}", circuit.gnd,
-            initial_value=0, pulsed_value=interest_rate,
-            delay_time=delay + dt@u_s, rise_time=0@u_ns,
-            fall_time=0@u_ns, pulse_width= width - dt@u_s, period=1@u_Ts)
-                
-        incentive_nodes.append(f"V(incentive_{i}_{name})")
-
-        i += 1
+def steps(circuit, name, rates, times):
+    # one PWL source for the whole rate path, ramping over the .tran step like the
+    # zero rise/fall pulses it replaces (see rate_path.py)
+    add_rate_path(circuit, name, step_pulses(rates, times), ramp=dt)
 
-            # Join all incentive node names into a single sum string
-        sum_string = " + ".join(incentive_nodes)
+import numpy as np
 
-            # Use the sum string in the behavioral voltage source
-    circuit.B(f"sum_pulses_{name}", f'{name}_preset', circuit.gnd, voltage_expression =sum_string)
+def _change_points(u_samples, tol):
+    """
+    Indices kept by the ZOH compression: a sample is kept when it differs by
+    more than tol from the last kept one.
+
+    Right after a kept sample, every following sample that moves more than
+    tol from its neighbour is kept too, so such runs are taken in one slice.
+    A jump of more than 2*tol is kept whatever came before (the previous
+    sample is within tol of the last kept value), which bounds the windowed
+    search for a slow drift in between. Python loops once per run or drift
+    change, never per sample.
+    """
+    n = len(u_samples)
+    step = np.abs(np.diff(u_samples))
+    quiet = np.flatnonzero(step <= tol) + 1          # samples that do not move more than tol
+    definite = np.flatnonzero(step > 2 * tol) + 1
+    keep = [np.array([0])]
+    i = 0
+    while True:
+        if i + 1 < n and step[i] > tol:
+            # run of large moves: keep up to the next quiet sample
+            q = np.searchsorted(quiet, i + 1)
+            end = quiet[q] if q < len(quiet) else n
+            keep.append(np.arange(i + 1, end))
+            i = end - 1
+            continue
+        p = np.searchsorted(definite, i, side='right')
+        stop = definite[p] if p < len(definite) else n
+        start, window, hit = i + 1, 64, stop
+        while start < stop:
+            end = min(stop, start + window)
+            found = np.flatnonzero(np.abs(u_samples[start:end] - u_samples[i]) > tol)
+            if found.size:
+                hit = start + found[0]
+                break
+            start, window = end, window * 2
+        if hit == n:
+            break
+        keep.append(np.array([hit]))
+        i = hit
+    return np.concatenate(keep)
 
-import numpy as np
 
 def recommend_discrete(time, u_continuous, Ts, tol=1e-6):
     """
@@ -98,14 +134,62 @@ def recommend_discrete(time, u_continuous, Ts, tol=1e-6):
     # 2) sample / interpolate the continuous waveform
     u_samples = np.interp(t_samples, time, u_continuous)
     # 3) collapse into only the points where u actually changes (within tol)
-    rates, times_out = [], []
-    last = None
-    for t, u in zip(t_samples, u_samples):
-        if (last is None) or (abs(u - last) > tol):
-            rates.append(u)
-            times_out.append(t)
-            last = u
-    return rates, times_out
+    keep = _change_points(u_samples, tol)
+    return u_samples[keep].tolist(), t_samples[keep].tolist()
+
+
+def _interp_rows(t_samples, time, u_traces):
+    """np.interp(t_samples, time, row) for every row, sharing the search over `time`."""
+    upper = np.clip(np.searchsorted(time, t_samples, side='right'), 1, len(time) - 1)
+    lower = upper - 1
+    with np.errstate(divide='ignore', invalid='ignore'):
+        slope = (u_traces[:, upper] - u_traces[:, lower]) / (time[upper] - time[lower])
+        u_samples = slope * (t_samples - time[lower]) + u_traces[:, lower]
+    # np.interp clamps outside the time axis
+    u_samples[:, t_samples >= time[-1]] = u_traces[:, -1:]
+    u_samples[:, t_samples <= time[0]] = u_traces[:, :1]
+    return u_samples
+
+
+def _change_mask(u_samples, tol):
+    """_change_points() for every row at once, stepping through the samples; pays off for many rows."""
+    mask = np.zeros(u_samples.shape, dtype=bool)
+    mask[:, 0] = True
+    last = u_samples[:, 0].copy()
+    for k in range(1, u_samples.shape[1]):
+        moved = np.abs(u_samples[:, k] - last) > tol
+        mask[:, k] = moved
+        np.copyto(last, u_samples[:, k], where=moved)
+    return mask
+
+
+def recommend_discrete_batch(time, u_traces, Ts_values, tol=1e-6):
+    """
+    recommend_discrete() for a stack of control traces and several periods at once.
+
+    Args:
+      time             np.ndarray of shape (N,)      – time stamps shared by all traces [s]
+      u_traces         np.ndarray of shape (M, N)    – one control trace per row
+      Ts_values        iterable of floats            – sampling periods [s]
+      tol              float                         – threshold for detecting changes
+
+    Returns:
+      {Ts: [(rates, times), ...]} with one ZOH schedule per trace, in row order
+    """
+    time = np.asarray(time, dtype=float)
+    u_traces = np.atleast_2d(np.asarray(u_traces, dtype=float))
+    schedules = {}
+    for Ts in Ts_values:
+        t_samples = np.arange(0, time[-1] + Ts, Ts)
+        u_samples = _interp_rows(t_samples, time, u_traces)
+        if len(u_traces) >= 16:
+            masks = _change_mask(u_samples, tol)
+            keeps = [np.flatnonzero(mask) for mask in masks]
+        else:
+            keeps = [_change_points(row, tol) for row in u_samples]
+        schedules[Ts] = [(row[keep].tolist(), t_samples[keep].tolist())
+                         for row, keep in zip(u_samples, keeps)]
+    return schedules
 
 
 
@@ -452,8 +536,7 @@ def ALM(
 
 
 def run_transient(circuit, step_time=dt @ u_s, end_time=300 @ u_s):
-    simulator = circuit.simulator()
-    return simulator.transient(step_time=dt, end_time=end_time, use_initial_condition=True)
+    return pooled_transient(circuit, step_time=dt, end_time=end_time, use_initial_condition=True)
 
 
 def plotting(circuit, analysis, plot_1 = 'N013', plot_2 ='v_bloan-to-deposit_ratio1', plot_3 ='BIncentive_to_Borrow'):
@@ -2,19 +2,33 @@
 
 
 import os
-import argparse
-import matplotlib.pyplot as plt
-from PySpice.Logging.Logging import setup_logging
 from PySpice.Spice.Netlist import Circuit
-from PySpice.Unit import u_F, u_H, u_Ω, u_V, u_A, u_s, u_ms, u_us, u_Ts, u_ns, u_mΩ
+from PySpice.Unit import u_F, u_H, u_Ω, u_s, u_us, u_Ts, u_ns
 import numpy as np
-from scipy.integrate import cumulative_trapezoid
+from ngspice_pool import pooled_transient
+from state_space import run_state_space
+from result_store import ResultStore
+from rate_path import add_rate_path
+from sweep import kpi_value
+from netlist_optimizer import inline_signals, optimize_circuit, with_aliases
+from instrumentation import add_stats, attach, instrumented, phase, running
 
 
 dt = 0.1
 
 show_statements = True
 show_preset_Trate = True
+save_results = False # keep each run under results/ (see result_store.py)
+
+# Vectors read by plotting() and run_recommend_discrete(); run_transient(circuit, save=DASHBOARD_VECTORS)
+DASHBOARD_VECTORS = [
+    'v_btarget_debt-to-equity_ratio', 'v_bdebt_to_equity_ratio1', 'v_bspread',
+    'v_btarget_loan-to-deposit_ratio', 'v_bloan-to-deposit_ratio1', 'BIncentive_to_Borrow',
+    'v_bt_rate', 'v_bftp_rate',
+    'v_btotal_assets', 'v_btotal_liabilities', 'v_btotal_equity',
+    'v_bnet_cash_flow', 'Lcurrent_deposits', 'Lsavings_deposits', 'Lloans',
+    'v_bnet_interest_income', 'v_binterest_income', 'v_binterest_expense',
+]
 
 def configure_environment():
     # os.environ["PYSPICE_SIMULATOR"] = "ngspice"
@@ -28,55 +42,101 @@ def add_integrator(circuit, name, input_inductor):
         circuit.B(f'{name}_input', f'{name}_measured', circuit.gnd, voltage_expression=f'I({input_inductor})')
         circuit.raw_spice += f"""
 A_{name} {name}_measured {name}_idt i_model
-.model i_model int(gain=1 in_offset=0 
+R_{name} {name}_idt 0 1Meg
+"""
+        if '.model i_model' not in circuit.raw_spice:  # one card shared by every integrator
+            circuit.raw_spice += """.model i_model int(gain=1 in_offset=0 
 + out_lower_limit=-1e100 out_upper_limit=1e100
 + limit_range=1e-9 out_ic=0)
-R_{name} {name}_idt 0 1Meg
 """
         circuit.B(f'{name}_output', circuit.gnd, circuit.gnd, current_expression=f'V({name}_idt)')
 
+def add_capacitor_integrator(circuit, name, input_inductor):
+        """Adds an integrator block as a 1 F capacitor charged by the input: V({name}_idt) = integral of I(input)."""
+        circuit.B(f'{name}_input', circuit.gnd, f'{name}_idt', current_expression=f'I({input_inductor})')
+        circuit.C(name, f'{name}_idt', circuit.gnd, 1 @ u_F)
+        circuit.B(f'{name}_output', circuit.gnd, circuit.gnd, current_expression=f'V({name}_idt)')
+
+INTEGRATORS = {'xspice': add_integrator, 'capacitor': add_capacitor_integrator}
+
 def add_differentiator(circuit, name, input_capacitor):
         """Adds a differentiator block to the circuit."""
         circuit.B(f'{name}_input_dt', f'{name}_measured_dt', circuit.gnd, voltage_expression=f'I({input_capacitor})')
         circuit.raw_spice += f"""
 A_{name}_dt {name}_measured_dt {name}_dt d_model
-.model d_model d_dt(out_offset=0 
+R_{name}_dt {name}_dt 0 1Meg
+"""
+        if '.model d_model' not in circuit.raw_spice:
+            circuit.raw_spice += """.model d_model d_dt(out_offset=0 
 + out_lower_limit=-1e100 out_upper_limit=1e100 
 + limit_range=1e-9)
-R_{name}_dt {name}_dt 0 1Meg
 """
         circuit.B(f'{name}_output_dt', circuit.gnd, circuit.gnd, current_expression=f'V({name}_dt)')
 
-def steps(circuit, name, rates, times):
-    i = 0 
-    incentive_nodes = []
-
-    for interest_rate in rates:
+def step_pulses(rates, times):
+    """(rate, delay_time, pulse_width) in seconds for each pulse that steps() adds."""
+    pulses = []
+    for i, interest_rate in enumerate(rates):
         if times == None:
             width = 20
             delay = 20*i
         else:
             width = times[i] - times[i-1] if i > 0 else times[0]
             delay = times[i-1] if i > 0 else 0 
+        pulses.append((interest_rate, delay + dt, width - dt))
+    return pulses
 
-        circuit.PulseVoltageSource(f"variable_source_{i}_{name}", f"incentive_{i}_{name}", circuit.gnd,
-            initial_value=0, pulsed_value=interest_rate,
-            delay_time=delay + dt@u_s, rise_time=0@u_ns,
-            fall_time=0@u_ns, pulse_width= width - dt@u_s, period=1@u_Ts)
-                
-        incentive_nodes.append(f"V(incentive_{i}_{name})")
-
-        i += 1
-
-            # Join all incentive node names into a single sum string
-        sum_string = " + ".join(incentive_nodes)
-
-            # Use the sum string in the behavioral voltage source
-    circuit.B(f"sum_pulses_{name}", f'{name}_preset', circuit.gnd, voltage_expression =sum_string)
+def steps(circuit, name, rates, times):
+    # one PWL source for the whole rate path, ramping over the .tran step like the
+    # zero rise/fall pulses it replaces (see rate_path.py)
+    add_rate_path(circuit, name, step_pulses(rates, times), ramp=dt)
 
 import numpy as np
 
-def recommend_discrete(time, u_continuous, Ts, tol=1e-6):
+def _change_points(u_samples, tol):
+    """
+    Indices kept by the ZOH compression: a sample is kept when it differs by
+    more than tol from the last kept one.
+
+    Right after a kept sample, every following sample that moves more than
+    tol from its neighbour is kept too, so such runs are taken in one slice.
+    A jump of more than 2*tol is kept whatever came before (the previous
+    sample is within tol of the last kept value), which bounds the windowed
+    search for a slow drift in between. Python loops once per run or drift
+    change, never per sample.
+    """
+    n = len(u_samples)
+    step = np.abs(np.diff(u_samples))
+    quiet = np.flatnonzero(step <= tol) + 1          # samples that do not move more than tol
+    definite = np.flatnonzero(step > 2 * tol) + 1
+    keep = [np.array([0])]
+    i = 0
+    while True:
+        if i + 1 < n and step[i] > tol:
+            # run of large moves: keep up to the next quiet sample
+            q = np.searchsorted(quiet, i + 1)
+            end = quiet[q] if q < len(quiet) else n
+            keep.append(np.arange(i + 1, end))
+            i = end - 1
+            continue
+        p = np.searchsorted(definite, i, side='right')
+        stop = definite[p] if p < len(definite) else n
+        start, window, hit = i + 1, 64, stop
+        while start < stop:
+            end = min(stop, start + window)
+            found = np.flatnonzero(np.abs(u_samples[start:end] - u_samples[i]) > tol)
+            if found.size:
+                hit = start + found[0]
+                break
+            start, window = end, window * 2
+        if hit == n:
+            break
+        keep.append(np.array([hit]))
+        i = hit
+    return np.concatenate(keep)
+
+
+def recommend_discrete(time, u_continuous, Ts, tol=1e-6, max_deviation=None):
     """
     Given a continuous control waveform u_continuous sampled at instants `time`,
     produce a list of (step_value, step_start_time) pairs for a zero-order hold
@@ -87,6 +147,9 @@ def recommend_discrete(time, u_continuous, Ts, tol=1e-6):
       u_continuous     np.ndarray of shape (N,)      – continuous control signal values
       Ts               float                         – sampling period [s]
       tol              float                         – threshold for detecting changes
+      max_deviation    float or None                 – segmentation mode: fewest steps (still
+                                                       on the Ts grid) that keep the path within
+                                                       max_deviation of u_continuous; tol is unused
       
     Returns:
       rates   : list of floats    – the sampled u[k] values
@@ -95,19 +158,115 @@ def recommend_discrete(time, u_continuous, Ts, tol=1e-6):
     # 1) build the uniform grid of sampling instants 
     t_samples = np.arange(0, time[-1] + Ts, Ts)
     # 2) sample / interpolate the continuous waveform
+    if max_deviation is not None:
+        # 3) fewest constant levels, each one the middle of the band it covers
+        starts, levels = _segments(*_cell_ranges(time, u_continuous, t_samples), max_deviation)
+        return levels.tolist(), t_samples[starts].tolist()
     u_samples = np.interp(t_samples, time, u_continuous)
     # 3) collapse into only the points where u actually changes (within tol)
-    rates, times_out = [], []
-    last = None
-    for t, u in zip(t_samples, u_samples):
-        if (last is None) or (abs(u - last) > tol):
-            rates.append(u)
-            times_out.append(t)
-            last = u
-    return rates, times_out
+    keep = _change_points(u_samples, tol)
+    return u_samples[keep].tolist(), t_samples[keep].tolist()
+
 
+def _cell_ranges(time, u_continuous, t_samples):
+    """Lowest and highest value of u in each ZOH cell [t_samples[k], t_samples[k+1])."""
+    # every cell gets its own start value, so none is empty
+    u_grid = np.interp(t_samples, time, u_continuous)
+    order = np.argsort(np.concatenate([t_samples, time]), kind='stable')
+    t_all = np.concatenate([t_samples, time])[order]
+    u_all = np.concatenate([u_grid, u_continuous])[order]
+    starts = np.searchsorted(t_all, t_samples, side='left')
+    return np.minimum.reduceat(u_all, starts), np.maximum.reduceat(u_all, starts)
 
 
+def _segments(cell_min, cell_max, max_deviation):
+    """
+    Fewest runs of cells whose values fit in a band of 2*max_deviation.
+
+    Extending each run as far as it goes is optimal for a bound on the
+    deviation; the search for each run's end doubles its window, so Python
+    loops once per step. A single cell wider than the band gets a step of
+    its own.
+    """
+    n = len(cell_min)
+    starts = []
+    s = 0
+    while s < n:
+        starts.append(s)
+        window = 64
+        e = n
+        while True:
+            stop = min(n, s + window)
+            spread = np.maximum.accumulate(cell_max[s:stop]) - np.minimum.accumulate(cell_min[s:stop])
+            over = np.flatnonzero(spread > 2 * max_deviation)
+            if over.size:
+                e = s + over[0]
+                break
+            if stop == n:
+                break
+            window *= 2
+        s = max(e, s + 1)
+    starts = np.asarray(starts)
+    levels = (np.maximum.reduceat(cell_max, starts) + np.minimum.reduceat(cell_min, starts)) / 2
+    return starts, levels
+
+
+def _interp_rows(t_samples, time, u_traces):
+    """np.interp(t_samples, time, row) for every row, sharing the search over `time`."""
+    upper = np.clip(np.searchsorted(time, t_samples, side='right'), 1, len(time) - 1)
+    lower = upper - 1
+    with np.errstate(divide='ignore', invalid='ignore'):
+        slope = (u_traces[:, upper] - u_traces[:, lower]) / (time[upper] - time[lower])
+        u_samples = slope * (t_samples - time[lower]) + u_traces[:, lower]
+    # np.interp clamps outside the time axis
+    u_samples[:, t_samples >= time[-1]] = u_traces[:, -1:]
+    u_samples[:, t_samples <= time[0]] = u_traces[:, :1]
+    return u_samples
+
+
+def _change_mask(u_samples, tol):
+    """_change_points() for every row at once, stepping through the samples; pays off for many rows."""
+    mask = np.zeros(u_samples.shape, dtype=bool)
+    mask[:, 0] = True
+    last = u_samples[:, 0].copy()
+    for k in range(1, u_samples.shape[1]):
+        moved = np.abs(u_samples[:, k] - last) > tol
+        mask[:, k] = moved
+        np.copyto(last, u_samples[:, k], where=moved)
+    return mask
+
+
+def recommend_discrete_batch(time, u_traces, Ts_values, tol=1e-6):
+    """
+    recommend_discrete() for a stack of control traces and several periods at once.
+
+    Args:
+      time             np.ndarray of shape (N,)      – time stamps shared by all traces [s]
+      u_traces         np.ndarray of shape (M, N)    – one control trace per row
+      Ts_values        iterable of floats            – sampling periods [s]
+      tol              float                         – threshold for detecting changes
+
+    Returns:
+      {Ts: [(rates, times), ...]} with one ZOH schedule per trace, in row order
+    """
+    time = np.asarray(time, dtype=float)
+    u_traces = np.atleast_2d(np.asarray(u_traces, dtype=float))
+    schedules = {}
+    for Ts in Ts_values:
+        t_samples = np.arange(0, time[-1] + Ts, Ts)
+        u_samples = _interp_rows(t_samples, time, u_traces)
+        if len(u_traces) >= 16:
+            masks = _change_mask(u_samples, tol)
+            keeps = [np.flatnonzero(mask) for mask in masks]
+        else:
+            keeps = [_change_points(row, tol) for row in u_samples]
+        schedules[Ts] = [(row[keep].tolist(), t_samples[keep].tolist())
+                         for row, keep in zip(u_samples, keeps)]
+    return schedules
+
+
+
+@instrumented
 def ALM(
     tau_d=1.0,
     q_L0=48,
@@ -152,16 +311,20 @@ def ALM(
     production_shock_time = 200,
     production_shock_size = 10,
 
-    demand_shock = False, #Nothing yet
+    demand_shock = False, # extra demand drawn from the goods market
     demand_shock_time = 120,
     demand_shock_size = 0.03,
 
+    kpi_sources = True, # If False, leaves ROE, NSFR, LCR, ... to kpi.py after the run
+    integrator = 'xspice', # or 'capacitor': one 1 F capacitor per integral instead of the XSPICE int chain
+
 # Simulation parameters
     dt = dt,
 
 ):
     
     circuit = Circuit('ALM - Asset Liability Management')
+    integrate = INTEGRATORS[integrator]
 
 
     # ─────────────── Parameters ───────────────
@@ -257,11 +420,11 @@ def ALM(
 
 ############# INTEGRATING INVESTMENT
     
-    add_integrator(circuit, 'Investment', 'LInvestment')
+    integrate(circuit, 'Investment', 'LInvestment')
 
 ############# INTEGRATING Current Deposits
 
-    add_integrator(circuit, 'Current_Deposits', 'LCurrent_Deposits')
+    integrate(circuit, 'Current_Deposits', 'LCurrent_Deposits')
 
     circuit.B('Current_Account_Balance', circuit.gnd, circuit.gnd,
                 current_expression='{q_C0} + I(BCurrent_Deposits_output)') 
@@ -269,7 +432,7 @@ def ALM(
 
 ############# INTEGRATING Savings Deposits
 
-    add_integrator(circuit, 'Savings_Deposits', 'LSavings_Deposits')
+    integrate(circuit, 'Savings_Deposits', 'LSavings_Deposits')
 
     circuit.B('Savings_Account_Balance', circuit.gnd, circuit.gnd,
                 current_expression='{q_S0} + I(BSavings_Deposits_output)') 
@@ -277,7 +440,7 @@ def ALM(
 
 ############# INTEGRATING Loans
 
-    add_integrator(circuit, 'Loans', 'LLoans')
+    integrate(circuit, 'Loans', 'LLoans')
 
     circuit.B('Loan_Balance',            circuit.gnd, circuit.gnd,
                 current_expression='{q_L0} + I(BLoans_output)')
@@ -285,7 +448,7 @@ def ALM(
     
 ############# INTEGRATING NII
 
-    add_integrator(circuit, 'NII', 'LNII')
+    integrate(circuit, 'NII', 'LNII')
 
     circuit.B('Retained_Earnings',       circuit.gnd, circuit.gnd,
                 current_expression='I(BNII_output)') 
@@ -316,28 +479,30 @@ def ALM(
     circuit.B('Total_Assets',            circuit.gnd, circuit.gnd,
                 current_expression='I(BLoan_Balance)+I(BCash_Reserves)')
 
-    circuit.B('Loan-to-Deposit_Ratio',   circuit.gnd, circuit.gnd,
-                current_expression='I(BLoan_Balance)/I(BTotal_Liabilities)')
-    circuit.B('Return_on_Equity',        circuit.gnd, circuit.gnd,
-                current_expression='I(LNII)/I(BTotal_Equity)')
-    circuit.B('Debt_to_Equity_Ratio',    circuit.gnd, circuit.gnd,
-                current_expression='I(BTotal_Liabilities)/I(BTotal_Equity)')
+    # reporting only, no controller reads these (see kpi.py)
+    if kpi_sources:
+        circuit.B('Loan-to-Deposit_Ratio',   circuit.gnd, circuit.gnd,
+                    current_expression='I(BLoan_Balance)/I(BTotal_Liabilities)')
+        circuit.B('Return_on_Equity',        circuit.gnd, circuit.gnd,
+                    current_expression='I(LNII)/I(BTotal_Equity)')
+        circuit.B('Debt_to_Equity_Ratio',    circuit.gnd, circuit.gnd,
+                    current_expression='I(BTotal_Liabilities)/I(BTotal_Equity)')
     
-    circuit.B('Net_Stable_Funding_Ratio',circuit.gnd, circuit.gnd,
-                current_expression='(I(BTotal_Equity)+0.9*I(BCurrent_Account_Balance)'
-                                    '+0.9*I(BSavings_Account_Balance))'
-                                    '/(0*I(BCash_Reserves)+0.85*I(BLoan_Balance))') 
-    circuit.B('Liquidity_Coverage_Ratio',circuit.gnd, circuit.gnd,
-                current_expression='I(BCash_Reserves)/(0.1*I(BCurrent_Account_Balance)'
-                                    '+0.1*I(BSavings_Account_Balance))') 
-    circuit.B('Tier_1_Capital_Ratio',    circuit.gnd, circuit.gnd,
-                current_expression='I(BTotal_Equity)/I(BLoan_Balance)')
-    circuit.B('Return_on_Assets',        circuit.gnd, circuit.gnd,
-                current_expression='I(LNII)/I(BTotal_Assets)')
-    circuit.B('Net_Interest_Margin',     circuit.gnd, circuit.gnd,
-                current_expression='I(LNII)/I(BLoan_Balance)')
-    circuit.B('Average_Cost_of_Debt',    circuit.gnd, circuit.gnd,
-                current_expression='I(BInterest_Expense)/I(BTotal_Liabilities)')
+        circuit.B('Net_Stable_Funding_Ratio',circuit.gnd, circuit.gnd,
+                    current_expression='(I(BTotal_Equity)+0.9*I(BCurrent_Account_Balance)'
+                                        '+0.9*I(BSavings_Account_Balance))'
+                                        '/(0*I(BCash_Reserves)+0.85*I(BLoan_Balance))') 
+        circuit.B('Liquidity_Coverage_Ratio',circuit.gnd, circuit.gnd,
+                    current_expression='I(BCash_Reserves)/(0.1*I(BCurrent_Account_Balance)'
+                                        '+0.1*I(BSavings_Account_Balance))') 
+        circuit.B('Tier_1_Capital_Ratio',    circuit.gnd, circuit.gnd,
+                    current_expression='I(BTotal_Equity)/I(BLoan_Balance)')
+        circuit.B('Return_on_Assets',        circuit.gnd, circuit.gnd,
+                    current_expression='I(LNII)/I(BTotal_Assets)')
+        circuit.B('Net_Interest_Margin',     circuit.gnd, circuit.gnd,
+                    current_expression='I(LNII)/I(BLoan_Balance)')
+        circuit.B('Average_Cost_of_Debt',    circuit.gnd, circuit.gnd,
+                    current_expression='I(BInterest_Expense)/I(BTotal_Liabilities)')
 
     circuit.B('Target_Debt-to-Equity_Ratio',circuit.gnd, circuit.gnd,
                 current_expression='2')
@@ -386,7 +551,13 @@ def ALM(
                 current_expression='{IC_Goods} + I(BInvestment_output)*1/120')     
     
 
-    # if demand_shock:
+    if demand_shock:
+        circuit.PulseVoltageSource("Demand_input", "node_demand", circuit.gnd,
+            initial_value=0, pulsed_value=demand_shock_size,
+            delay_time=demand_shock_time@u_s, rise_time=1@u_ns,
+            fall_time=1@u_us, pulse_width=1e100@u_s, period=1@u_Ts)
+        circuit.B('Demand',                  'N013', circuit.gnd,
+                current_expression='V(node_demand)') # drains N013 next to LAggregate_Demand
 
     # ----------------------- Control --------------------------
     
@@ -418,7 +589,7 @@ def ALM(
     # Controllers
 
     if control_loan_desposit:
-        add_integrator(circuit, 'FTP_Err2', 'BFTP_Err2')
+        integrate(circuit, 'FTP_Err2', 'BFTP_Err2')
         add_differentiator(circuit, 'FTP_Err2', 'BFTP_Err2')
         circuit.B('FTP_Rate',                circuit.gnd, circuit.gnd, 
                 current_expression='0.025 - ({Kp}*I(BFTP_Err2) + {Ki}*I(BFTP_Err2_output) + {Kd}*I(BFTP_Err2_output_dt))') 
@@ -426,13 +597,13 @@ def ALM(
 
 
     if control_debt_equity:
-        add_integrator(circuit, 'Spread_Err2', 'BSpread_Err2')
+        integrate(circuit, 'Spread_Err2', 'BSpread_Err2')
         add_differentiator(circuit, 'Spread_Err2', 'BSpread_Err2')
         circuit.B('Spread',                  circuit.gnd, circuit.gnd,
                 current_expression='0.010 - ({Kp}*I(BSpread_Err2) + {Ki}*I(BSpread_Err2_output) + {Kd}*I(BSpread_Err2_output_dt))')
 
     if control_tier_1:
-        add_integrator(circuit, 'Spread_Err3', 'BSpread_Err3')
+        integrate(circuit, 'Spread_Err3', 'BSpread_Err3')
         add_differentiator(circuit, 'Spread_Err3', 'BSpread_Err3')
         circuit.B('Spread',                 circuit.gnd, circuit.gnd,
                 current_expression='0.005 + ({Kp}*I(BSpread_Err3) + {Ki}*I(BSpread_Err3_output) + {Kd}*I(BSpread_Err3_output_dt))')
@@ -449,12 +620,13 @@ def ALM(
 
     
 
-    if control_premium and use_time_delay == True:
+    # a preset FTP path already drives FTP_Rate, so the premium control only applies without one
+    if control_premium and not use_preset_FTP and use_time_delay == True:
         new_times = [t + time_delay for t in preset_T_times]
         steps(circuit, 'FTP', preset_T_rates, new_times)  # add time delay to preset times
         circuit.B('FTP_Rate',                circuit.gnd, circuit.gnd, 
                 current_expression='V(FTP_preset)')
-    elif control_premium:
+    elif control_premium and not use_preset_FTP:
         circuit.B('FTP_Rate',                circuit.gnd, circuit.gnd, 
                 current_expression='I(BT_rate)') 
         # circuit.B('Spread',                  circuit.gnd, circuit.gnd,
@@ -462,16 +634,58 @@ def ALM(
 
 
         
-    print(circuit)
+    with phase('print'):
+        print(circuit)
     return circuit 
 
 
-def run_transient(circuit, step_time=dt @ u_s, end_time=5000 @ u_s):
-    simulator = circuit.simulator()
-    return simulator.transient(step_time=dt, end_time=end_time, use_initial_condition=True)
-
-
+def run_transient(circuit, step_time=dt @ u_s, end_time=5000 @ u_s, backend='ngspice', cache=None, save=None,
+                  optimize=False, inline=False):
+    # backend='numpy' solves the same circuit in-process (see state_space.py)
+    # save: only record these vectors (e.g. DASHBOARD_VECTORS), None keeps everything
+    # optimize: merge duplicate signals and prune dead blocks first, in place (see netlist_optimizer.py)
+    # inline: fold the gnd-gnd signal sources into their readers and evaluate the rest after the run, in place
+    # with instrumentation.enable() the phase timings land on analysis.run_record (see instrumentation.py)
+    with running(circuit) as record:
+        analysis = _transient(circuit, step_time, end_time, backend, cache, save, optimize, inline)
+    return attach(analysis, record)
+
+def _transient(circuit, step_time, end_time, backend, cache, save, optimize=False, inline=False):
+    if optimize or inline:
+        with phase('optimize'):
+            aliases = optimize_circuit(circuit, keep=save) if optimize else {}
+        save = sorted({aliases.get(name.lower(), name) for name in save}) if save else save
+        with phase('inline'):
+            derived = inline_signals(circuit, keep=save) if inline else None
+        if derived is not None and save:
+            computed = {vector for vector, _ in derived.definitions}
+            save = sorted({name for name in save if name.lower() not in computed} | derived.inputs)
+        analysis = _transient(circuit, step_time, end_time, backend, cache, save)
+        if derived is not None:
+            with phase('derive'):
+                analysis = derived.evaluate(analysis)
+        return with_aliases(analysis, aliases)
+
+    simulated = []
+    def run():
+        simulated.append(True)
+        if backend == 'numpy':
+            return run_state_space(circuit, step_time=dt, end_time=end_time, save=save)
+        return pooled_transient(circuit, step_time=dt, end_time=end_time, use_initial_condition=True, save=save)
+
+    # cache=default_cache (result_cache.py) reuses the stored result of an identical netlist + .tran settings;
+    # a hit is a StateSpaceAnalysis, not a PySpice analysis. The default None always simulates
+    if cache is None:
+        return run()
+    analysis = cache.fetch(circuit, run, backend=backend, step_time=float(dt), end_time=float(end_time),
+                           use_initial_condition=True, save=sorted(save) if save else None)
+    add_stats(cached=not simulated)
+    return analysis
+
+
+@phase('plot')
 def plotting(circuit, analysis, plot_1 = 'v_btarget_debt-to-equity_ratio', plot_2 ='v_bdebt_to_equity_ratio1', plot_3 ='v_bspread'):
+    import matplotlib.pyplot as plt  # only when plotting: keeps ALM()/run_transient() workers light
     time = analysis.time
     #plot_1 = 'v_btarget_loan-to-deposit_ratio', plot_2 ='v_bloan-to-deposit_ratio1', plot_3 ='BIncentive_to_Borrow'
     plot_1_output = analysis[plot_1]
@@ -552,7 +766,7 @@ def plotting(circuit, analysis, plot_1 = 'v_btarget_debt-to-equity_ratio', plot_
         plt.tight_layout()
         plt.show()
 
-def plot_control_with_zoh(time, u_continuous, Ts):
+def plot_control_with_zoh(time, u_continuous, Ts, max_deviation=None):
     """
     Plot continuous control signal and its ZOH discrete approximation.
     
@@ -560,9 +774,11 @@ def plot_control_with_zoh(time, u_continuous, Ts):
         time (np.ndarray): time stamps of continuous signal [s]
         u_continuous (np.ndarray): continuous control signal values
         Ts (float): sampling period [s]
+        max_deviation (float): segmentation mode of recommend_discrete()
     """
+    import matplotlib.pyplot as plt
     # Get discrete ZOH approximation
-    rates, times_zoh = recommend_discrete(time, u_continuous, Ts)
+    rates, times_zoh = recommend_discrete(time, u_continuous, Ts, max_deviation=max_deviation)
 
     
     # Build step plot arrays
@@ -580,22 +796,56 @@ def plot_control_with_zoh(time, u_continuous, Ts):
     plt.grid(True)
     plt.show()
 
-def run_recommend_discrete(time, u_continuous, Ts):
-    rates, times_zoh = recommend_discrete(time, u_continuous, Ts)
+def run_preset_ftp(rates, times, backend='ngspice', save=None):
+    circuit = ALM(use_preset_FTP=True, preset_FTP_rates=rates, preset_FTP_times=times,
+                  control_loan_desposit=False)
+    return run_transient(circuit, backend=backend, save=save)
+
+
+def recommend_discrete_kpi(time, u_continuous, Ts, kpi, max_kpi_change, simulate=run_preset_ftp,
+                           iterations=10, tol=1e-6):
+    """
+    Fewest-step ZOH schedule whose KPI stays within max_kpi_change of the full one's.
+
+    kpi is a kpi_value() spec such as 'max:v_bspread' (see sweep.py) and
+    simulate(rates, times) returns the analysis of a schedule. The
+    max_deviation of recommend_discrete() is bisected, one simulation per
+    iteration; the full tol-based schedule is the reference.
+    """
+    best = recommend_discrete(time, u_continuous, Ts, tol)
+    reference = kpi_value(simulate(*best), kpi)
+    low, high = 0.0, (np.max(u_continuous) - np.min(u_continuous)) / 2
+    for _ in range(iterations):
+        middle = (low + high) / 2
+        schedule = recommend_discrete(time, u_continuous, Ts, max_deviation=middle)
+        if abs(kpi_value(simulate(*schedule), kpi) - reference) <= max_kpi_change:
+            low = middle
+            if len(schedule[0]) <= len(best[0]):
+                best = schedule
+        else:
+            high = middle
+    return best
+
+
+def run_recommend_discrete(time, u_continuous, Ts, max_deviation=None):
+    rates, times_zoh = recommend_discrete(time, u_continuous, Ts, max_deviation=max_deviation)
     print(f"ZOH rates: {rates}")
     print(f"ZOH times: {times_zoh}")
     circuit = ALM(use_preset_FTP=True, preset_FTP_rates = rates, preset_FTP_times= times_zoh, control_loan_desposit=False)
-    analysis = run_transient(circuit)
+    analysis = run_transient(circuit, save=DASHBOARD_VECTORS)
     plotting(circuit, analysis)
 
 
 def main():
+    from PySpice.Logging.Logging import setup_logging
     configure_environment()
     setup_logging()
 
     circuit = ALM()
 
-    analysis = run_transient(circuit)
+    analysis = run_transient(circuit, save=DASHBOARD_VECTORS)
+    if save_results:
+        analysis = ResultStore('results').save(analysis)
 
     plotting(circuit, analysis)
 
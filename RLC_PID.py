@@ -3,11 +3,9 @@
 Modular PySpice simulation runner with plotting and easy circuit registration.
 """
 import os
-import argparse
-import matplotlib.pyplot as plt
 from PySpice.Logging.Logging import setup_logging
 from PySpice.Spice.Netlist import Circuit
-from PySpice.Unit import *
+from PySpice.Unit import u_F, u_H, u_Ω, u_V, u_s, u_ms, u_us, u_ns, u_Ts
 
 # Ensure ngspice is on the PATH and set as simulator
 
@@ -97,6 +95,7 @@ def plot_node_voltage(circuit, analysis, node_control='input_c',node_controlled=
     voltage_control = analysis[node_control]
     voltage_controlled = analysis[node_controlled]
     voltage_error = analysis[node_error]
+    import matplotlib.pyplot as plt
     plt.figure()
     plt.plot(time, voltage_control, label = "Controller Output", zorder = 5)
     plt.plot(time, voltage_controlled, label = "System Output (Capacitor)", zorder = 10)
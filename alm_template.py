@@ -0,0 +1,189 @@
+"""
+Compiled ALM netlist templates: build the topology once, rebind values per run.
+
+Most ALM() kwargs only change numbers in an otherwise identical netlist:
+the .param values (Kp, Ki, q_L0, ...) and the stimulus waveforms (shock
+pulses, preset rate paths, constant_T_rate). Everything else -- the flags,
+and whether a preset has times at all -- decides the topology. An ALMTemplate
+builds ALM() once per topology and keeps the full deck as a list of lines;
+a run rebinds the values on the existing elements and re-renders only the
+.param lines and the handful of stimulus elements before loading the deck.
+
+    results = [template_transient(Kp=kp) for kp in (0.005, 0.015, 0.03)]
+"""
+import contextlib
+import inspect
+import io
+
+from PySpice.Spice.Simulation import CircuitSimulation
+from PySpice.Unit import u_V, u_s
+
+from BEP_alm_v12 import ALM, dt, step_pulses
+from instrumentation import add_stats, current, ngspice_statistics, phase
+from ngspice_pool import default_pool, set_save
+from rate_path import pwl_values
+from state_space import run_state_space
+
+PARAMETERS = ('Kp', 'Ki', 'Kd', 'tau_d', 'q_L0', 'q_C0', 'q_S0', 'q_E0', 'IC_Goods', 'IC_Income')
+
+WAVEFORMS = (
+    'rate_shock_size', 'rate_shock_time', 'production_shock_size', 'production_shock_time',
+    'demand_shock_size', 'demand_shock_time',
+    'constant_T_rate', 'time_delay',
+    'preset_T_rates', 'preset_T_times', 'preset_FTP_rates', 'preset_FTP_times',
+    'preset_spread', 'preset_spread_times',
+)
+
+DEFAULTS = {name: parameter.default for name, parameter in inspect.signature(ALM).parameters.items()}
+
+
+def structure_key(kwargs):
+    """What decides the topology: every flag, plus which preset lists are None."""
+    values = {**DEFAULTS, **kwargs}
+    key = []
+    for name in sorted(values):
+        value = values[name]
+        if name in PARAMETERS:
+            continue
+        if name in WAVEFORMS:
+            if value is None or isinstance(value, (list, tuple)):
+                key.append((name, value is None))
+            continue
+        key.append((name, repr(value)))
+    return tuple(key)
+
+
+class ALMTemplate:
+    """One ALM() topology whose parameters and stimuli are rebound in place."""
+
+    def __init__(self, **kwargs):
+        self.key = structure_key(kwargs)
+        # what a bind() without flags falls back to: the flags and which presets are None
+        self._structure = {name: value for name, value in kwargs.items()
+                           if name not in PARAMETERS and (name not in WAVEFORMS or value is None)}
+        with contextlib.redirect_stdout(io.StringIO()):  # ALM() prints its netlist
+            self.circuit = ALM(**kwargs)
+        self._decks = {}
+        self._stimuli = []
+        self.bind(**kwargs)
+
+    def bind(self, **kwargs):
+        """
+        Sets the circuit to ALM(**kwargs); flags must match the template.
+
+        Every call starts from the ALM() defaults, so nothing an earlier run
+        set carries over to the next one.
+        """
+        values = {**DEFAULTS, **self._structure, **kwargs}
+        if structure_key(values) != self.key:
+            raise ValueError('kwargs change the ALM topology; build another ALMTemplate')
+        self.values = values
+        for name in PARAMETERS:
+            self.circuit.parameter(name, values[name])
+
+        self._stimuli = []
+        if values['Trate_shock']:
+            self._set('VT_rate_input', pulsed_value=values['rate_shock_size']@u_V,
+                      delay_time=values['rate_shock_time']@u_s)
+        if values['use_preset_Trate']:
+            self._steps('Trate', values['preset_T_rates'], values['preset_T_times'])
+        else:
+            self._set('BT_rate', current_expression=f"V(t_rate_shock)+{values['constant_T_rate']}")
+        if values['production_shock']:
+            self._set('VProduction_input', pulsed_value=values['production_shock_size']@u_V,
+                      delay_time=values['production_shock_time']@u_s)
+        if values['demand_shock']:
+            self._set('VDemand_input', pulsed_value=values['demand_shock_size']@u_V,
+                      delay_time=values['demand_shock_time']@u_s)
+        if values['use_preset_FTP']:
+            self._steps('FTP', values['preset_FTP_rates'], values['preset_FTP_times'])
+        if values['use_preset_spread']:
+            self._steps('Spread', values['preset_spread'], values['preset_spread_times'])
+        if values['control_premium'] and not values['use_preset_FTP'] and values['use_time_delay'] == True:
+            new_times = [t + values['time_delay'] for t in values['preset_T_times']]
+            self._steps('FTP', values['preset_T_rates'], new_times)
+        return self.circuit
+
+    def _set(self, element_name, **attributes):
+        element = self.circuit[element_name]
+        for name, value in attributes.items():
+            setattr(element, name, value)
+        self._stimuli.append(element_name)
+
+    def _steps(self, name, rates, times):
+        # same PWL path as steps() in BEP_alm_v12.py; any number of steps fits the same element
+        values = pwl_values(step_pulses(rates, times), ramp=dt)
+        self._set(f'V{name}_path', values=[value for corner in values for value in corner])
+
+    def _deck(self, ngspice, step_time, end_time, save=None):
+        settings = (float(step_time), float(end_time), tuple(save or ()))
+        if settings not in self._decks:
+            simulator = self.circuit.simulator(simulator='ngspice-shared', ngspice_shared=ngspice)
+            if save:
+                set_save(simulator, self.circuit, save)
+            CircuitSimulation.transient(simulator, step_time=step_time, end_time=end_time,
+                                        use_initial_condition=True)
+            lines = str(simulator).splitlines()
+            index = {}
+            for number, line in enumerate(lines):
+                if line.startswith('.param '):
+                    index[line[7:].split('=', 1)[0]] = number
+                elif line and not line.startswith(('.', '+', '*')):
+                    index.setdefault(line.split(' ', 1)[0], number)
+            self._decks[settings] = simulator, lines, index
+        return self._decks[settings]
+
+    def netlist(self, ngspice, step_time, end_time, save=None):
+        """(simulator, deck text) for the current values; only .param and stimulus lines are re-rendered."""
+        simulator, lines, index = self._deck(ngspice, step_time, end_time, save)
+        lines = list(lines)
+        for name in PARAMETERS:
+            lines[index[name]] = f'.param {name}={self.circuit._parameters[name]}'
+        for name in self._stimuli:
+            lines[index[name]] = str(self.circuit[name])
+        return simulator, '\n'.join(lines) + '\n'
+
+    def transient(self, step_time=dt, end_time=5000, backend='ngspice', pool=None,
+                  cache=None, save=None, **kwargs):
+        """run_transient() for these kwargs without rebuilding the circuit."""
+        self.bind(**kwargs)
+        # keyed exactly like run_transient(), so both find each other's results
+        settings = dict(backend=backend, step_time=float(step_time), end_time=float(end_time),
+                        use_initial_condition=True, save=sorted(save) if save else None)
+        if backend == 'numpy':
+            run = lambda: run_state_space(self.circuit, step_time=step_time, end_time=end_time, save=save)
+            return run() if cache is None else cache.fetch(self.circuit, run, **settings)
+
+        def run():
+            with (pool or default_pool).session() as ngspice:
+                with phase('netlist'):
+                    simulator, text = self.netlist(ngspice, step_time, end_time, save)
+                ngspice.destroy()
+                with phase('load'):
+                    ngspice.load_circuit(text)
+                with phase('transient'):
+                    ngspice.run()
+                if ngspice.last_plot == 'const':
+                    raise NameError('Simulation failed')
+                if current() is not None:
+                    add_stats(**ngspice_statistics(ngspice))
+                with phase('read'):
+                    return ngspice.plot(simulator, ngspice.last_plot).to_analysis()
+
+        return run() if cache is None else cache.fetch(self.circuit, run, **settings)
+
+
+_templates = {}
+
+
+def template(**kwargs):
+    """The per-process ALMTemplate for the topology these kwargs select."""
+    key = structure_key(kwargs)
+    if key not in _templates:
+        _templates[key] = ALMTemplate(**kwargs)
+    return _templates[key]
+
+
+def template_transient(step_time=dt, end_time=5000, backend='ngspice', save=None, **kwargs):
+    """ALM(**kwargs) + run_transient(), compiled once per topology."""
+    return template(**kwargs).transient(step_time, end_time, backend=backend, save=save, **kwargs)
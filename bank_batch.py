@@ -0,0 +1,206 @@
+#!/usr/bin/env python3
+"""
+Many ALM scenarios in one netlist, solved in one run.
+
+add_bank() copies a built ALM() into a shared batch circuit as one
+instance: every element, node and .param gets the instance tag as a
+prefix ('BLoan_Balance' -> 'Bx1_Loan_Balance', 'N005' -> 'x1_N005',
+{Kp} -> {x1_Kp}) and every I()/V()/{param} reference is rewritten to
+match, which is what ngspice does when it expands an X line of a .subckt.
+The expansion is done here rather than by ngspice so that the state-space
+backend, which has no .subckt support, solves the same deck, and so that
+per-instance .param values do not collide with the global ones
+alm_template.py rebinds. Instances may differ in parameters, rate paths
+and even flags. BankBatch.split() turns the batch result back into one
+analysis per instance under the usual vector names.
+
+    batch = BankBatch([dict(Kp=kp) for kp in (0.005, 0.015, 0.03)])
+    analyses = batch.run(end_time=1000, save=DASHBOARD_VECTORS)
+"""
+import argparse
+import contextlib
+import io
+import re
+import time
+
+import numpy as np
+from PySpice.Spice.Netlist import Circuit
+from PySpice.Unit import u_s
+
+from BEP_alm_v12 import ALM, DASHBOARD_VECTORS, run_transient
+from netlist_optimizer import _raw_statements
+from state_space import StateSpaceAnalysis
+
+_REFERENCE = re.compile(r'([IiVv])\s*\(\s*([^,()\s]+)\s*(?:,\s*([^,()\s]+)\s*)?\)')
+_PARAMETER = re.compile(r'\{\s*([A-Za-z_]\w*)\s*\}')
+
+
+class Instance:
+    """The renaming of one ALM() copied into a batch under `tag`."""
+
+    def __init__(self, tag, gnd):
+        self.tag = tag
+        self.gnd = str(gnd)
+
+    def element(self, name):
+        separator = '' if name[1:2] == '_' else '_'      # 'A_Loans' -> 'Ax1_Loans'
+        return f'{name[0]}{self.tag}{separator}{name[1:]}'
+
+    def node(self, name):
+        name = str(name)
+        return name if name == self.gnd else f'{self.tag}_{name}'
+
+    def expression(self, expression):
+        def reference(match):
+            kind, first, second = match.groups()
+            if kind in 'Ii':
+                return f'{kind}({self.element(first)})'
+            if second is not None:
+                return f'{kind}({self.node(first)},{self.node(second)})'
+            return f'{kind}({self.node(first)})'
+        expression = _REFERENCE.sub(reference, str(expression))
+        return _PARAMETER.sub(lambda match: '{' + f'{self.tag}_{match.group(1)}' + '}', expression)
+
+    def raw_spice(self, statement):
+        """A raw SPICE device line (A device or its load) of the instance."""
+        tokens = statement.split()
+        if tokens and statement[:1].lower() in ('a', 'r'):
+            statement = ' '.join([self.element(tokens[0])] + [self.node(node) for node in tokens[1:3]] + tokens[3:])
+        return self.expression(statement)
+
+    def vector(self, name):
+        """Batch name of one of the instance's vectors ('v_bspread' -> 'v_bx1_spread')."""
+        name = name.lower()
+        if name.startswith('v_'):
+            return 'v_' + self.element(name[2:])
+        return self.element(name)
+
+    def own(self, name, node=False):
+        """Instance name of a batch vector or node, None when it belongs to another instance."""
+        prefix = self.tag + '_'
+        if node:
+            return name[len(prefix):] if name.startswith(prefix) else None
+        if name.startswith('v_'):
+            own = self.own(name[2:])
+            return None if own is None else 'v_' + own
+        return name[0] + name[1 + len(prefix):] if name[1:].startswith(prefix) else None
+
+
+# element class -> (Circuit method that builds it, the keyword arguments it is rebuilt from)
+_CONSTRUCTORS = {
+    'Resistor': ('R', ('resistance',)),
+    'Capacitor': ('C', ('capacitance', 'initial_condition')),
+    'Inductor': ('L', ('inductance', 'initial_condition')),
+    'BehavioralSource': ('B', ('current_expression', 'voltage_expression')),
+    'VoltageSource': ('V', ('dc_value',)),
+    'PulseVoltageSource': ('PulseVoltageSource', ('initial_value', 'pulsed_value', 'pulse_width', 'period',
+                                                  'delay_time', 'rise_time', 'fall_time', 'phase', 'dc_offset')),
+    'PieceWiseLinearVoltageSource': ('PieceWiseLinearVoltageSource', ('values', 'repeat_time', 'delay_time', 'dc')),
+}
+
+
+def _copy_element(element, netlist, instance):
+    """Rebuilds `element` in `netlist` as part of `instance` through the public Circuit constructors."""
+    kind = type(element).__name__
+    if kind not in _CONSTRUCTORS:
+        raise NotImplementedError(f'{element.name}: a {kind} cannot be copied into a batch')
+    method, names = _CONSTRUCTORS[kind]
+    values = {name: getattr(element, name) for name in names if getattr(element, name, None) is not None}
+    if 'values' in values:      # PWL keeps its (time, value) pairs flattened
+        values['values'] = list(zip(values['values'][0::2], values['values'][1::2]))
+    for name in ('current_expression', 'voltage_expression'):
+        if name in values:
+            values[name] = instance.expression(values[name])
+    if element.raw_spice:
+        values['raw_spice'] = instance.expression(element.raw_spice)
+    nodes = [instance.node(node) for node in element.node_names]
+    return getattr(netlist, method)(instance.element(element.name)[1:], *nodes, **values)
+
+
+def add_bank(batch, tag, circuit):
+    """Copies a built ALM() circuit into `batch` as instance `tag`; returns its Instance."""
+    instance = Instance(tag, circuit.gnd)
+    for name, value in circuit._parameters.items():
+        batch.parameter(f'{tag}_{name}', instance.expression(value))
+    for element in circuit.elements:
+        if type(element).__name__ == 'CoupledInductor':   # its "nodes" are the two inductors
+            batch.CoupledInductor(instance.element(element.name)[1:], instance.element(element.inductor1),
+                                  instance.element(element.inductor2), element.coupling_factor)
+        else:
+            _copy_element(element, batch, instance)
+    for kind, name, _, _, text in _raw_statements(circuit.raw_spice):
+        card = '\n'.join(text)
+        if kind == 'model':
+            if card not in batch.raw_spice:     # one card for every instance
+                batch.raw_spice += card + '\n'
+        else:
+            batch.raw_spice += instance.raw_spice(card) + '\n'
+    return instance
+
+
+class BankBatch:
+    """N ALM() scenarios as instances 'x0', 'x1', ... of one batch circuit."""
+
+    def __init__(self, scenarios, title='ALM batch'):
+        self.circuit = Circuit(title)
+        self.instances = {}
+        for k, kwargs in enumerate(scenarios):
+            with contextlib.redirect_stdout(io.StringIO()):  # ALM() prints its netlist
+                circuit = ALM(**kwargs)
+            self.instances[f'x{k}'] = add_bank(self.circuit, f'x{k}', circuit)
+
+    def save(self, vectors):
+        """The .save list that records `vectors` of every instance."""
+        return [instance.vector(name) for instance in self.instances.values() for name in vectors]
+
+    def split(self, analysis):
+        """{tag: analysis of that instance under the usual vector names}."""
+        analyses = {}
+        for tag, instance in self.instances.items():
+            nodes, branches = {}, {}
+            for source, target, node in (analysis.nodes, nodes, True), (analysis.branches, branches, False):
+                for name, values in source.items():
+                    own = instance.own(str(name).lower(), node)
+                    if own is not None:
+                        target[own] = np.asarray(values)
+            analyses[tag] = StateSpaceAnalysis(np.asarray(analysis.time), nodes, branches)
+        return analyses
+
+    def run(self, end_time=5000, backend='ngspice', save=None, cache=None):
+        """One run_transient() of the whole batch, split per instance."""
+        analysis = run_transient(self.circuit, end_time=end_time @ u_s, backend=backend, cache=cache,
+                                 save=self.save(save) if save else None)
+        return self.split(analysis)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='One batch solve against one solve per scenario.')
+    parser.add_argument('--backend', default='numpy', choices=['numpy', 'ngspice'])
+    parser.add_argument('--scenarios', type=int, default=4)
+    parser.add_argument('--end-time', type=float, default=1000)
+    args = parser.parse_args()
+    scenarios = [dict(Kp=kp) for kp in np.linspace(0.005, 0.03, args.scenarios)]
+
+    start = time.perf_counter()
+    batch = BankBatch(scenarios)
+    together = batch.run(end_time=args.end_time, backend=args.backend, save=DASHBOARD_VECTORS)
+    batched = time.perf_counter() - start
+
+    start = time.perf_counter()
+    apart = []
+    for kwargs in scenarios:
+        with contextlib.redirect_stdout(io.StringIO()):
+            circuit = ALM(**kwargs)
+        apart.append(run_transient(circuit, end_time=args.end_time @ u_s, backend=args.backend, cache=None,
+                                   save=DASHBOARD_VECTORS))
+    separate = time.perf_counter() - start
+
+    deviation = max(float(np.max(np.abs(np.interp(analysis.time, together[f'x{k}'].time, together[f'x{k}'][name])
+                                        - np.asarray(analysis[name]))))
+                    for k, analysis in enumerate(apart) for name in DASHBOARD_VECTORS)
+    print(f'{args.scenarios} scenarios, {args.backend}: batch {batched:.3f} s, separate {separate:.3f} s, '
+          f'max deviation {deviation:.2e}')
+
+
+if __name__ == '__main__':
+    main()
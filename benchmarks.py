@@ -0,0 +1,273 @@
+#!/usr/bin/env python3
+"""
+Benchmark suite: model build, netlist, transient, post-processing, plotting.
+
+Every case runs in a fresh process, so its peak RSS is its own: the case's
+setup runs once, then its body is timed `repeat` times and the best and
+mean wall times are kept. One run of the suite is appended as a JSON line
+to benchmarks/results.jsonl together with the commit it measured, and
+compared with the last run recorded for another commit; cases that got
+slower by more than --threshold are listed. A case that fails (e.g. the
+ngspice ones without libngspice) is recorded with its error and the suite
+goes on. Plots use the Agg backend.
+
+The startup.* cases time a cold `python -c "import <module>"` of the
+modules sweep and batch workers load, and fail if that import pulls in
+matplotlib or SciPy; every start-up slower than STARTUP_BUDGET seconds is
+reported at the end and makes the suite exit non-zero.
+
+    python benchmarks.py                       # everything, 3 repeats
+    python benchmarks.py --filter BEP_alm_v12 --repeat 5
+    python benchmarks.py --list
+"""
+import os
+
+os.environ.setdefault('MPLBACKEND', 'Agg')   # before anything imports pyplot
+
+import argparse
+import concurrent.futures
+import contextlib
+import importlib
+import io
+import json
+import multiprocessing
+import platform
+import resource
+import subprocess
+import sys
+import time
+
+import numpy as np
+
+VARIANTS = ('ALM', 'BEP_alm_v4', 'BEP_alm_v10', 'BEP_alm_v11', 'BEP_alm_v12', 'complete_alm', 'working_alm')
+END_TIMES = (500, 2000, 5000)
+STEP_TIMES = (0.1, 0.5)
+STARTUP_MODULES = ('BEP_alm_v12', 'state_space', 'sweep', 'bank_batch', 'alm_template', 'run_scenarios')
+STARTUP_BUDGET = 0.5        # seconds for a cold import, interpreter start included
+LAZY_MODULES = ('matplotlib', 'scipy')
+
+
+def _quiet():
+    return contextlib.redirect_stdout(io.StringIO())
+
+
+def _build(variant):
+    module = importlib.import_module(variant)
+
+    def build():
+        with _quiet():          # ALM() prints its netlist
+            module.ALM()
+    return build
+
+
+def _netlist(variant):
+    module = importlib.import_module(variant)
+    with _quiet():
+        circuit = module.ALM()
+    return lambda: str(circuit)
+
+
+def _transient(variant):
+    # each variant's own run_transient() and default .tran settings (ngspice)
+    module = importlib.import_module(variant)
+    with _quiet():
+        circuit = module.ALM()
+    return lambda: module.run_transient(circuit)
+
+
+def _transient_numpy(variant):
+    from state_space import run_state_space
+    module = importlib.import_module(variant)
+    with _quiet():
+        circuit = module.ALM()
+    return lambda: run_state_space(circuit, step_time=0.1, end_time=300)
+
+
+def _v12_transient(backend, end_time, step_time):
+    import BEP_alm_v12
+    from PySpice.Unit import u_s
+    BEP_alm_v12.dt = step_time       # run_transient() steps at the module's dt
+    with _quiet():
+        circuit = BEP_alm_v12.ALM(dt=step_time)
+    return lambda: BEP_alm_v12.run_transient(circuit, end_time=end_time @ u_s, backend=backend, cache=None)
+
+
+def _control_trace():
+    time = np.arange(0, 5000, 0.1)
+    return time, 0.01 + 0.005 * np.tanh((time - 1500) / 200) + 0.001 * np.sin(time / 50)
+
+
+def _recommend_discrete():
+    from BEP_alm_v12 import recommend_discrete
+    time, u = _control_trace()
+    return lambda: recommend_discrete(time, u, Ts=10)
+
+
+def _recommend_discrete_batch():
+    from BEP_alm_v12 import recommend_discrete_batch
+    time, u = _control_trace()
+    traces = np.stack([u * scale for scale in np.linspace(0.5, 1.5, 16)])
+    return lambda: recommend_discrete_batch(time, traces, [1, 5, 10, 50])
+
+
+def _forloop(module_name, function):
+    module = importlib.import_module(module_name)
+
+    def run():
+        with _quiet():
+            getattr(module, function)()
+    return run
+
+
+def _startup(module):
+    check = (f'import sys, {module}; '
+             f'loaded = [name for name in {LAZY_MODULES!r} if name in sys.modules]; '
+             f'sys.exit(f"import {module} loaded {{loaded}}" if loaded else 0)')
+
+    def run():
+        process = subprocess.run([sys.executable, '-c', check], capture_output=True, text=True,
+                                 env={**os.environ, 'MPLBACKEND': 'Agg'})
+        if process.returncode:
+            raise RuntimeError(process.stderr.strip().splitlines()[-1])
+    return run
+
+
+def _plotting():
+    import matplotlib.pyplot as plt
+    import BEP_alm_v12
+    from PySpice.Unit import u_s
+    with _quiet():
+        circuit = BEP_alm_v12.ALM()
+    analysis = BEP_alm_v12.run_transient(circuit, end_time=500 @ u_s, backend='numpy', cache=None)
+
+    def run():
+        with _quiet():
+            BEP_alm_v12.plotting(circuit, analysis)
+        plt.close('all')
+    return run
+
+
+def cases():
+    """{case name: (setup function, args)}; setup returns the callable to time."""
+    table = {f'startup.{module}': (_startup, (module,)) for module in STARTUP_MODULES}
+    for variant in VARIANTS:
+        table[f'{variant}.build'] = (_build, (variant,))
+        table[f'{variant}.netlist'] = (_netlist, (variant,))
+        table[f'{variant}.transient'] = (_transient, (variant,))
+        table[f'{variant}.transient_numpy'] = (_transient_numpy, (variant,))
+    for backend in ('numpy', 'ngspice'):
+        for end_time in END_TIMES:
+            for step_time in STEP_TIMES:
+                name = f'BEP_alm_v12.run_transient[{backend},end={end_time},dt={step_time}]'
+                table[name] = (_v12_transient, (backend, end_time, step_time))
+    table['BEP_alm_v12.recommend_discrete'] = (_recommend_discrete, ())
+    table['BEP_alm_v12.recommend_discrete_batch'] = (_recommend_discrete_batch, ())
+    table['BEP_alm_v12.plotting'] = (_plotting, ())
+    for module_name in ('numerical_RLC_PID', 'discrete_inductor'):
+        for function in ('forloop', 'forloop_cosim'):
+            table[f'{module_name}.{function}'] = (_forloop, (module_name, function))
+    return table
+
+
+def _measure(name, repeat):
+    # Runs in a fresh worker process per case.
+    setup, args = cases()[name]
+    row = {'best': None, 'mean': None, 'error': None}
+    try:
+        body = setup(*args)
+        times = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            body()
+            times.append(time.perf_counter() - start)
+        row['best'], row['mean'] = min(times), sum(times) / len(times)
+    except Exception as error:
+        row['error'] = f'{type(error).__name__}: {error}'
+    row['peak_rss_mb'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    return row
+
+
+def commit():
+    """(commit hash, whether the tree has uncommitted changes), or (None, None) outside git."""
+    try:
+        head = subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, check=True).stdout.strip()
+        dirty = subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'],
+                               capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None, None
+    return head, bool(dirty)
+
+
+def run_suite(names, repeat=3):
+    """{case: {'best', 'mean', 'peak_rss_mb', 'error'}}, one fresh process per case."""
+    results = {}
+    context = multiprocessing.get_context('spawn')
+    for name in names:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=1, mp_context=context) as pool:
+            results[name] = pool.submit(_measure, name, repeat).result()
+    return results
+
+
+def load_runs(path):
+    if not os.path.exists(path):
+        return []
+    with open(path) as handle:
+        return [json.loads(line) for line in handle if line.strip()]
+
+
+def regressions(previous, results, threshold):
+    """[(case, before, after)] for cases whose best time grew by more than `threshold` (0.2 = 20 %)."""
+    slower = []
+    for name, row in results.items():
+        before = previous['results'].get(name, {}).get('best')
+        if before and row['best'] and row['best'] > before * (1 + threshold):
+            slower.append((name, before, row['best']))
+    return slower
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--filter', default='', help='only cases whose name contains this')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--output', default=os.path.join('benchmarks', 'results.jsonl'))
+    parser.add_argument('--threshold', type=float, default=0.2)
+    parser.add_argument('--list', action='store_true')
+    args = parser.parse_args()
+
+    names = [name for name in cases() if args.filter in name]
+    if args.list:
+        print('\n'.join(names))
+        return 0
+    head, dirty = commit()
+    results = run_suite(names, args.repeat)
+    record = {'commit': head, 'dirty': dirty, 'date': time.strftime('%Y-%m-%dT%H:%M:%S'),
+              'python': platform.python_version(), 'machine': platform.machine(),
+              'repeat': args.repeat, 'results': results}
+
+    print(f"{'case':<58} {'best s':>9} {'mean s':>9} {'peak MB':>8}")
+    for name, row in results.items():
+        if row['error']:
+            print(f"{name:<58} {'failed':>9} {'':>9} {row['peak_rss_mb']:>8.1f}  {row['error'][:60]}")
+        else:
+            print(f"{name:<58} {row['best']:>9.4f} {row['mean']:>9.4f} {row['peak_rss_mb']:>8.1f}")
+
+    previous = [run for run in load_runs(args.output) if run['commit'] != head]
+    if previous:
+        slower = regressions(previous[-1], results, args.threshold)
+        print(f"\n{len(slower)} regression(s) against {str(previous[-1]['commit'])[:10]}")
+        for name, before, after in slower:
+            print(f'  {name}: {before:.4f} s -> {after:.4f} s')
+
+    os.makedirs(os.path.dirname(args.output) or '.', exist_ok=True)
+    with open(args.output, 'a') as handle:
+        handle.write(json.dumps(record) + '\n')
+
+    over = [(name, row['best']) for name, row in results.items()
+            if name.startswith('startup.') and (row['error'] or row['best'] > STARTUP_BUDGET)]
+    for name, best in over:
+        print(f"{name}: {'failed' if best is None else f'{best:.3f} s'}, start-up budget is {STARTUP_BUDGET} s")
+    return 1 if over else 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -0,0 +1,97 @@
+"""
+Step-and-resume co-simulation on a single ngspice session.
+
+The circuit is loaded once with a .tran over the whole horizon. A stop
+breakpoint at every control boundary halts ngspice; the controller reads
+the samples of the step just finished, alters its source values and the
+run resumes from where it stopped. Capacitor voltages and inductor
+currents carry over inside the simulator, so nothing is rebuilt and no
+state is passed back through initial_condition / IC= between steps.
+"""
+import numpy as np
+from PySpice.Spice.Simulation import CircuitSimulation
+
+from ngspice_pool import default_pool
+
+
+class CoSimulation:
+    """
+    Drives `circuit` in control steps of `step_size` seconds up to `end_time`.
+
+    `probes` lists node names and element names (for branch currents, e.g.
+    'L1'); advance() returns the new samples of those plus 'time'.
+    """
+
+    def __init__(self, circuit, step_size, end_time, probes, points_per_step=100,
+                 initial_condition=None, pool=None):
+        self.step_size = float(step_size)
+        self.end_time = float(end_time)
+        self.time = 0.0
+        elements = {element.name.lower() for element in circuit.elements}
+        self._vectors = {'time': 'time'}
+        for probe in probes:
+            name = probe.lower()
+            self._vectors[probe] = f'{name}#branch' if name in elements else name
+        self._read = 0
+        self._started = False
+
+        self._session = (pool or default_pool).session()
+        self.ngspice = self._session.__enter__()
+        try:
+            simulator = circuit.simulator(simulator='ngspice-shared', ngspice_shared=self.ngspice)
+            if initial_condition:
+                simulator.initial_condition(**initial_condition)
+            step_time = self.step_size / points_per_step
+            # Only the analysis is added here; simulator.transient() would also run it.
+            CircuitSimulation.transient(simulator, step_time=step_time, end_time=self.end_time,
+                                        max_time=step_time, use_initial_condition=True)
+            self.ngspice.load_circuit(str(simulator))
+        except BaseException:
+            self.close()
+            raise
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        """Hands the session back to the pool."""
+        if self._session is not None:
+            self._session.__exit__(None, None, None)
+            self._session = None
+
+    @property
+    def done(self):
+        return self.time >= self.end_time
+
+    def alter(self, device, **kwargs):
+        """Changes device parameters for the following steps, e.g. alter('V5', dc=0.3)."""
+        self.ngspice.alter_device(device, **kwargs)
+
+    def advance(self):
+        """Runs to the next control boundary and returns the samples of that step."""
+        target = min(self.time + self.step_size, self.end_time)
+        if self._started:
+            self.ngspice.exec_command('delete all')
+        if target < self.end_time:
+            self.ngspice.stop(f'time >= {target!r}')
+        if self._started:
+            self.ngspice.resume(background=False)
+        else:
+            self.ngspice.run()
+            self._started = True
+        self.time = target
+
+        # NgSpiceShared.plot() copies the whole plot so far; only the new samples are kept.
+        plot = self.ngspice.plot(None, self.ngspice.last_plot)
+        samples = {probe: np.asarray(plot[vector].to_waveform(), dtype=float)[self._read:]
+                   for probe, vector in self._vectors.items()}
+        self._read += len(samples['time'])
+        return samples
+
+
+def deviation(time, reference, candidate_time, candidate):
+    """Largest |candidate - reference| on `time`, the candidate interpolated from its own samples."""
+    return float(np.max(np.abs(np.interp(time, candidate_time, candidate) - np.asarray(reference))))
@@ -4,11 +4,12 @@ Linked transient simulations preserving capacitor initial condition,
 with validation against a single continuous run.
 """
 import matplotlib.pyplot as plt
-import numpy as np
 from PySpice.Logging.Logging import setup_logging
 from PySpice.Spice.Netlist import Circuit
 from PySpice.Unit import u_V, u_s, u_Ω, u_F, u_H, u_A
 
+from trajectory import Trajectory
+
 def configure_environment():
     # os.environ["PYSPICE_SIMULATOR"] = "ngspice"
     # If needed, adjust PATH externally or here:
@@ -45,18 +46,15 @@ def run_subsim(last_condition, last_current):
 
 
 def forloop():
-    time = np.array([])
-    voltage = np.array([])
-    current = np.array([])
-    
     last_condition = C1_ic
     last_current = L1_ic
     analysis = run_subsim(last_condition, last_current)
-    time = np.append(time, analysis.time)
-    voltage = np.append(voltage, analysis['node3'])
-    current = np.append(current, analysis['L1'])
+    trajectory = Trajectory('time', 'voltage', 'current', capacity=len(analysis.time))
+    trajectory.extend('time', analysis.time)
+    trajectory.extend('voltage', analysis['node3'])
+    trajectory.extend('current', analysis['L1'])
 
-    return time, voltage, current
+    return trajectory.arrays('time', 'voltage', 'current')
 
     
 def plotting(time, voltage, current):
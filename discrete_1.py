@@ -4,11 +4,12 @@ Linked transient simulations preserving capacitor initial condition,
 with validation against a single continuous run.
 """
 import matplotlib.pyplot as plt
-import numpy as np
 from PySpice.Logging.Logging import setup_logging
 from PySpice.Spice.Netlist import Circuit
 from PySpice.Unit import u_V, u_s, u_Ω, u_F
 
+from trajectory import Trajectory
+
 def configure_environment():
     # os.environ["PYSPICE_SIMULATOR"] = "ngspice"
     # If needed, adjust PATH externally or here:
@@ -40,21 +41,20 @@ def run_subsim(last_condition):
 
 
 def forloop():
-    time = np.array([])
-    voltage = np.array([])
+    trajectory = Trajectory('time', 'voltage', capacity=10*101)
     for i in range(1, 11):
         if i == 1:
             last_condition = C1_ic
             analysis = run_subsim(last_condition)
-            time = np.append(time, analysis.time)
-            voltage = np.append(voltage, analysis['node1'])
+            trajectory.extend('time', analysis.time)
+            trajectory.extend('voltage', analysis['node1'])
         else: 
             last_condition = analysis["node1"][-1]    
             analysis = run_subsim(last_condition)
-            time = np.append(time, np.array(np.array(analysis.time)+time[-1]))
-            voltage = np.append(voltage, np.array(analysis['node1']))
+            trajectory.extend('time', analysis.time, offset=trajectory.last('time'))
+            trajectory.extend('voltage', analysis['node1'])
     
-    return time, voltage
+    return trajectory.arrays('time', 'voltage')
 
     
 def plotting(time, voltage):
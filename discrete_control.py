@@ -0,0 +1,52 @@
+"""
+Incremental integral/derivative state for the discrete PID co-simulation.
+
+The forloop() scripts used to recompute np.trapezoid / np.gradient over the
+whole sample history at every control step. DiscreteController keeps the
+running integral and the previous sample instead, so each update is O(1):
+
+    rule='trapezoid'  I_n = I_(n-1) + (e_(n-1) + e_n)/2 * dt   (np.trapezoid)
+    rule='euler'      I_n = I_(n-1) + e_n * dt                 (forward Euler sum)
+    derivative        D_n = (e_n - e_(n-1)) / dt               (np.gradient(...)[-1])
+
+The derivative is 0 until a second sample arrives. The euler sum runs from
+the first sample on; int_forward_euler() in int.py restarted it at the
+second sample (its len(integral) < 2 branch), which was not kept.
+"""
+
+RULES = ('trapezoid', 'euler')
+
+
+class DiscreteController:
+    """Running integral and backward-difference derivative of a sampled error."""
+
+    def __init__(self, dt, rule='trapezoid', integral=0.0):
+        if rule not in RULES:
+            raise ValueError(f"rule must be one of {RULES}, got {rule!r}")
+        self.dt = float(dt)
+        self.rule = rule
+        self.initial_integral = float(integral)
+        self.reset()
+
+    def reset(self):
+        self.integral = self.initial_integral
+        self.derivative = 0.0
+        self.last = None
+        self.samples = 0
+
+    def update(self, value):
+        """Feeds the sample of the step just finished; returns (integral, derivative)."""
+        value = float(value)
+        if self.rule == 'euler':
+            self.integral += value * self.dt
+        elif self.last is not None:
+            self.integral += 0.5 * (self.last + value) * self.dt
+        if self.last is not None:
+            self.derivative = (value - self.last) / self.dt
+        self.last = value
+        self.samples += 1
+        return self.integral, self.derivative
+
+    def output(self, kp=0.0, ki=0.0, kd=0.0):
+        """kp*e + ki*I + kd*D for the latest sample."""
+        return kp * (self.last or 0.0) + ki * self.integral + kd * self.derivative
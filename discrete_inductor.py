@@ -4,11 +4,13 @@ Linked transient simulations preserving capacitor initial condition,
 with validation against a single continuous run.
 """
 import matplotlib.pyplot as plt
-import numpy as np
 from PySpice.Logging.Logging import setup_logging
 from PySpice.Spice.Netlist import Circuit
 from PySpice.Unit import u_V, u_s, u_Ω, u_F, u_H, u_A
 
+from cosim import CoSimulation, deviation
+from trajectory import Trajectory
+
 def configure_environment():
     # os.environ["PYSPICE_SIMULATOR"] = "ngspice"
     # If needed, adjust PATH externally or here:
@@ -45,26 +47,35 @@ def run_subsim(last_condition, last_current):
 
 
 def forloop():
-    time = np.array([])
-    voltage = np.array([])
-    current = np.array([])
+    trajectory = Trajectory('time', 'voltage', 'current', capacity=10*101)
     for i in range(1, 11):
         if i == 1:
             last_condition = C1_ic
             last_current = L1_ic
             analysis = run_subsim(last_condition, last_current)
-            time = np.append(time, analysis.time)
-            voltage = np.append(voltage, analysis['node3'])
-            current = np.append(current, analysis['L1'])
+            trajectory.extend('time', analysis.time)
         else: 
             last_condition = analysis["node3"][-1]
             last_current = analysis["L1"][-1]    
             analysis = run_subsim(last_condition, last_current)
-            time = np.append(time, np.array(np.array(analysis.time)+time[-1]))
-            voltage = np.append(voltage, np.array(analysis['node3']))
-            current = np.append(current, np.array(analysis['L1']))
+            trajectory.extend('time', analysis.time, offset=trajectory.last('time'))
+        trajectory.extend('voltage', analysis['node3'])
+        trajectory.extend('current', analysis['L1'])
     
-    return time, voltage, current
+    return trajectory.arrays('time', 'voltage', 'current')
+
+
+def forloop_cosim():
+    """Same 10 x 100 s chain on one loaded circuit, stopped and resumed at each boundary."""
+    trajectory = Trajectory('time', 'voltage', 'current', capacity=10*101)
+    with CoSimulation(VRLC(V1, R1, C1, L1, L1_ic), step_size=100, end_time=1000,
+                      probes=['node3', 'L1'], initial_condition={'node3': C1_ic}) as cosim:
+        while not cosim.done:
+            samples = cosim.advance()
+            trajectory.extend('time', samples['time'])
+            trajectory.extend('voltage', samples['node3'])
+            trajectory.extend('current', samples['L1'])
+    return trajectory.arrays('time', 'voltage', 'current')
 
     
 def plotting(time, voltage, current):
@@ -89,7 +100,11 @@ def main():
     setup_logging()
 
     
-    time, voltage, current = forloop()
+    # the linked runs validate the single continuous one, on the linked runs' time points
+    linked_time, linked_voltage, linked_current = forloop()
+    time, voltage, current = forloop_cosim()
+    print(f'voltage  {deviation(linked_time, linked_voltage, time, voltage):.3g}')
+    print(f'current  {deviation(linked_time, linked_current, time, current):.3g}')
     plotting(time, voltage, current)
 
 if __name__ == '__main__':
@@ -0,0 +1,208 @@
+"""
+Phase timing and memory records for ALM() and run_transient().
+
+Off by default; enable() switches it on for the process. ALM() then starts
+a RunRecord on the circuit it builds. Each run_transient() starts a fresh
+record holding a copy of those build phases, attaches it to the analysis
+it returns as `analysis.run_record` and, with a sink, appends it to a
+JSON-lines file.
+Wrapping a whole flow in `with recording(...)` collects everything inside
+(several builds, runs, plotting()) into one record instead, written when
+the block ends.
+
+Phases are named by nesting ('build', 'build/print', 'solve'):
+
+  build, print          ALM() and its print(circuit)
+  netlist, load,        ngspice: deck rendering, ngspice parsing, the
+  transient, read       transient itself, vectors into WaveForms
+  compile, solve        numpy backend (state_space.py)
+  optimize, inline,     netlist_optimizer.py passes and the signals
+  derive                evaluated after the run
+  plot                  plotting()
+
+Each phase has its wall and CPU time, the process' peak RSS when it ended
+and how much it raised it, and its traced Python peak when tracemalloc is
+running. Run statistics (ngspice's `rusage all`: accepted and rejected
+timepoints, transient iterations, circuit equations; the state-space
+solver's evaluation counts) go into record.stats.
+
+    enable(sink='runs.jsonl')
+    analysis = run_transient(ALM(), backend='numpy')
+    analysis.run_record.phases
+"""
+import contextlib
+import contextvars
+import functools
+import itertools
+import json
+import os
+import re
+import resource
+import time
+import tracemalloc
+
+_settings = {'enabled': False, 'sink': None}
+_active = contextvars.ContextVar('run_record', default=None)
+_ids = itertools.count()
+
+
+def enable(sink=None):
+    """Records every ALM() / run_transient() from now on; sink: JSON-lines path or None."""
+    _settings.update(enabled=True, sink=sink)
+
+
+def disable():
+    _settings.update(enabled=False, sink=None)
+
+
+def _peak_rss_mb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+class RunRecord:
+    """Phases and statistics of one build/run."""
+
+    def __init__(self, name):
+        self.id = f'{os.getpid()}-{next(_ids)}'
+        self.name = name
+        self.started = time.time()
+        self.phases = []
+        self.stats = {}
+        self._path = []
+
+    def as_dict(self):
+        return {'id': self.id, 'name': self.name, 'started': self.started,
+                'phases': self.phases, 'stats': self.stats}
+
+    def write(self, path):
+        with open(path, 'a') as handle:
+            handle.write(json.dumps(self.as_dict(), default=float) + '\n')
+
+
+def current():
+    """The record phases go to right now, or None."""
+    return _active.get()
+
+
+@contextlib.contextmanager
+def phase(name):
+    """Times the block into the current record; does nothing without one. Also a decorator."""
+    record = _active.get()
+    if record is None:
+        yield
+        return
+    record._path.append(name)
+    entry = {'phase': '/'.join(record._path)}
+    rss = _peak_rss_mb()
+    if tracemalloc.is_tracing():
+        tracemalloc.reset_peak()
+    wall, cpu = time.perf_counter(), time.process_time()
+    try:
+        yield
+    finally:
+        entry['wall'] = time.perf_counter() - wall
+        entry['cpu'] = time.process_time() - cpu
+        entry['peak_rss_mb'] = _peak_rss_mb()
+        entry['rss_growth_mb'] = entry['peak_rss_mb'] - rss
+        if tracemalloc.is_tracing():
+            entry['python_peak_mb'] = tracemalloc.get_traced_memory()[1] / 2**20
+        record.phases.append(entry)
+        record._path.pop()
+
+
+def add_stats(**values):
+    """Adds run statistics to the current record, summing numbers that are already there."""
+    record = _active.get()
+    if record is None:
+        return
+    for key, value in values.items():
+        if isinstance(value, (int, float)) and isinstance(record.stats.get(key), (int, float)):
+            value += record.stats[key]
+        record.stats[key] = value
+
+
+@contextlib.contextmanager
+def recording(name='run', sink=None):
+    """Collects everything in the block into one fresh record, written to `sink` at the end."""
+    record = RunRecord(name)
+    token = _active.set(record)
+    try:
+        yield record
+    finally:
+        _active.reset(token)
+        if sink or _settings['sink']:
+            record.write(sink or _settings['sink'])
+
+
+@contextlib.contextmanager
+def running(circuit, name='run_transient'):
+    """
+    The record a build or run of `circuit` goes into, or None when off.
+
+    An active recording() block wins; otherwise every run gets a fresh
+    record starting with a copy of the build phases on the circuit's own
+    record, so running one circuit twice neither repeats phases nor sums
+    statistics across runs. The outermost run writes it to the sink when
+    it ends.
+    """
+    record = _active.get()
+    if record is not None or not _settings['enabled']:
+        if record is not None and circuit is not None and getattr(circuit, 'run_record', None) is None:
+            circuit.run_record = record
+        yield record
+        return
+    record = RunRecord(name)
+    build = getattr(circuit, 'run_record', None)
+    if build is not None:
+        record.phases = [dict(entry) for entry in build.phases if entry['phase'].split('/')[0] == 'build']
+    token = _active.set(record)
+    try:
+        yield record
+    finally:
+        _active.reset(token)
+        if _settings['sink']:
+            record.write(_settings['sink'])
+
+
+def attach(analysis, record):
+    """Puts the record on the analysis as `run_record` (when there is one) and returns the analysis."""
+    if record is not None:
+        analysis.run_record = record
+    return analysis
+
+
+def instrumented(function):
+    """Decorator for circuit builders such as ALM(): records a 'build' phase on the circuit."""
+    @functools.wraps(function)
+    def build(*args, **kwargs):
+        if _active.get() is None and not _settings['enabled']:
+            return function(*args, **kwargs)
+        record = _active.get() or RunRecord(function.__name__)
+        token = _active.set(record)
+        try:
+            with phase('build'):
+                circuit = function(*args, **kwargs)
+        finally:
+            _active.reset(token)
+        circuit.run_record = record
+        return circuit
+    return build
+
+
+_RUSAGE = re.compile(r'^\s*([A-Za-z][\w ()/-]*?)\s*=\s*(\S+)', re.MULTILINE)
+
+
+def ngspice_statistics(ngspice):
+    """ngspice's `rusage all` as {snake_case name: number or text}."""
+    try:
+        output = ngspice.exec_command('rusage all')
+    except Exception as error:      # statistics are best effort, never fail a run for them
+        return {'rusage_error': str(error)}
+    stats = {}
+    for key, value in _RUSAGE.findall(output or ''):
+        key = re.sub(r'\W+', '_', key.strip().lower()).strip('_')
+        try:
+            stats[key] = float(value)
+        except ValueError:
+            stats[key] = value
+    return stats
@@ -9,6 +9,9 @@ from PySpice.Logging.Logging import setup_logging
 from PySpice.Spice.Netlist import Circuit
 from PySpice.Unit import u_V, u_s, u_Ω, u_F, u_H, u_A
 
+from discrete_control import DiscreteController
+from trajectory import Trajectory
+
 def configure_environment():
     # os.environ["PYSPICE_SIMULATOR"] = "ngspice"
     # If needed, adjust PATH externally or here:
@@ -47,33 +50,27 @@ def run_subsim(last_condition, last_current, step_size):
 
 
 def forloop():
-    time = np.array([])
-    voltage = np.array([])
-    current = np.array([])
-    int_current = np.array([])
-    control_times = np.array([])
-    for i in range(1, total_time//step_size + 1):
+    number_of_steps = total_time//step_size
+    trajectory = Trajectory('time', 'voltage', 'current', capacity=number_of_steps*(step_size + 1),
+                            sizes={'control_times': number_of_steps, 'int_current': number_of_steps})
+    controller = DiscreteController(step_size, rule='euler')
+    for i in range(1, number_of_steps + 1):
         if i == 1:
             last_condition = C1_ic
             last_current = L1_ic
             analysis = run_subsim(last_condition, last_current, step_size)
-            time = np.append(time, analysis.time)
-            voltage = np.append(voltage, analysis['node3'])
-            current = np.append(current, analysis['L1'])
-            int_current = int_forward_euler(time, last_current, int_current, step_size)
-            control_times = np.append(control_times, time[-1])
-
+            trajectory.extend('time', analysis.time)
         else: 
             last_condition = analysis["node3"][-1]
             last_current = analysis["L1"][-1]    
             analysis = run_subsim(last_condition, last_current, step_size)
-            time = np.append(time, np.array(np.array(analysis.time)+time[-1]))
-            voltage = np.append(voltage, np.array(analysis['node3']))
-            current = np.append(current, np.array(analysis['L1']))
-            int_current = int_forward_euler(time, last_current, int_current, i)
-            control_times = np.append(control_times, time[-1])
-        print(int_current)
-    return time, voltage, current, int_current, control_times
+            trajectory.extend('time', analysis.time, offset=trajectory.last('time'))
+        trajectory.extend('voltage', analysis['node3'])
+        trajectory.extend('current', analysis['L1'])
+        trajectory.append('control_times', trajectory.last('time'))
+        trajectory.append('int_current', controller.update(last_current)[0])
+        print(trajectory.last('int_current'))
+    return trajectory.arrays('time', 'voltage', 'current', 'int_current', 'control_times')
 
     
 def plotting(time, voltage, current):
@@ -10,6 +10,9 @@ from PySpice.Logging.Logging import setup_logging
 from PySpice.Spice.Netlist import Circuit
 from PySpice.Unit import u_V, u_s, u_Ω, u_F, u_H, u_A
 
+from discrete_control import DiscreteController
+from trajectory import Trajectory
+
 def configure_environment():
     # os.environ["PYSPICE_SIMULATOR"] = "ngspice"
     # If needed, adjust PATH externally or here:
@@ -52,41 +55,33 @@ def run_subsim(last_condition, last_current, step_size):
 
 
 def forloop():
-    time = np.array([])
-    voltage = np.array([])
-    current = np.array([])
-    int_current = np.array([])
-    dif_current = np.array([])
-    control_times = np.array([])
-    current_at_control_time = np.array([])
+    trajectory = Trajectory('time', 'voltage', 'current', capacity=number_of_steps*101,
+                            sizes={name: number_of_steps for name in
+                                   ('int_current', 'dif_current', 'control_times', 'current_at_control_time')})
+    controller = DiscreteController(step_size, rule='trapezoid')
     for i in range(1, number_of_steps):
         if i == 1:
             last_condition = C1_ic
             last_current = L1_ic
             analysis = run_subsim(last_condition, last_current, step_size)
-            time = np.append(time, analysis.time)
-            voltage = np.append(voltage, analysis['node3'])
-            current = np.append(current, analysis['L1'])
-            current_at_control_time = np.append(current_at_control_time, current[-1])
-            control_times = np.append(control_times, time[-1])
-            int_current = np.append(int_current, np.trapezoid(y = current_at_control_time, dx = step_size))
-            # dif_current = np.append(dif_current, np.gradient(current_at_control_time, step_size)[-1])
-
+            trajectory.extend('time', analysis.time)
         else: 
             last_condition = analysis["node3"][-1]
             last_current = analysis["L1"][-1]    
             analysis = run_subsim(last_condition, last_current, step_size)
-            time = np.append(time, np.array(np.array(analysis.time)+time[-1]))
-            voltage = np.append(voltage, np.array(analysis['node3']))
-            current = np.append(current, np.array(analysis['L1']))
-            current_at_control_time = np.append(current_at_control_time, current[-1])
-            control_times = np.append(control_times, time[-1])
-            int_current = np.append(int_current, np.trapezoid(y = current_at_control_time, dx = step_size))
-            dif_current = np.append(dif_current, np.gradient(current_at_control_time, step_size)[-1])
+            trajectory.extend('time', analysis.time, offset=trajectory.last('time'))
+        trajectory.extend('voltage', analysis['node3'])
+        trajectory.extend('current', analysis['L1'])
+        trajectory.append('current_at_control_time', trajectory.last('current'))
+        trajectory.append('control_times', trajectory.last('time'))
+        int_current, dif_current = controller.update(trajectory.last('current_at_control_time'))
+        trajectory.append('int_current', int_current)
+        if i > 1:
+            trajectory.append('dif_current', dif_current)
             if i == 2:
-                dif_current = np.append(dif_current, np.gradient(current_at_control_time, step_size)[-1])
+                trajectory.append('dif_current', trajectory.last('dif_current'))
         # print(int_current)
-    return time, voltage, current, int_current, control_times, dif_current
+    return trajectory.arrays('time', 'voltage', 'current', 'int_current', 'control_times', 'dif_current')
 
     
 def plotting(time, voltage, current):
@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+"""
+Benchmarks ALM(integrator='capacitor') against the XSPICE int chain.
+
+For each integrator block it times ALM() and str(circuit), counts devices
+(elements plus raw XSPICE lines) and .model cards, times run_transient() with the cache off and
+reports the largest deviation of every DASHBOARD_VECTORS entry from the
+'xspice' run, interpolated onto its time grid.
+
+    python integrator_benchmark.py --backend numpy --end-time 1000
+"""
+import argparse
+import contextlib
+import io
+import time
+
+import numpy as np
+from PySpice.Unit import u_s
+
+from BEP_alm_v12 import ALM, DASHBOARD_VECTORS, INTEGRATORS, run_transient
+
+
+def _best_of(repeat, function):
+    best, result = float('inf'), None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function()
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def benchmark(backend='numpy', end_time=1000, repeat=3):
+    """{integrator: {'build', 'netlist', 'run', 'devices', 'models', 'deviation'}}."""
+    results, analyses = {}, {}
+    for integrator in INTEGRATORS:
+        with contextlib.redirect_stdout(io.StringIO()):  # ALM() prints its netlist
+            build, circuit = _best_of(repeat, lambda: ALM(integrator=integrator))
+        netlist, deck = _best_of(repeat, lambda: str(circuit))
+        run, analysis = _best_of(repeat, lambda: run_transient(circuit, end_time=end_time @ u_s, backend=backend,
+                                                               cache=None, save=DASHBOARD_VECTORS))
+        analyses[integrator] = analysis
+        results[integrator] = {
+            'build': build, 'netlist': netlist, 'run': run,
+            'devices': sum(line[:1] not in ('', '.', '+', '*') for line in deck.splitlines()),
+            'models': sum(line.lower().startswith('.model') for line in deck.splitlines()),
+        }
+    reference = analyses['xspice']
+    for integrator, analysis in analyses.items():
+        results[integrator]['deviation'] = max(
+            float(np.max(np.abs(np.asarray(reference[vector]) - np.interp(
+                np.asarray(reference.time), np.asarray(analysis.time), np.asarray(analysis[vector])))))
+            for vector in DASHBOARD_VECTORS)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--backend', default='numpy', choices=['numpy', 'ngspice'])
+    parser.add_argument('--end-time', type=float, default=1000)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+    results = benchmark(args.backend, args.end_time, args.repeat)
+    print(f"{'integrator':<10} {'build ms':>9} {'netlist ms':>10} {'run s':>8} {'devices':>8} {'models':>6} "
+          f"{'max dev':>9}")
+    for integrator, row in results.items():
+        print(f"{integrator:<10} {1e3 * row['build']:>9.2f} {1e3 * row['netlist']:>10.2f} {row['run']:>8.3f} "
+              f"{row['devices']:>8} {row['models']:>6} {row['deviation']:>9.2e}")
+
+
+if __name__ == '__main__':
+    main()
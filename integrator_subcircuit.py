@@ -1,11 +1,8 @@
-import os
-import argparse
-import matplotlib.pyplot as plt
-from PySpice.Logging.Logging import setup_logging
-from PySpice.Spice.Netlist import Circuit, SubCircuitFactory
-from PySpice.Unit import *
+from PySpice.Spice.Netlist import Circuit
 
 
+circuit = Circuit('XSPICE current integrator')
+
 # measured has to be a component so that we can measure the current through it
 # i_out is the integrated current output, but is given as a voltage
 circuit.B('1', 'name_measured', circuit.gnd, voltage_expression='I(component)')
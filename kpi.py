@@ -0,0 +1,95 @@
+"""
+Balance-sheet KPIs computed in NumPy after the run.
+
+ALM() carries Return_on_Equity, Net_Stable_Funding_Ratio, Liquidity_Coverage_Ratio,
+Return_on_Assets, ... as gnd-gnd B sources that the solver evaluates at every
+timestep, although no controller reads them. kpis() derives them from the few
+balance vectors a run saves (BALANCE_VECTORS), with the same formulas as the
+netlist, so ALM(kpi_sources=False) can leave them out. Everything is elementwise:
+one run gives (time,) arrays, stack_balances() puts a batch of runs on a common
+time grid as (runs, time) arrays and the same call evaluates all of them. A new
+KPI is a new KPIS entry and needs no re-simulation.
+
+    save = DASHBOARD_VECTORS + KPI_VECTORS
+    values = kpis(balances(run_transient(ALM(kpi_sources=False), save=save)))
+    batch = kpis(stack_balances(analyses), names=['Return_on_Equity'])
+"""
+import numpy as np
+
+BALANCE_VECTORS = {
+    'loans': 'v_bloan_balance',
+    'current_deposits': 'v_bcurrent_account_balance',
+    'savings_deposits': 'v_bsavings_account_balance',
+    'retained_earnings': 'v_bretained_earnings',
+    'net_interest_income': 'lnii',
+    'interest_expense': 'v_binterest_expense',
+}
+
+KPI_VECTORS = sorted(BALANCE_VECTORS.values())
+
+# the balance-sheet identities of ALM()
+TOTALS = {
+    'total_liabilities': lambda b: b['current_deposits'] + b['savings_deposits'],
+    'total_equity': lambda b: b['retained_earnings'] + b['initial_equity'],
+    'cash_reserves': lambda b: b['total_liabilities'] + b['total_equity'] - b['loans'],
+    'total_assets': lambda b: b['loans'] + b['cash_reserves'],
+}
+
+KPIS = {
+    'Loan-to-Deposit_Ratio': lambda b: b['loans'] / b['total_liabilities'],
+    'Debt_to_Equity_Ratio': lambda b: b['total_liabilities'] / b['total_equity'],
+    'Tier_1_Capital_Ratio': lambda b: b['total_equity'] / b['loans'],
+    'Return_on_Equity': lambda b: b['net_interest_income'] / b['total_equity'],
+    'Return_on_Assets': lambda b: b['net_interest_income'] / b['total_assets'],
+    'Net_Interest_Margin': lambda b: b['net_interest_income'] / b['loans'],
+    'Net_Stable_Funding_Ratio': lambda b: (b['total_equity'] + 0.9 * b['current_deposits']
+                                           + 0.9 * b['savings_deposits']) / (0.85 * b['loans']),
+    'Liquidity_Coverage_Ratio': lambda b: b['cash_reserves'] / (0.1 * b['current_deposits']
+                                                                + 0.1 * b['savings_deposits']),
+    'Average_Cost_of_Debt': lambda b: b['interest_expense'] / b['total_liabilities'],
+}
+
+
+def balances(analysis, initial_equity=20.0):
+    """The BALANCE_VECTORS of one analysis as float arrays, plus q_E0 as 'initial_equity'."""
+    values = {name: np.asarray(analysis[vector], dtype=float) for name, vector in BALANCE_VECTORS.items()}
+    values['initial_equity'] = np.asarray(initial_equity, dtype=float)
+    return values
+
+
+def stack_balances(analyses, time=None, initial_equity=20.0):
+    """
+    The balances of several runs as (runs, time) arrays on one time grid.
+
+    time defaults to the first run's; the others are linearly interpolated
+    onto it. initial_equity is one q_E0 for all runs or one per run.
+    Returns (time, balances).
+    """
+    analyses = list(analyses)
+    if time is None:
+        time = np.asarray(analyses[0].time, dtype=float)
+    values = {}
+    for name, vector in BALANCE_VECTORS.items():
+        values[name] = np.stack([np.interp(time, np.asarray(analysis.time, dtype=float),
+                                           np.asarray(analysis[vector], dtype=float))
+                                 for analysis in analyses])
+    equity = np.asarray(initial_equity, dtype=float)
+    values['initial_equity'] = equity[:, None] if equity.ndim == 1 else equity
+    return time, values
+
+
+def kpis(values, names=None):
+    """
+    KPIs of one run or a batch.
+
+    Args:
+      values   dict   – balances() or the second item of stack_balances()
+      names    list   – KPIS (or TOTALS such as 'total_equity') to compute, default all KPIS
+    """
+    if isinstance(values, tuple):
+        values = values[1]
+    values = dict(values)
+    for name, total in TOTALS.items():
+        values[name] = total(values)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return {name: KPIS[name](values) if name in KPIS else values[name] for name in (names or KPIS)}
@@ -0,0 +1,311 @@
+#!/usr/bin/env python3
+"""
+Monte Carlo shock scenarios for ALM(): T_rate, production and demand shocks.
+
+Every scenario samples, from a model of distributions, whether each shock
+happens, its time and size, and a perturbed preset T_rate path. Scenario k
+draws from its own generator seeded with (seed, k), so a seed gives the same
+scenarios whatever the process count or chunking. Chunks of scenarios run on
+a process pool, with only a bounded number in flight; each returns its KPIs
+on a common time grid instead of whole analyses. Bands folds them in, in
+scenario order, as count/mean/std/min/max and a fixed-bin histogram per KPI
+and grid point, so memory does not grow with the number of scenarios and
+percentile bands are read off at the end (exact up to the pilot size, to a
+bin width beyond). <directory>/scenarios.jsonl gets one line per scenario
+(sampled kwargs, final KPI values, error), <directory>/bands.npz the summary.
+
+    bands = monte_carlo(5000, 'mc/base', seed=1, backend='numpy', processes=8)
+    bands['percentiles'], bands['bands']['Tier_1_Capital_Ratio']    # (percentiles, time)
+
+A model maps each shock flag of ALM() to its probability and the
+distributions of its time and size; a distribution is a number or a
+[Generator method, *args] list such as ['uniform', 100, 2000] or
+['normal', 0.01, 0.005]. 'rate_path' is a Gaussian random walk added to
+preset_T_rates, None keeps the preset path.
+"""
+import argparse
+import concurrent.futures
+import contextlib
+import io
+import json
+import os
+import warnings
+
+import numpy as np
+
+from kpi import KPI_VECTORS, balances, kpis
+
+DEFAULT_MODEL = {
+    'Trate_shock': {'probability': 0.5, 'time': ['uniform', 100, 2000], 'size': ['normal', 0.01, 0.005]},
+    'production_shock': {'probability': 0.3, 'time': ['uniform', 100, 2000], 'size': ['normal', 10, 5]},
+    'demand_shock': {'probability': 0.3, 'time': ['uniform', 100, 2000], 'size': ['normal', 0.03, 0.01]},
+    'rate_path': {'volatility': 0.0025, 'floor': 0.0},
+}
+
+# the time and size kwargs of each shock flag
+SHOCKS = {
+    'Trate_shock': ('rate_shock_time', 'rate_shock_size'),
+    'production_shock': ('production_shock_time', 'production_shock_size'),
+    'demand_shock': ('demand_shock_time', 'demand_shock_size'),
+}
+
+METRICS = ('total_equity', 'Liquidity_Coverage_Ratio', 'Tier_1_Capital_Ratio',
+           'Debt_to_Equity_Ratio', 'Loan-to-Deposit_Ratio', 'Return_on_Equity')
+
+PERCENTILES = (5, 25, 50, 75, 95)
+
+
+# ─────────────── Sampling ───────────────
+
+def draw(rng, spec):
+    """One value of a distribution spec: a number or [Generator method, *args]."""
+    if isinstance(spec, (int, float)):
+        return float(spec)
+    method, *args = spec
+    return float(getattr(rng, method)(*args))
+
+
+def sample_scenario(seed, index, model=None, base=None):
+    """ALM() kwargs of scenario `index`; the same (seed, index) always gives the same kwargs."""
+    from alm_template import DEFAULTS
+
+    model = DEFAULT_MODEL if model is None else model
+    rng = np.random.default_rng(np.random.SeedSequence(seed, spawn_key=(index,)))
+    kwargs = dict(base or {})
+    for flag, (time_name, size_name) in SHOCKS.items():
+        shock = model.get(flag)
+        if shock is None:
+            continue
+        kwargs[flag] = bool(rng.random() < shock.get('probability', 1.0))
+        time, size = draw(rng, shock['time']), draw(rng, shock['size'])   # drawn either way: stable streams
+        if kwargs[flag]:
+            kwargs[time_name], kwargs[size_name] = time, size
+    walk = model.get('rate_path')
+    if walk is not None:
+        rates = np.asarray(kwargs.get('preset_T_rates', DEFAULTS['preset_T_rates']), dtype=float)
+        rates = rates + np.cumsum(rng.normal(0.0, walk['volatility'], rates.size))
+        kwargs['preset_T_rates'] = np.maximum(rates, walk.get('floor', -np.inf)).tolist()
+    return kwargs
+
+
+# ─────────────── Bands ───────────────
+
+class Bands:
+    """
+    Streaming count/mean/std/min/max and percentiles of (metric, time) values.
+
+    add() takes a (runs, metrics, time) block. The first `pilot` runs are
+    kept as they are. Once there are more, every (metric, time) point gets
+    `bins` equal bins over the range of exactly those `pilot` runs, widened
+    by `margin` on both sides, so the bands do not depend on how the runs
+    were split into blocks. Later values outside that range fall into the end bins, but
+    min/max still track them. Non-finite values (a ratio over a zero
+    balance) are left out of a point's statistics.
+    """
+
+    def __init__(self, metrics, time, percentiles=PERCENTILES, bins=512, pilot=256, margin=0.25):
+        self.metrics = list(metrics)
+        self.time = np.asarray(time, dtype=float)
+        self.percentiles = tuple(percentiles)
+        self.bins, self.pilot, self.margin = bins, pilot, margin
+        shape = (len(self.metrics), self.time.size)
+        self.runs = 0
+        self.count = np.zeros(shape, dtype=np.int64)
+        self.sum = np.zeros(shape)
+        self.sum_sq = np.zeros(shape)
+        self.min = np.full(shape, np.inf)
+        self.max = np.full(shape, -np.inf)
+        self._pilot = []
+        self.low = self.width = self.histogram = None
+
+    def add(self, block):
+        block = np.asarray(block, dtype=float)
+        if block.shape[0] == 0:
+            return
+        finite = np.isfinite(block)
+        values = np.where(finite, block, 0.0)
+        self.runs += block.shape[0]
+        self.count += finite.sum(axis=0)
+        self.sum += values.sum(axis=0)
+        self.sum_sq += (values ** 2).sum(axis=0)
+        self.min = np.minimum(self.min, np.where(finite, block, np.inf).min(axis=0))
+        self.max = np.maximum(self.max, np.where(finite, block, -np.inf).max(axis=0))
+        if self.histogram is None:
+            kept = max(0, self.pilot - (self.runs - block.shape[0]))   # the block may cross the pilot's end
+            self._pilot.append(block[:kept])
+            if self.runs <= self.pilot:
+                return
+            pilot = np.concatenate(self._pilot)
+            self._pilot = []
+            low = np.min(np.where(np.isfinite(pilot), pilot, np.inf), axis=0, initial=np.inf)
+            high = np.max(np.where(np.isfinite(pilot), pilot, -np.inf), axis=0, initial=-np.inf)
+            span = np.where(high > low, high - low, np.maximum(np.abs(high), 1.0))
+            span = np.where(np.isfinite(span), span, 1.0)
+            self.low = np.where(np.isfinite(low), low, 0.0) - self.margin * span
+            self.width = span * (1 + 2 * self.margin) / self.bins
+            self.histogram = np.zeros(self.count.shape + (self.bins,), dtype=np.int64)
+            self._bin(pilot)
+            block = block[kept:]
+        self._bin(block)
+
+    def _bin(self, block):
+        index = np.floor((block - self.low) / self.width)
+        cells = np.arange(self.count.size).reshape(self.count.shape) * self.bins
+        flat = (cells + np.clip(np.nan_to_num(index), 0, self.bins - 1).astype(np.int64))[np.isfinite(block)]
+        self.histogram += np.bincount(flat, minlength=self.histogram.size).reshape(self.histogram.shape)
+
+    def bands(self):
+        """{metric: (percentiles, time) array}."""
+        q = np.asarray(self.percentiles, dtype=float)
+        if self.histogram is None:
+            pilot = np.concatenate(self._pilot) if self._pilot else np.full((1,) + self.count.shape, np.nan)
+            with warnings.catch_warnings():
+                warnings.simplefilter('ignore', RuntimeWarning)     # all-NaN points stay NaN
+                values = np.nanpercentile(np.where(np.isfinite(pilot), pilot, np.nan), q, axis=0)
+        else:
+            cumulative = np.cumsum(self.histogram, axis=-1)
+            values = np.empty((q.size,) + self.count.shape)
+            for k, percentile in enumerate(q):
+                target = percentile / 100 * self.count
+                edge = (cumulative < target[..., None]).sum(axis=-1).clip(0, self.bins - 1)
+                below = np.take_along_axis(cumulative, edge[..., None], -1)[..., 0] \
+                    - np.take_along_axis(self.histogram, edge[..., None], -1)[..., 0]
+                inside = np.take_along_axis(self.histogram, edge[..., None], -1)[..., 0]
+                with np.errstate(divide='ignore', invalid='ignore'):
+                    fraction = np.where(inside > 0, (target - below) / inside, 0.5)
+                values[k] = np.clip(self.low + (edge + fraction) * self.width, self.min, self.max)
+            values[:, self.count == 0] = np.nan
+        return {metric: values[:, m] for m, metric in enumerate(self.metrics)}
+
+    def summary(self):
+        with np.errstate(divide='ignore', invalid='ignore'):
+            mean = self.sum / self.count
+            std = np.sqrt(np.maximum(self.sum_sq / self.count - mean ** 2, 0.0))
+        return {'runs': self.runs, 'time': self.time, 'metrics': self.metrics,
+                'percentiles': np.asarray(self.percentiles), 'bands': self.bands(),
+                'count': self.count, 'mean': mean, 'std': std, 'min': self.min, 'max': self.max}
+
+    def save(self, path):
+        summary = self.summary()
+        bands = summary.pop('bands')
+        np.savez_compressed(path, **{key: np.asarray(value) for key, value in summary.items()},
+                            **{f'band:{metric}': band for metric, band in bands.items()})
+
+
+def load_bands(directory):
+    """bands.npz of a monte_carlo() directory as the dict Bands.summary() returns."""
+    with np.load(os.path.join(directory, 'bands.npz')) as data:
+        summary = {key: data[key] for key in data.files if not key.startswith('band:')}
+        summary['bands'] = {key[5:]: data[key] for key in data.files if key.startswith('band:')}
+    summary['metrics'] = [str(metric) for metric in summary['metrics']]
+    summary['runs'] = int(summary['runs'])
+    return summary
+
+
+# ─────────────── Runs ───────────────
+
+def _run_chunk(indices, seed, model, base, metrics, time, backend, compiled):
+    # Runs in a worker process; returns (runs, metrics, time) values and one row per scenario.
+    from BEP_alm_v12 import ALM, run_transient
+    from PySpice.Unit import u_s
+    from alm_template import template
+
+    block = np.full((len(indices), len(metrics), time.size), np.nan)
+    rows = []
+    for k, index in enumerate(indices):
+        kwargs = sample_scenario(seed, index, model, base)
+        sampled = {key: value for key, value in kwargs.items() if key not in (base or {}) or value != base[key]}
+        row = {'index': index, 'params': sampled, 'final': {}, 'error': None}
+        try:
+            with contextlib.redirect_stdout(io.StringIO()):
+                if compiled:
+                    analysis = template(**kwargs).transient(end_time=time[-1], backend=backend,
+                                                            cache=None, save=KPI_VECTORS, **kwargs)
+                else:
+                    analysis = run_transient(ALM(**kwargs), end_time=time[-1] @ u_s, backend=backend,
+                                             cache=None, save=KPI_VECTORS)
+            values = kpis(balances(analysis, kwargs.get('q_E0', 20)), metrics)
+            run_time = np.asarray(analysis.time, dtype=float)
+            for m, metric in enumerate(metrics):
+                block[k, m] = np.interp(time, run_time, np.broadcast_to(values[metric], run_time.shape))
+            row['final'] = {metric: float(block[k, m, -1]) for m, metric in enumerate(metrics)}
+        except Exception as error:
+            row['error'] = f'{type(error).__name__}: {error}'
+        rows.append(row)
+    return block, rows
+
+
+def monte_carlo(scenarios, directory, model=None, base=None, seed=0, metrics=METRICS, end_time=5000,
+                points=201, percentiles=PERCENTILES, processes=None, backend='ngspice', chunk=16,
+                compiled=True, bins=512, pilot=256):
+    """
+    Runs `scenarios` sampled ALM() scenarios and returns Bands.summary().
+
+    `base` holds the ALM() kwargs all scenarios share. The KPIs (kpi.py
+    names, TOTALS included) are interpolated onto `points` times from 0 to
+    end_time. Failed scenarios are listed in scenarios.jsonl with their
+    error and left out of the bands.
+    """
+    os.makedirs(directory, exist_ok=True)
+    metrics = list(metrics)
+    time = np.linspace(0.0, float(end_time), points)
+    accumulator = Bands(metrics, time, percentiles, bins=bins, pilot=pilot)
+    chunks = [list(range(start, min(start + chunk, scenarios))) for start in range(0, scenarios, chunk)]
+
+    initializer = None
+    if backend == 'ngspice':
+        from ngspice_pool import warm_up
+        initializer = warm_up
+
+    with open(os.path.join(directory, 'scenarios.jsonl'), 'w') as table, \
+            concurrent.futures.ProcessPoolExecutor(processes, initializer=initializer) as executor:
+        in_flight = 2 * (processes or os.cpu_count() or 1)
+        futures = {}
+        try:
+            for k in range(len(chunks)):
+                # keep the pool busy but only a bounded number of chunks in memory
+                for ahead in range(k + len(futures), min(k + in_flight, len(chunks))):
+                    futures[ahead] = executor.submit(_run_chunk, chunks[ahead], seed, model, base,
+                                                     metrics, time, backend, compiled)
+                block, rows = futures.pop(k).result()
+                ok = [n for n, row in enumerate(rows) if row['error'] is None]
+                accumulator.add(block[ok])
+                for row in rows:
+                    table.write(json.dumps(row, default=float) + '\n')
+                table.flush()
+        except KeyboardInterrupt:
+            for future in futures.values():
+                future.cancel()
+            raise
+
+    accumulator.save(os.path.join(directory, 'bands.npz'))
+    return accumulator.summary()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Monte Carlo shock scenarios for ALM().')
+    parser.add_argument('scenarios', type=int)
+    parser.add_argument('--output', default='monte_carlo')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--model', help='JSON file with the shock model (default: DEFAULT_MODEL)')
+    parser.add_argument('--backend', default='ngspice', choices=['ngspice', 'numpy'])
+    parser.add_argument('--end-time', type=float, default=5000)
+    parser.add_argument('--processes', type=int)
+    parser.add_argument('--chunk', type=int, default=16)
+    args = parser.parse_args()
+
+    model = None
+    if args.model:
+        with open(args.model) as file:
+            model = json.load(file)
+    summary = monte_carlo(args.scenarios, args.output, model=model, seed=args.seed, end_time=args.end_time,
+                          processes=args.processes, backend=args.backend, chunk=args.chunk)
+
+    print(f"{summary['runs']} of {args.scenarios} scenarios, final values:")
+    print(f"{'':<26}" + ''.join(f'{f"p{p:g}":>10}' for p in summary['percentiles']))
+    for metric in summary['metrics']:
+        print(f'{metric:<26}' + ''.join(f'{value:>10.4g}' for value in summary['bands'][metric][:, -1]))
+
+
+if __name__ == '__main__':
+    main()
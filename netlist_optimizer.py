@@ -0,0 +1,435 @@
+"""
+Netlist optimisation pass for built ALM circuits.
+
+ALM() carries signals that cost the simulator an unknown each but add no
+information: exact duplicates (Loan-to-Deposit_Ratio1, Debt_to_Equity_Ratio1,
+Tier_1_Capital_Ratio1), pass-throughs (Make_sure_netinterest_is_saved,
+makesure_netcashflow_is_saved) and derivative blocks whose gain Kd is 0.
+optimize_circuit() works on the built Circuit, in place:
+
+  * `{P}*I(x)` terms whose .param P is 0 are folded to 0;
+  * gnd-gnd B current sources with the same expression are merged into
+    the first one, and a source that only reads `I(Bx)` into Bx; every
+    reference is renamed;
+  * signal elements (B sources, V sources and XSPICE blocks whose nodes
+    touch no L, C or R) that nothing alive reads any more are removed,
+    together with their raw SPICE devices and unused .model cards.
+
+It returns the merged names as vector aliases ('v_bdebt_to_equity_ratio1'
+-> 'v_bdebt_to_equity_ratio'); with_aliases() puts them back into an
+analysis so the old names still resolve. Folding uses the current .param
+values, so a circuit that is rebound later (alm_template.py) must not be
+optimised.
+
+    aliases = optimize_circuit(circuit, keep=DASHBOARD_VECTORS)
+    analysis = with_aliases(run(circuit), aliases)
+
+inline_signals() goes further and takes the gnd-gnd signal sources out of
+the matrix: signals the dynamics read are substituted into their readers,
+the reporting-only ones (ratios, totals, ...) are evaluated from the saved
+vectors after the run. It keeps the {param} references, and the derived
+signals read the circuit's .param values when they are evaluated, so unlike
+the folding above it survives a rebind.
+
+    derived = inline_signals(circuit, keep=DASHBOARD_VECTORS)
+    analysis = derived.evaluate(run(circuit, save=... + derived.inputs))
+"""
+import re
+
+import numpy as np
+
+from state_space import StateSpaceAnalysis, evaluate_parameters, translate_expression
+
+_REFERENCE = re.compile(r'([IiVv])\s*\(\s*([^,()\s]+)\s*\)')
+_ZERO_GAIN = re.compile(r'\{?\s*([A-Za-z_]\w*)\s*\}?\s*\*\s*I\s*\(\s*[^,()\s]+\s*\)')
+_SIGNAL_KINDS = ('BehavioralSource', 'VoltageSource', 'PulseVoltageSource', 'PieceWiseLinearVoltageSource')
+
+
+def references(expression):
+    """{('i', element) or ('v', node)} read by an expression, lower case."""
+    return {(kind.lower(), name.lower()) for kind, name in _REFERENCE.findall(str(expression or ''))}
+
+
+def rename_references(expression, names):
+    """Rewrites I(old) to I(new) for every lower-case old -> new in `names`."""
+    def replace(match):
+        kind, name = match.groups()
+        if kind in 'Ii' and name.lower() in names:
+            return f'{kind}({names[name.lower()]})'
+        return match.group(0)
+    return _REFERENCE.sub(replace, str(expression))
+
+
+def _expression(element):
+    if type(element).__name__ != 'BehavioralSource':
+        return None
+    if element.current_expression is not None:
+        return element.current_expression
+    return element.voltage_expression
+
+
+def _set_expression(element, expression):
+    if element.current_expression is not None:
+        element.current_expression = expression
+    else:
+        element.voltage_expression = expression
+
+
+def _is_signal_source(element, gnd):
+    """gnd-gnd B current source: a pure signal read as I(B...)."""
+    nodes = [str(node) for node in element.node_names]
+    return (type(element).__name__ == 'BehavioralSource' and element.current_expression is not None
+            and nodes[0] == gnd and nodes[1] == gnd)
+
+
+def vector_name(element):
+    """Analysis name of an element's branch: 'v_b<name>' for a current B source, else '<name>'."""
+    name = element.name.lower()
+    if type(element).__name__ == 'BehavioralSource' and element.current_expression is not None:
+        return 'v_' + name
+    return name
+
+
+# ─────────────── raw SPICE ───────────────
+
+def _raw_statements(raw_spice):
+    """Raw SPICE as [(kind, name, nodes, model, text)], '+' lines joined to their statement."""
+    statements = []
+    for line in (raw_spice or '').splitlines():
+        stripped = line.strip()
+        if stripped.startswith('+') and statements:
+            statements[-1][4].append(line)
+            continue
+        if not stripped:
+            continue
+        tokens = stripped.split()
+        lower = stripped.lower()
+        if lower.startswith('.model'):
+            statements.append(['model', tokens[1].lower(), [], None, [line]])
+        elif lower[0] == 'a':
+            statements.append(['device', tokens[0], [t.lower() for t in tokens[1:3]], tokens[3].lower(), [line]])
+        elif lower[0] == 'r':
+            statements.append(['load', tokens[0], [t.lower() for t in tokens[1:3]], None, [line]])
+        else:
+            statements.append(['other', tokens[0], [], None, [line]])
+    return statements
+
+
+def _render_raw(statements):
+    used = {model for kind, _, _, model, _ in statements if kind == 'device'}
+    seen, lines = set(), []
+    for kind, name, _, _, text in statements:
+        if kind == 'model':
+            card = '\n'.join(text)
+            if name not in used or card in seen:
+                continue        # unused or a repeat of the same card
+            seen.add(card)
+        lines += text
+    return '\n' + '\n'.join(lines) + '\n' if lines else ''
+
+
+# ─────────────── liveness ───────────────
+
+def _live(circuit, statements, roots, signal):
+    """Names of elements / raw devices reachable from `roots` through what they read."""
+    gnd = str(circuit.gnd).lower()
+    producers, reads = {}, {}
+    for element in circuit.elements:
+        name = element.name
+        reads[name] = references(_expression(element))
+        if name in signal:
+            if _is_signal_source(element, str(circuit.gnd)):
+                producers[('i', name.lower())] = name
+            else:
+                producers[('v', str(element.node_names[0]).lower())] = name
+                producers[('i', name.lower())] = name
+    for kind, name, nodes, _, _ in statements:
+        if kind == 'device':
+            reads[name] = {('v', nodes[0])}
+            producers[('v', nodes[1])] = name
+
+    live, pending = set(), list(roots)
+    while pending:
+        name = pending.pop()
+        if name in live:
+            continue
+        live.add(name)
+        for item in reads.get(name, ()):
+            if item in producers:
+                pending.append(producers[item])
+    # a device's load resistor stays with the device driving its node
+    live_nodes = {item[1] for item, name in producers.items() if name in live and item[0] == 'v'}
+    for kind, name, nodes, _, _ in statements:
+        if kind == 'load' and any(node in live_nodes for node in nodes if node != gnd):
+            live.add(name)
+        elif kind not in ('device', 'load'):
+            live.add(name)
+    return live
+
+
+def _signal_elements(circuit, statements):
+    """Elements whose non-ground nodes are touched by no L, C, R or current-injecting source."""
+    gnd = str(circuit.gnd)
+    structural = set()
+    for element in circuit.elements:
+        kind = type(element).__name__
+        nodes = [str(node) for node in element.node_names]
+        if kind not in _SIGNAL_KINDS or (kind == 'BehavioralSource' and element.current_expression is not None
+                                         and not _is_signal_source(element, gnd)):
+            structural.update(node.lower() for node in nodes)
+    signal = set()
+    for element in circuit.elements:
+        kind = type(element).__name__
+        nodes = [str(node).lower() for node in element.node_names]
+        if kind in _SIGNAL_KINDS and not any(node in structural for node in nodes if node != gnd.lower()):
+            signal.add(element.name)
+    return signal
+
+
+# ─────────────── the pass ───────────────
+
+def optimize_circuit(circuit, keep=None):
+    """
+    Folds zero gains, merges duplicate signals and prunes dead blocks, in place.
+
+    keep lists analysis vector names that must survive (e.g. the .save list).
+    With keep=None every signal is kept except the blocks that only fed a
+    folded zero-gain term. Returns {old vector name: vector name it now reads}.
+    """
+    gnd = str(circuit.gnd)
+    statements = _raw_statements(circuit.raw_spice)
+    signal = _signal_elements(circuit, statements)
+    before = _live(circuit, statements,
+                   [element.name for element in circuit.elements if element.name not in signal
+                    or _is_signal_source(element, gnd)] + [s[1] for s in statements if s[0] != 'device'],
+                   signal)
+
+    # 1) zero gains
+    zero = {name for name, value in evaluate_parameters(circuit).items() if value == 0}
+    folded = set()
+    for element in circuit.elements:
+        expression = _expression(element)
+        if expression is None:
+            continue
+        def fold(match):
+            before = str(expression)[:match.start()].rstrip()
+            if match.group(1).lower() in zero and not before.endswith(('/', '^', '*')):
+                folded.update(name for kind, name in references(match.group(0)))
+                return '0'
+            return match.group(0)
+        new = _ZERO_GAIN.sub(fold, str(expression))
+        if new != str(expression):
+            _set_expression(element, new)
+
+    # 2) duplicates and pass-throughs, until nothing merges any more
+    merged = {}                                   # lower-case element name -> element name
+    while True:
+        canonical, renames = {}, {}
+        sources = {element.name.lower(): element for element in circuit.elements
+                   if _is_signal_source(element, gnd)}
+        for name, element in sources.items():
+            key = re.sub(r'\s+', '', str(element.current_expression)).lower()
+            through = re.fullmatch(r'i\(([^,()\s]+)\)', key)
+            if through and through.group(1) in sources and through.group(1) != name:
+                renames[name] = sources[through.group(1)]
+            elif key in canonical:
+                renames[name] = canonical[key]
+            else:
+                canonical[key] = element
+        # never merge into something that is itself merged away in this round
+        renames = {old: new for old, new in renames.items() if new.name.lower() not in renames}
+        if not renames:
+            break
+        for old, new in renames.items():
+            circuit._remove_element(sources[old])
+            merged[old] = new.name
+        for name, target in list(merged.items()):
+            while target.lower() in merged:
+                target = merged[target.lower()]
+            merged[name] = target
+        for element in circuit.elements:
+            expression = _expression(element)
+            if expression is not None:
+                new = rename_references(expression, {old: name for old, name in merged.items()})
+                if new != str(expression):
+                    _set_expression(element, new)
+    aliases = {'v_' + old: 'v_' + new.lower() for old, new in merged.items()}
+
+    # 3) dead blocks
+    signal = _signal_elements(circuit, statements)
+    roots = [element.name for element in circuit.elements if element.name not in signal]
+    roots += [s[1] for s in statements if s[0] not in ('device', 'load')]
+    if keep is None:
+        roots += [element.name for element in circuit.elements
+                  if _is_signal_source(element, gnd) and element.name.lower() not in folded]
+    else:
+        wanted = {aliases.get(name.lower(), name.lower()) for name in keep}
+        roots += [element.name for element in circuit.elements
+                  if vector_name(element) in wanted or element.name.lower() in wanted
+                  or (element.node_names and str(element.node_names[0]).lower() in wanted)]
+    live = _live(circuit, statements, roots, signal)
+    dead = {name for name in before if name not in live} if keep is None else None
+    for element in list(circuit.elements):
+        if element.name in live or (dead is not None and element.name not in dead):
+            continue
+        circuit._remove_element(element)
+    statements = [s for s in statements if s[1] in live or (dead is not None and s[1] not in dead)]
+    circuit.raw_spice = _render_raw(statements)
+    return aliases
+
+
+def with_aliases(analysis, aliases):
+    """The analysis with every alias readable under its old name as well."""
+    branches = dict(analysis.branches)
+    for old, new in aliases.items():
+        if new in branches:
+            branches[old] = branches[new]
+    return StateSpaceAnalysis(analysis.time, dict(analysis.nodes), branches)
+
+
+# ─────────────── inlining ───────────────
+
+class DerivedSignals:
+    """
+    Signals inline_signals() took out of the netlist, evaluated after the run.
+
+    definitions are (vector name, expression) pairs in evaluation order, in
+    the circuit's own syntax; inputs are the vectors they read, which the
+    run has to record (add them to the .save list). The .param values are
+    read from the circuit at evaluate() time, so they follow a rebind.
+    """
+
+    def __init__(self, definitions, inputs, circuit, vectors, gnd):
+        self.definitions = definitions
+        self.inputs = inputs
+        self._circuit = circuit
+        self._vectors = vectors
+        self._gnd = gnd
+
+    def _vector(self, kind, name):
+        name = name.lower()
+        if kind == 'v':
+            return None if name == self._gnd else name
+        return self._vectors.get(name, name)
+
+    def evaluate(self, analysis):
+        """The analysis with every derived signal added as a branch vector."""
+        time = np.asarray(analysis.time, dtype=float)
+        parameters = evaluate_parameters(self._circuit)
+        values = {}
+
+        def probe(kind, name):
+            vector = self._vector(kind, name)
+            if vector is None:
+                return '0.0'
+            if vector not in values:
+                values[vector] = np.asarray(analysis[vector], dtype=float)
+            return f'_v[{vector!r}]'
+
+        branches = dict(analysis.branches)
+        for vector, expression in self.definitions:
+            source = translate_expression(expression, parameters, probe)
+            values[vector] = eval(source, {'np': np, '_v': values, 't': time}) + np.zeros_like(time)
+            branches[vector] = values[vector]
+        return StateSpaceAnalysis(analysis.time, dict(analysis.nodes), branches)
+
+
+def _signal_order(expressions):
+    """Signal names with their dependencies first; names on an algebraic loop are returned apart."""
+    order, state, loops = [], {}, set()
+
+    def visit(name, path):
+        if state.get(name) == 'done':
+            return
+        if state.get(name) == 'open':
+            loops.update(path[path.index(name):])
+            return
+        state[name] = 'open'
+        for kind, dependency in references(expressions[name]):
+            if kind == 'i' and dependency in expressions:
+                visit(dependency, path + [name])
+        state[name] = 'done'
+        order.append(name)
+
+    for name in expressions:
+        visit(name, [])
+    return [name for name in order if name not in loops], loops
+
+
+def _substitute(expression, texts):
+    """Replaces I(x) by texts[x] for every lower-case x in `texts`."""
+    def replace(match):
+        kind, name = match.groups()
+        if kind in 'Ii' and name.lower() in texts:
+            return texts[name.lower()]
+        return match.group(0)
+    return _REFERENCE.sub(replace, str(expression))
+
+
+def inline_signals(circuit, keep=None, max_length=200):
+    """
+    Takes the gnd-gnd B current sources out of the matrix, in place.
+
+    A signal that something other than a signal reads (an L/C/R branch
+    source, a B voltage source driving an XSPICE input, ...) is inlined into
+    its readers as a parenthesised expression, unless the inlined text gets
+    longer than max_length characters or the signal sits on an algebraic
+    loop; those stay as unknowns. Signals that only feed reporting are
+    removed and returned as DerivedSignals to evaluate after the run: all of
+    them with keep=None, otherwise those whose vector is in keep.
+    """
+    gnd = str(circuit.gnd)
+    sources = {element.name.lower(): element for element in circuit.elements if _is_signal_source(element, gnd)}
+    expressions = {name: str(element.current_expression) for name, element in sources.items()}
+    order, loops = _signal_order(expressions)
+
+    # signals the dynamics read, directly or through other such signals
+    needed = set(loops)
+    for element in circuit.elements:
+        if element.name.lower() not in sources:
+            needed.update(name for kind, name in references(_expression(element))
+                          if kind == 'i' and name in sources)
+    for name in reversed(order):
+        if name in needed:
+            needed.update(dependency for kind, dependency in references(expressions[name])
+                          if kind == 'i' and dependency in sources)
+
+    texts, kept = {}, set(loops)
+    for name in order:
+        if name not in needed:
+            continue
+        text = _substitute(expressions[name], texts)
+        if len(text) <= max_length:
+            texts[name] = '(' + text.strip() + ')'
+        else:
+            kept.add(name)
+    for element in circuit.elements:
+        expression = _expression(element)
+        if expression is not None and element.name.lower() not in texts:
+            new = _substitute(expression, texts)
+            if new != str(expression):
+                _set_expression(element, new)
+    for name, element in sources.items():
+        if name not in kept:
+            circuit._remove_element(element)
+
+    # what is evaluated after the run, from the original expressions
+    wanted = [name for name in order if name not in kept]
+    if keep is not None:
+        names = {name.lower() for name in keep}
+        wanted = [name for name in wanted if 'v_' + name in names]
+    required = set(wanted)
+    for name in reversed(order):
+        if name in required:
+            required.update(dependency for kind, dependency in references(expressions[name])
+                            if kind == 'i' and dependency in sources and dependency not in kept)
+    definitions = [('v_' + name, expressions[name]) for name in order if name in required]
+    vectors = {name: 'v_' + name for name in sources}
+    vectors.update((element.name.lower(), vector_name(element)) for element in circuit.elements)
+    derived = DerivedSignals(definitions, set(), circuit, vectors, gnd.lower())
+    for name in required:
+        for kind, reference in references(expressions[name]):
+            vector = derived._vector(kind, reference)
+            if vector is not None and (kind == 'v' or reference not in required):
+                derived.inputs.add(vector)
+    return derived
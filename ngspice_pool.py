@@ -0,0 +1,160 @@
+"""
+Pool of long-lived in-process ngspice sessions for run_transient().
+
+Every NgSpiceShared session loads libngspice and its XSPICE code models
+once. A run borrows a session, loads its netlist, runs, and hands the
+session back with its circuit and plots removed, so the next run starts
+from a clean simulator without paying the library start-up again.
+
+ngspice keeps global state per loaded library, so a session serves one
+thread at a time. Pools larger than one need the numbered library copies
+PySpice looks for (libngspice1.so, libngspice2.so, ...); process-based
+sweeps should keep size=1 and call warm_up() in each worker's initializer.
+"""
+import contextlib
+import queue
+import threading
+
+from PySpice.Spice.NgSpice.Shared import NgSpiceShared, NgSpiceCommandError
+from PySpice.Spice.Simulation import CircuitSimulation
+
+from instrumentation import add_stats, current, ngspice_statistics, phase
+
+
+class NgSpicePool:
+    """Borrow/return pool of NgSpiceShared sessions, created on first use."""
+
+    def __init__(self, size=1, first_id=0):
+        self.size = size
+        self.first_id = first_id
+        self._idle = queue.LifoQueue()
+        self._created = 0
+        self._lock = threading.Lock()
+
+    def _acquire(self):
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+        with self._lock:
+            if self._created < self.size:
+                ngspice = NgSpiceShared.new_instance(ngspice_id=self.first_id + self._created)
+                self._created += 1
+                return ngspice
+        return self._idle.get()
+
+    def _release(self, ngspice):
+        try:
+            ngspice.destroy()
+            ngspice.remove_circuit()
+        except NgSpiceCommandError:
+            pass  # nothing loaded, e.g. the netlist failed to parse
+        self._idle.put(ngspice)
+
+    @contextlib.contextmanager
+    def session(self):
+        """Borrows a session for the duration of the with-block."""
+        ngspice = self._acquire()
+        try:
+            yield ngspice
+        finally:
+            self._release(ngspice)
+
+    def transient(self, circuit, step_time, end_time, save=None, **kwargs):
+        """
+        Runs circuit.simulator().transient(...) on a borrowed session.
+
+        `save` lists the analysis vectors to record (see save_names()); by
+        default ngspice keeps every node and branch.
+        """
+        with self.session() as ngspice:
+            simulator = circuit.simulator(simulator='ngspice-shared', ngspice_shared=ngspice)
+            if save:
+                set_save(simulator, circuit, save)
+            # simulator.transient(), one step at a time so each can be timed (see instrumentation.py)
+            CircuitSimulation.transient(simulator, step_time=step_time, end_time=end_time, **kwargs)
+            with phase('netlist'):
+                deck = str(simulator)
+            ngspice.destroy()
+            with phase('load'):
+                ngspice.load_circuit(deck)
+            with phase('transient'):
+                ngspice.run()
+            if ngspice.last_plot == 'const':
+                raise NameError('Simulation failed')
+            if current() is not None:
+                add_stats(**ngspice_statistics(ngspice))
+            with phase('read'):
+                return ngspice.plot(simulator, ngspice.last_plot).to_analysis()
+
+
+def save_names(circuit, vectors):
+    """
+    .save arguments for analysis vector names.
+
+    Branch currents are read back as 'lloans' or 'v_bspread' (the 0 V
+    source ngspice puts in series with a current B source); they are saved
+    as '<name>#branch'. Anything else is taken to be a node.
+    """
+    elements = {name.lower() for name in circuit.element_names}
+    names = []
+    for vector in vectors:
+        name = vector.lower()
+        if name in elements or (name.startswith('v_') and name[2:] in elements):
+            name += '#branch'
+        if name not in names:
+            names.append(name)
+    return names
+
+
+def set_save(simulator, circuit, vectors):
+    """simulator.save() for analysis vector names; returns the .save names."""
+    names = save_names(circuit, vectors)
+    # PySpice 1.5 does `saved |= set(*args)`: one iterable, never several names
+    simulator.save(names)
+    return names
+
+
+def check_save_line(circuit, vectors):
+    """
+    The .save line set_save() renders for `vectors` on `circuit`.
+
+    Raises ValueError when a vector is neither a node nor an element of the
+    circuit (ngspice would silently record nothing for it), or when the
+    rendered deck does not carry exactly one .save line naming them all.
+    """
+    nodes = {str(node).lower() for node in circuit.node_names}
+    names = save_names(circuit, vectors)
+    unknown = [name for name in names if not name.endswith('#branch') and name not in nodes]
+    if unknown:
+        raise ValueError(f"{', '.join(unknown)}: no such node or element in {circuit.title!r}")
+    simulator = circuit.simulator(simulator='ngspice-subprocess')
+    set_save(simulator, circuit, vectors)
+    CircuitSimulation.transient(simulator, step_time=1, end_time=2)
+    lines = [line for line in str(simulator).splitlines() if line.startswith('.save ')]
+    if len(lines) != 1 or sorted(lines[0].split()[1:]) != sorted(names):
+        raise ValueError(f'.save line {lines} does not match {names}')
+    return lines[0]
+
+
+default_pool = NgSpicePool()
+
+
+def warm_up(pool=None):
+    """Loads the library up front, e.g. from a process pool initializer."""
+    pool = pool or default_pool
+    with pool.session():
+        pass
+
+
+def pooled_transient(circuit, step_time, end_time, pool=None, **kwargs):
+    """Transient analysis on a session from `pool` (the per-process default)."""
+    return (pool or default_pool).transient(circuit, step_time, end_time, **kwargs)
+
+
+if __name__ == '__main__':
+    import io
+    with contextlib.redirect_stdout(io.StringIO()):  # ALM() prints its netlist
+        from BEP_alm_v12 import ALM, DASHBOARD_VECTORS
+        circuit = ALM()
+    print(check_save_line(circuit, DASHBOARD_VECTORS))
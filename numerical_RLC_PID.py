@@ -10,6 +10,10 @@ from PySpice.Spice.Netlist import Circuit
 from PySpice.Unit import u_V, u_s, u_ms, u_us, u_ns, u_Ω, u_H, u_F, u_A
 import numpy as np
 
+from cosim import CoSimulation, deviation
+from discrete_control import DiscreteController
+from trajectory import Trajectory
+
 # Ensure ngspice is on the PATH and set as simulator
 
 
@@ -17,6 +21,7 @@ C1_ic = 0
 L1_ic = 0
 step_size = 1 #s
 total_time = 50 #s
+kp, ki, kd = 0.6, 0.7, 1
 add_plot_lines = False
 
 number_of_steps = int(np.round(total_time/step_size)+1)
@@ -30,7 +35,7 @@ def configure_environment():
 
 #RLC control
 
-def RLC(R=1@u_Ω, L=3@u_H, C=1@u_F, V_input=10@u_V, kp=0.6, kd=0, ki=0, v_d=0, v_i=0, i=0,  last_current=0, v_input =0):
+def RLC(R=1@u_Ω, L=3@u_H, C=1@u_F, V_input=10@u_V, kp=0.6, kd=0, ki=0, v_d=0, v_i=0, i=0,  last_current=0, v_input =0, period=10e20@u_s, pulse_width=1@u_s):
 
 
     circuit = Circuit('RLC with PID Feedback')
@@ -38,7 +43,7 @@ def RLC(R=1@u_Ω, L=3@u_H, C=1@u_F, V_input=10@u_V, kp=0.6, kd=0, ki=0, v_d=0, v
     circuit.PulseVoltageSource("V1", "input_base", circuit.gnd,
         initial_value=0@u_V, pulsed_value=V_input,
         delay_time=1@u_ms, rise_time=1@u_ns,
-        fall_time=1@u_us, pulse_width=1@u_s, period=10e20@u_s)
+        fall_time=1@u_us, pulse_width=pulse_width, period=period)
 
     # RLC path (driven by your B-source on 'input_c')
     circuit.L(
@@ -71,7 +76,7 @@ def RLC(R=1@u_Ω, L=3@u_H, C=1@u_F, V_input=10@u_V, kp=0.6, kd=0, ki=0, v_d=0, v
 
 def run_subsim(last_condition, last_current, step_size, v_d, v_i, i, v_input):
     C1_ic = last_condition
-    circuit  = RLC(R=1@u_Ω, L=3@u_H, C=1@u_F, V_input=1@u_V, kd=1, ki=0.7, kp=0.6, v_d=v_d, v_i=v_i, i=1, last_current=last_current, v_input=v_input)
+    circuit  = RLC(R=1@u_Ω, L=3@u_H, C=1@u_F, V_input=1@u_V, kd=kd, ki=ki, kp=kp, v_d=v_d, v_i=v_i, i=1, last_current=last_current, v_input=v_input)
     simulator = circuit.simulator(temperature=25, nominal_temperature=25)
     ## initial condition defined with simulator
     simulator.initial_condition(node2=C1_ic) #sets initial condition: voltage at node 1
@@ -82,53 +87,88 @@ def run_subsim(last_condition, last_current, step_size, v_d, v_i, i, v_input):
 
 
 def forloop():
-    time = np.array([])
-    voltage = np.array([])
-    current = np.array([])
-    int_error = np.array([])
-    dif_error = np.array([])
-    control_times = np.array([])
-    error = np.array([])
+    trajectory = Trajectory('time', 'voltage', 'current', capacity=number_of_steps*101,
+                            sizes={name: number_of_steps for name in
+                                   ('int_error', 'control_times', 'dif_error', 'error')})
+    controller = DiscreteController(step_size, rule='trapezoid')
     for i in range(1, number_of_steps):
         if i == 1:
             last_condition = C1_ic
             last_current = L1_ic
             analysis = run_subsim(last_condition, last_current, step_size, 0, 0, i, 10)
-            time = np.append(time, analysis.time)
-
-            voltage = np.append(voltage, analysis['node2'])
-            current = np.append(current, analysis['L1'])
-
-            control_times = np.append(control_times, time[-1])
-
-            #control 
-            error = np.append(error, analysis['v_tap'][-1]-1)
-            # current_at_control_time = np.append(current_at_control_time, current[-1])
-            int_error = np.append(int_error, np.trapezoid(y = error, dx = step_size))
-            # dif_current = np.append(dif_current, np.gradient(current_at_control_time, step_size)[-1])
-            dif_error = np.append(dif_error, 0)
-
+            trajectory.extend('time', analysis.time)
         else: 
             last_condition = analysis["node2"][-1]
             last_current = analysis["L1"][-1]    
-            analysis = run_subsim(last_condition, last_current, step_size, dif_error[-1], int_error[-1], i, 0)
-            time = np.append(time, np.array(np.array(analysis.time)+time[-1]))
-            
-            voltage = np.append(voltage, np.array(analysis['node2']))
-            current = np.append(current, np.array(analysis['L1']))
-
-            control_times = np.append(control_times, time[-1])
-
-            #control 
-            error = np.append(error, analysis['v_tap'][-1]-1)
-            # current_at_control_time = np.append(current_at_control_time, current[-1])
-            int_error = np.append(int_error, np.trapezoid(y = error, dx = step_size))
-            # dif_current = np.append(dif_current, np.gradient(current_at_control_time, step_size)[-1])
-            dif_error = np.append(dif_error, np.gradient(error, step_size)[-1])
-            if i == 2:
-                dif_error = np.append(dif_error, np.gradient(error, step_size)[-1])
+            analysis = run_subsim(last_condition, last_current, step_size,
+                                  trajectory.last('dif_error'), trajectory.last('int_error'), i, 0)
+            trajectory.extend('time', analysis.time, offset=trajectory.last('time'))
+
+        trajectory.extend('voltage', analysis['node2'])
+        trajectory.extend('current', analysis['L1'])
+        trajectory.append('control_times', trajectory.last('time'))
+
+        #control 
+        trajectory.append('error', analysis['v_tap'][-1]-1)
+        integral, derivative = controller.update(trajectory.last('error'))
+        trajectory.append('int_error', integral)
+        trajectory.append('dif_error', derivative)
+        if i == 2:
+            trajectory.append('dif_error', trajectory.last('dif_error'))
         # print(int_current)
-    return time, voltage, current, int_error, control_times, dif_error, error
+    return trajectory.arrays('time', 'voltage', 'current', 'int_error', 'control_times', 'dif_error', 'error')
+
+
+def forloop_cosim():
+    """
+    forloop() on a single loaded circuit: the controller output is written into
+    V5/V6 with alter between steps instead of rebuilding RLC() every step.
+    The input pulse repeats every step_size, as it restarts with each sub-run above:
+    low for the first 1 ms of every step, then high until the step ends.
+    compare() measures how far it is from forloop().
+    """
+    # delay + rise + width + fall = one step, so each period is 1 ms low + the rest high
+    width = step_size - 1e-3 - 1e-9 - 1e-6
+    circuit = RLC(R=1@u_Ω, L=3@u_H, C=1@u_F, V_input=1@u_V, kd=kd, ki=ki, kp=kp,
+                  last_current=L1_ic, period=step_size@u_s, pulse_width=width@u_s)
+    trajectory = Trajectory('time', 'voltage', 'current', capacity=number_of_steps*101,
+                            sizes={name: number_of_steps for name in
+                                   ('int_error', 'control_times', 'dif_error', 'error')})
+    controller = DiscreteController(step_size, rule='trapezoid')
+    with CoSimulation(circuit, step_size, (number_of_steps - 1)*step_size,
+                      probes=['node2', 'L1', 'v_tap'], initial_condition={'node2': C1_ic}) as cosim:
+        for i in range(1, number_of_steps):
+            samples = cosim.advance()
+            trajectory.extend('time', samples['time'])
+            trajectory.extend('voltage', samples['node2'])
+            trajectory.extend('current', samples['L1'])
+            trajectory.append('control_times', trajectory.last('time'))
+
+            #control
+            trajectory.append('error', samples['v_tap'][-1]-1)
+            integral, derivative = controller.update(trajectory.last('error'))
+            trajectory.append('int_error', integral)
+            trajectory.append('dif_error', derivative)
+            if i == 2:
+                trajectory.append('dif_error', trajectory.last('dif_error'))
+            cosim.alter('V5', dc=ki*trajectory.last('int_error'))
+            cosim.alter('V6', dc=kd*trajectory.last('dif_error'))
+    return trajectory.arrays('time', 'voltage', 'current', 'int_error', 'control_times', 'dif_error', 'error')
+
+
+def compare():
+    """
+    Runs forloop() and forloop_cosim() over the same steps; returns the largest
+    difference of each signal, the waveforms on forloop()'s time points.
+    """
+    names = ('time', 'voltage', 'current', 'int_error', 'control_times', 'dif_error', 'error')
+    reference = dict(zip(names, forloop()))
+    cosim = dict(zip(names, forloop_cosim()))
+    differences = {name: deviation(reference['time'], reference[name], cosim['time'], cosim[name])
+                   for name in ('voltage', 'current')}
+    for name in ('int_error', 'dif_error', 'error'):
+        differences[name] = float(np.max(np.abs(cosim[name] - reference[name])))
+    return differences
 
 def plot_error(control_times, error):
     """
@@ -144,11 +184,17 @@ def plot_error(control_times, error):
     plt.show()
 
 def main():
+    parser = argparse.ArgumentParser(description='PID-controlled RLC, one control step at a time.')
+    parser.add_argument('--compare', action='store_true',
+                        help='also run the rebuild-every-step forloop() and print the largest differences')
+    args = parser.parse_args()
     configure_environment()
     setup_logging()
 
-    forloop()
-    time, voltage, current, int_error, control_times, dif_error, error = forloop()
+    if args.compare:
+        for name, difference in compare().items():
+            print(f'{name:<10} {difference:.3g}')
+    time, voltage, current, int_error, control_times, dif_error, error = forloop_cosim()
     # plot_int_output(analysis, circuit, node_controlled='node_int')
     plot_error(control_times, error)
     plot_error(time, voltage)
@@ -0,0 +1,244 @@
+#!/usr/bin/env python3
+"""
+Nelder-Mead tuning of ALM()'s PID gains (Kp, Ki, Kd) with parallel, cached runs.
+
+ALM() shares one Kp/Ki/Kd between its controllers; CONTROLLERS picks which
+loop is switched on and whose error the objective scores: the spread
+against the debt-to-equity target (Spread_Err2), the FTP rate against the
+loan-to-deposit target (FTP_Err2) or the spread against the tier-1 target
+(Spread_Err3). Every run records all of OBJECTIVES for that error (ISE,
+IAE, ITAE, overshoot, settling time); the score is their weighted sum, so
+a different weighting reuses the runs already made.
+
+The search runs in gain / scale coordinates, with gains clipped at 0. Each
+Nelder-Mead iteration evaluates its reflection, expansion and both
+contractions together, and a shrink evaluates all new vertices together,
+so a batch keeps up to max(4, len(gains) + 1) workers busy. Runs go through
+sweep.py's worker, and their rows go to <directory>/results.jsonl keyed by
+run id. Tuning again in the same directory only runs gains it has not
+seen; gains are rounded to 6 significant digits for that purpose.
+
+    best = tune('debt_equity', gains=('Kp', 'Ki'), objective={'itae': 1.0, 'overshoot': 100.0},
+                backend='numpy', end_time=2000, processes=4)
+    best['gains'], best['score']
+"""
+import argparse
+import concurrent.futures
+import functools
+import json
+import os
+
+import numpy as np
+
+from sweep import _run_one, load_results, run_id
+
+CONTROLLERS = {
+    'debt_equity': ({'control_debt_equity': True, 'control_tier_1': False}, 'v_bspread_err2'),
+    'loan_deposit': ({'control_loan_desposit': True, 'control_premium': False}, 'v_bftp_err2'),
+    'tier_1': ({'control_tier_1': True, 'control_debt_equity': False}, 'v_bspread_err3'),
+}
+
+DEFAULT_GAINS = {'Kp': 0.015, 'Ki': 0.001, 'Kd': 0.0}
+SCALES = {'Kp': 0.015, 'Ki': 0.001, 'Kd': 0.01}   # one unit of the search space per gain
+
+
+# ─────────────── Objectives ───────────────
+
+def _error(analysis, vector):
+    return np.asarray(analysis.time, dtype=float), np.asarray(analysis[vector], dtype=float)
+
+
+def ise(analysis, vector):
+    """Integral of the squared error."""
+    time, error = _error(analysis, vector)
+    return float(np.trapezoid(error ** 2, time))
+
+
+def iae(analysis, vector):
+    """Integral of the absolute error."""
+    time, error = _error(analysis, vector)
+    return float(np.trapezoid(np.abs(error), time))
+
+
+def itae(analysis, vector):
+    """Integral of time times the absolute error."""
+    time, error = _error(analysis, vector)
+    return float(np.trapezoid(time * np.abs(error), time))
+
+
+def overshoot(analysis, vector, tolerance=1e-9):
+    """How far the error swings past zero against the sign of the first error, 0 without overshoot."""
+    _, error = _error(analysis, vector)
+    first = np.flatnonzero(np.abs(error) > tolerance)
+    if not first.size:
+        return 0.0
+    return float(max(0.0, np.max(-np.sign(error[first[0]]) * error)))
+
+
+def settling_time(analysis, vector, band=0.02):
+    """Last time |error| is outside `band` times its largest value; 0 when it never is."""
+    time, error = _error(analysis, vector)
+    outside = np.flatnonzero(np.abs(error) > band * np.max(np.abs(error)))
+    return float(time[outside[-1]]) if outside.size else 0.0
+
+
+OBJECTIVES = {'ise': ise, 'iae': iae, 'itae': itae, 'overshoot': overshoot, 'settling_time': settling_time}
+
+
+# ─────────────── Evaluation ───────────────
+
+def _rounded(value):
+    return float(f'{value:.6g}')
+
+
+class Evaluator:
+    """Scores gain sets on a process pool, with the runs cached in <directory>/results.jsonl."""
+
+    def __init__(self, directory, controller='debt_equity', base=None, objective=None, backend='ngspice',
+                 end_time=2000, processes=None, compiled=True):
+        flags, vector = CONTROLLERS[controller]
+        self.directory = directory
+        self.base = {**flags, **(base or {})}
+        self.objective = dict(objective or {'itae': 1.0})
+        self.kpis = {name: functools.partial(function, vector=vector) for name, function in OBJECTIVES.items()}
+        self.settings = dict(backend=backend, end_time=end_time, quiet=True, compiled=compiled)
+        self.rows = {row['run_id']: row for row in load_results(directory) if row['error'] is None}
+        self.runs = 0
+        initializer = None
+        if backend == 'ngspice':
+            from ngspice_pool import warm_up
+            initializer = warm_up
+        os.makedirs(directory, exist_ok=True)
+        self._table = open(os.path.join(directory, 'results.jsonl'), 'a')
+        self._executor = concurrent.futures.ProcessPoolExecutor(processes, initializer=initializer)
+
+    def kwargs(self, gains):
+        return {**self.base, **{name: _rounded(max(value, 0.0)) for name, value in gains.items()}}
+
+    def score(self, row):
+        if row['error'] is not None:
+            return np.inf
+        return float(sum(weight * row['kpis'][name] for name, weight in self.objective.items()))
+
+    def evaluate(self, batch):
+        """Scores of a list of {gain: value} dicts; only unseen gains are run, all at once."""
+        runs = {}
+        for gains in batch:
+            kwargs = self.kwargs(gains)
+            key = run_id(kwargs)
+            if key not in self.rows:
+                runs[key] = kwargs
+        futures = [self._executor.submit(_run_one, kwargs, (), self.kpis, self.settings['backend'],
+                                         self.settings['end_time'], os.path.join(self.directory, key),
+                                         self.settings['quiet'], self.settings['compiled'])
+                   for key, kwargs in runs.items()]
+        for future in futures:
+            row = future.result()
+            self.rows[row['run_id']] = row
+            self._table.write(json.dumps(row, default=float) + '\n')
+        self._table.flush()
+        self.runs += len(futures)
+        return [self.score(self.rows[run_id(self.kwargs(gains))]) for gains in batch]
+
+    def close(self):
+        self._executor.shutdown(cancel_futures=True)
+        self._table.close()
+
+
+# ─────────────── Nelder-Mead ───────────────
+
+def nelder_mead(evaluate, x0, step=0.5, max_evaluations=80, xtol=1e-3, ftol=1e-4):
+    """
+    Minimises evaluate(list of points) -> list of values from x0.
+
+    Returns (best point, best value, number of points evaluated). The
+    candidates of one iteration are evaluated as one batch.
+    """
+    x0 = np.asarray(x0, dtype=float)
+    simplex = [x0] + [x0 + step * np.eye(x0.size)[k] for k in range(x0.size)]
+    values = evaluate(simplex)
+    evaluations = len(simplex)
+    while evaluations < max_evaluations:
+        order = np.argsort(values)
+        simplex, values = [simplex[k] for k in order], [values[k] for k in order]
+        size = max(np.max(np.abs(point - simplex[0])) for point in simplex[1:])
+        if size < xtol and abs(values[-1] - values[0]) <= ftol * max(abs(values[0]), 1e-12):
+            break
+        centroid = np.mean(simplex[:-1], axis=0)
+        worst = simplex[-1]
+        reflected = centroid + (centroid - worst)
+        candidates = [reflected, centroid + 2 * (centroid - worst),          # reflection, expansion
+                      centroid + 0.5 * (reflected - centroid), centroid + 0.5 * (worst - centroid)]
+        f_reflected, f_expanded, f_outside, f_inside = evaluate(candidates)
+        evaluations += len(candidates)
+        if f_reflected < values[0]:
+            new = (candidates[1], f_expanded) if f_expanded < f_reflected else (reflected, f_reflected)
+        elif f_reflected < values[-2]:
+            new = (reflected, f_reflected)
+        elif f_reflected < values[-1] and f_outside <= f_reflected:
+            new = (candidates[2], f_outside)
+        elif f_reflected >= values[-1] and f_inside < values[-1]:
+            new = (candidates[3], f_inside)
+        else:
+            shrunk = [simplex[0] + 0.5 * (point - simplex[0]) for point in simplex[1:]]
+            simplex = [simplex[0]] + shrunk
+            values = [values[0]] + evaluate(shrunk)
+            evaluations += len(shrunk)
+            continue
+        simplex[-1], values[-1] = new
+    best = int(np.argmin(values))
+    return simplex[best], values[best], evaluations
+
+
+def tune(controller='debt_equity', gains=('Kp', 'Ki'), objective=None, directory=None, base=None, start=None,
+         backend='ngspice', end_time=2000, processes=None, max_evaluations=80, compiled=True):
+    """
+    Tunes `gains` of one controller; returns {'gains', 'score', 'kpis', 'runs', 'evaluations'}.
+
+    start defaults to ALM()'s hand-picked gains, base holds other ALM() kwargs.
+    """
+    gains = list(gains)
+    directory = directory or os.path.join('tuning', controller)
+    start = {**DEFAULT_GAINS, **(start or {})}
+    scale = np.array([SCALES[name] for name in gains])
+    evaluator = Evaluator(directory, controller, base, objective, backend, end_time, processes, compiled)
+
+    def to_gains(point):
+        return {name: value for name, value in zip(gains, (point * scale).tolist())}
+
+    try:
+        point, score, evaluations = nelder_mead(lambda points: evaluator.evaluate([to_gains(p) for p in points]),
+                                                np.array([start[name] for name in gains]) / scale,
+                                                max_evaluations=max_evaluations)
+        best = evaluator.kwargs(to_gains(point))
+        row = evaluator.rows[run_id(best)]
+    finally:
+        evaluator.close()
+    return {'gains': {name: best[name] for name in gains}, 'score': score, 'kpis': row['kpis'],
+            'runs': evaluator.runs, 'evaluations': evaluations}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Nelder-Mead tuning of ALM()'s PID gains.")
+    parser.add_argument('--controller', default='debt_equity', choices=sorted(CONTROLLERS))
+    parser.add_argument('--gains', default='Kp,Ki', help='comma-separated subset of Kp,Ki,Kd')
+    parser.add_argument('--objective', default='itae=1',
+                        help=f"weighted sum, e.g. itae=1,overshoot=100; terms: {', '.join(OBJECTIVES)}")
+    parser.add_argument('--output', help='result directory (default: tuning/<controller>)')
+    parser.add_argument('--backend', default='ngspice', choices=['ngspice', 'numpy'])
+    parser.add_argument('--end-time', type=float, default=2000)
+    parser.add_argument('--processes', type=int)
+    parser.add_argument('--max-evaluations', type=int, default=80)
+    args = parser.parse_args()
+
+    objective = {name: float(weight) for name, weight in (term.split('=') for term in args.objective.split(','))}
+    result = tune(args.controller, args.gains.split(','), objective, args.output, backend=args.backend,
+                  end_time=args.end_time, processes=args.processes, max_evaluations=args.max_evaluations)
+    print(f"best {result['gains']} score {result['score']:.6g} "
+          f"({result['evaluations']} points, {result['runs']} new runs)")
+    for name, value in result['kpis'].items():
+        print(f'  {name:<14} {value:.6g}')
+
+
+if __name__ == '__main__':
+    main()
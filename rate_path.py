@@ -0,0 +1,63 @@
+"""
+Rate paths as one PWL source.
+
+steps() used to add one PULSE source per rate change plus a B source that
+summed all of them, so a ZOH schedule with hundreds of changes grew the
+netlist, the matrix and the sum expression by hundreds of terms. The same
+staircase is a single PWL source: its corners are ngspice breakpoints, so
+each change is still hit exactly, while the element count stays constant.
+
+The pulses are given as (rate, delay_time, pulse_width) like steps()
+computes them. ngspice replaces their zero rise/fall times with the .tran
+step, so the PWL ramps over `ramp` seconds (pass the step time) to give
+the same waveform as the old pulse sum.
+"""
+import numpy as np
+from PySpice.Unit import u_s, u_V
+
+
+def pulse_train_points(pulses, ramp):
+    """
+    PWL corners (times, values) of the sum of trapezoidal pulses.
+
+    Each pulse rises over `ramp` from delay_time, holds for pulse_width and
+    falls over `ramp`. Every pulse is evaluated only at the corners inside
+    its own support, so a staircase of n steps costs O(n log n); corners
+    where the slope does not change are dropped.
+    """
+    if not len(pulses):
+        return np.array([0.0]), np.array([0.0])
+    rate, delay, width = (np.asarray(column, dtype=float) for column in zip(*pulses))
+    width = np.maximum(width, 0.0)
+    end = delay + 2*ramp + width
+    times = np.sort(np.concatenate([[0.0], delay, delay + ramp, delay + ramp + width, end]))
+    # corners that only differ by rounding (one pulse's end, the next one's start) are merged
+    tolerance = 1e-9 * np.maximum(1.0, np.abs(times))
+    times = times[np.concatenate([[True], np.diff(times) > tolerance[1:]])]
+
+    values = np.zeros(len(times))
+    low = np.searchsorted(times, delay - 1e-9 * np.maximum(1.0, np.abs(delay)))
+    high = np.searchsorted(times, end + 1e-9 * np.maximum(1.0, np.abs(end)), side='right')
+    for r, d, e, lo, hi in zip(rate.tolist(), delay.tolist(), end.tolist(), low.tolist(), high.tolist()):
+        t = times[lo:hi]
+        level = np.clip(np.minimum(t - d, e - t) / ramp, 0.0, 1.0)
+        level[np.isclose(level, 1.0, rtol=0, atol=1e-9)] = 1.0
+        level[level < 1e-9] = 0.0
+        values[lo:hi] += r * level
+
+    slopes = np.diff(values) / np.diff(times)
+    keep = np.ones(len(times), dtype=bool)
+    keep[1:-1] = ~np.isclose(slopes[1:], slopes[:-1], rtol=1e-9, atol=1e-12 * (np.max(np.abs(slopes)) + 1))
+    return times[keep], values[keep]
+
+
+def pwl_values(pulses, ramp):
+    """[(time, value), ...] for PieceWiseLinearVoltageSource(values=...)."""
+    times, values = pulse_train_points(pulses, ramp)
+    return [(t @ u_s, v @ u_V) for t, v in zip(times.tolist(), values.tolist())]
+
+
+def add_rate_path(circuit, name, pulses, ramp):
+    """Adds V<name>_path driving node <name>_preset with the summed pulse train."""
+    return circuit.PieceWiseLinearVoltageSource(f'{name}_path', f'{name}_preset', circuit.gnd,
+                                                values=pwl_values(pulses, ramp))
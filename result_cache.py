@@ -0,0 +1,124 @@
+"""
+Content-addressed disk cache for transient results.
+
+A circuit's netlist text plus the .tran settings fully determine its
+analysis, so the SHA-256 of both is the cache key. Each entry is one .npz
+holding the time axis and every node and branch vector. Entries are
+written to a temporary file and renamed into place, so concurrent sweep
+workers never see a half-written file; two workers racing on the same key
+simply both write the same result. A hit refreshes the entry's mtime and
+the oldest entries are evicted once the directory grows past max_bytes,
+along with temporary files a crashed write left behind.
+
+Nothing is cached unless asked for: pass cache=default_cache (or a
+ResultCache of your own) to run_transient() / ALMTemplate.transient().
+"""
+import hashlib
+import os
+import tempfile
+import time
+
+import numpy as np
+
+from state_space import StateSpaceAnalysis
+
+STALE_TEMPORARY = 3600    # seconds before an unfinished .tmp write counts as crashed
+
+DEFAULT_DIRECTORY = os.environ.get('ALM_CACHE_DIR',
+                                   os.path.join(os.path.expanduser('~'), '.cache', 'alm_results'))
+
+
+class ResultCache:
+    """LRU-bounded directory of analysis results keyed by netlist + settings."""
+
+    def __init__(self, directory=DEFAULT_DIRECTORY, max_bytes=2 * 1024**3):
+        self.directory = directory
+        self.max_bytes = max_bytes
+
+    @staticmethod
+    def key(circuit, **settings):
+        digest = hashlib.sha256(str(circuit).encode())
+        for name in sorted(settings):
+            digest.update(f'\n{name}={settings[name]!r}'.encode())
+        return digest.hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.directory, f'{key}.npz')
+
+    def get(self, key):
+        """The cached analysis for `key`, or None."""
+        path = self._path(key)
+        try:
+            with np.load(path) as data:
+                arrays = {name: data[name] for name in data.files}
+            os.utime(path)
+        except (FileNotFoundError, OSError, ValueError):
+            return None  # missing, evicted meanwhile or unreadable
+        nodes = {name[5:]: value for name, value in arrays.items() if name.startswith('node:')}
+        branches = {name[7:]: value for name, value in arrays.items() if name.startswith('branch:')}
+        return StateSpaceAnalysis(arrays['time'], nodes, branches)
+
+    def put(self, key, analysis):
+        os.makedirs(self.directory, exist_ok=True)
+        arrays = {'time': np.asarray(analysis.time, dtype=float)}
+        arrays.update({f'node:{name}': np.asarray(value, dtype=float)
+                       for name, value in analysis.nodes.items()})
+        arrays.update({f'branch:{name}': np.asarray(value, dtype=float)
+                       for name, value in analysis.branches.items()})
+        handle, temporary = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        try:
+            with os.fdopen(handle, 'wb') as file:
+                np.savez(file, **arrays)
+            os.replace(temporary, self._path(key))
+        except BaseException:
+            os.unlink(temporary)
+            raise
+        self.evict()
+
+    def evict(self):
+        """Removes least recently used entries until the cache fits in max_bytes, and stale .tmp files."""
+        if not os.path.isdir(self.directory):
+            return
+        entries = []
+        stale = time.time() - STALE_TEMPORARY
+        with os.scandir(self.directory) as scan:
+            for entry in scan:
+                if not entry.name.endswith(('.npz', '.tmp')):
+                    continue
+                try:
+                    stat = entry.stat()
+                    if entry.name.endswith('.tmp'):
+                        if stat.st_mtime < stale:
+                            os.unlink(entry.path)
+                        continue
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass  # another worker got there first
+            total -= size
+
+    def clear(self):
+        max_bytes, self.max_bytes = self.max_bytes, -1
+        try:
+            self.evict()
+        finally:
+            self.max_bytes = max_bytes
+
+    def fetch(self, circuit, run, **settings):
+        """Cached result for circuit + settings, calling run() and storing it on a miss."""
+        key = self.key(circuit, **settings)
+        analysis = self.get(key)
+        if analysis is None:
+            analysis = run()
+            self.put(key, analysis)
+        return analysis
+
+
+default_cache = ResultCache()
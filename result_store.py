@@ -0,0 +1,124 @@
+"""
+Columnar on-disk store for transient results.
+
+Each run is a directory with one .npy file per vector and a manifest.json
+naming them:
+
+    <root>/<run_id>/manifest.json   {"time": ..., "nodes": {...}, "branches": {...}, "metadata": {...}}
+    <root>/<run_id>/0000.npy        one float64 column per vector
+
+Vector files are numbered rather than named after the vector, since SPICE
+names may contain characters that are not valid in file names. StoredRun
+mirrors the analysis interface plotting() uses (`time`, `nodes`,
+`branches`, case-insensitive item access) and memory-maps each column the
+first time it is read, so opening a run costs only the manifest.
+"""
+import collections.abc
+import json
+import os
+import uuid
+
+import numpy as np
+
+MANIFEST = 'manifest.json'
+
+
+class _LazyVectors(collections.abc.Mapping):
+    """name -> memory-mapped column, opened on first access."""
+
+    def __init__(self, directory, files):
+        self._directory = directory
+        self._files = files
+        self._open = {}
+
+    def __getitem__(self, name):
+        if name not in self._open:
+            path = os.path.join(self._directory, self._files[name])
+            self._open[name] = np.load(path, mmap_mode='r')
+        return self._open[name]
+
+    def __iter__(self):
+        return iter(self._files)
+
+    def __len__(self):
+        return len(self._files)
+
+
+class StoredRun:
+    """Read-only view of a saved run; vectors are memory-mapped lazily."""
+
+    def __init__(self, directory):
+        self.directory = directory
+        with open(os.path.join(directory, MANIFEST)) as file:
+            manifest = json.load(file)
+        self.metadata = manifest.get('metadata', {})
+        self._time_file = manifest['time']
+        self.nodes = _LazyVectors(directory, manifest['nodes'])
+        self.branches = _LazyVectors(directory, manifest['branches'])
+        self._time = None
+
+    @property
+    def time(self):
+        if self._time is None:
+            self._time = np.load(os.path.join(self.directory, self._time_file), mmap_mode='r')
+        return self._time
+
+    def __getitem__(self, name):
+        for key in (name, name.lower()):
+            if key in self.nodes:
+                return self.nodes[key]
+            if key in self.branches:
+                return self.branches[key]
+        raise IndexError(name)
+
+    def __contains__(self, name):
+        return any(key in self.nodes or key in self.branches for key in (name, name.lower()))
+
+    def load(self, *names):
+        """Copies the named vectors into memory, e.g. before the files are removed."""
+        return {name: np.array(self[name]) for name in names}
+
+
+def save_run(directory, analysis, metadata=None):
+    """Writes the time, node and branch vectors of `analysis` below `directory`."""
+    os.makedirs(directory, exist_ok=True)
+    manifest = {'time': None, 'nodes': {}, 'branches': {}, 'metadata': metadata or {}}
+    columns = [('time', None, analysis.time)]
+    columns += [('nodes', name, value) for name, value in analysis.nodes.items()]
+    columns += [('branches', name, value) for name, value in analysis.branches.items()]
+    for number, (group, name, value) in enumerate(columns):
+        file = f'{number:04d}.npy'
+        np.save(os.path.join(directory, file), np.asarray(value, dtype=np.float64))
+        if group == 'time':
+            manifest['time'] = file
+        else:
+            manifest[group][name] = file
+    # the manifest goes last, so a run without one was interrupted while writing
+    temporary = os.path.join(directory, f'.{MANIFEST}.{uuid.uuid4().hex}')
+    with open(temporary, 'w') as file:
+        json.dump(manifest, file, indent=1, default=str)
+    os.replace(temporary, os.path.join(directory, MANIFEST))
+    return StoredRun(directory)
+
+
+class ResultStore:
+    """A directory of saved runs addressed by run id."""
+
+    def __init__(self, root='results'):
+        self.root = root
+
+    def save(self, analysis, run_id=None, **metadata):
+        run_id = run_id or uuid.uuid4().hex[:12]
+        return save_run(os.path.join(self.root, run_id), analysis, metadata)
+
+    def open(self, run_id):
+        return StoredRun(os.path.join(self.root, run_id))
+
+    def __contains__(self, run_id):
+        return os.path.exists(os.path.join(self.root, run_id, MANIFEST))
+
+    def run_ids(self):
+        """Ids of every complete run in the store."""
+        if not os.path.isdir(self.root):
+            return []
+        return sorted(name for name in os.listdir(self.root) if name in self)
@@ -0,0 +1,160 @@
+#!/usr/bin/env python3
+"""
+Headless batch runner for ALM() scenario files.
+
+A scenario file (JSON, or YAML when PyYAML is installed) names the runs
+and how to run them; everything but `scenarios` is optional:
+
+    {
+      "backend": "ngspice", "end_time": 5000, "processes": 4,
+      "defaults": {"Kd": 0.0},
+      "scenarios": {"base": {}, "tight": {"Kp": 0.03, "Ki": 0.002}},
+      "vectors": ["v_bspread", "v_bftp_rate"],
+      "kpis": {"final_spread": "final:v_bspread"},
+      "balance_kpis": ["Return_on_Equity", "Liquidity_Coverage_Ratio"],
+      "plots": ["v_bspread"]
+    }
+
+`scenarios` is a {name: ALM kwargs} mapping or a list of kwargs dicts with
+an optional "name". The runs go through sweep.sweep(), so they run in a
+process pool and are resumable. Each run's row is appended to
+<output>/results.jsonl and its vectors are saved under <output>/vectors/.
+`kpis` are kpi_value() specs. `balance_kpis` are kpi.py ratios, whose
+final and mean values are computed from the saved balances. One line per
+scenario goes to <output>/summary.csv.
+
+matplotlib is imported only when `plots` (or --plots) asks for figures.
+It then uses the Agg backend, and one PNG per scenario is written to
+<output>/plots/.
+
+    python run_scenarios.py nightly.json --output runs/nightly --processes 8
+"""
+import argparse
+import csv
+import json
+import os
+
+os.environ.setdefault('MPLBACKEND', 'Agg')   # workers never open a window
+
+from kpi import KPI_VECTORS, balances, kpis as balance_kpis
+from sweep import load_vectors, run_id, sweep
+
+DEFAULT_VECTORS = [
+    'v_btarget_debt-to-equity_ratio', 'v_bdebt_to_equity_ratio1', 'v_bspread',
+    'v_btarget_loan-to-deposit_ratio', 'v_bloan-to-deposit_ratio1',
+    'v_bt_rate', 'v_bftp_rate', 'v_btotal_assets', 'v_btotal_liabilities', 'v_btotal_equity',
+]
+
+
+def load_scenario_file(path):
+    """The scenario file as a dict; YAML needs PyYAML."""
+    with open(path) as file:
+        if path.lower().endswith(('.yaml', '.yml')):
+            try:
+                import yaml
+            except ImportError:
+                raise SystemExit(f'{path}: reading YAML needs PyYAML (pip install pyyaml), or use JSON')
+            return yaml.safe_load(file)
+        return json.load(file)
+
+
+def scenarios(spec):
+    """[(name, ALM kwargs)] with the file's defaults applied."""
+    defaults = dict(spec.get('defaults') or {})
+    entries = spec['scenarios']
+    if isinstance(entries, dict):
+        entries = [dict(kwargs or {}, name=name) for name, kwargs in entries.items()]
+    named = []
+    for k, entry in enumerate(entries):
+        entry = dict(entry)
+        name = str(entry.pop('name', f'scenario_{k}'))
+        named.append((name, {**defaults, **entry}))
+    return named
+
+
+def summarise(directory, named, rows, kpi_names, balance_names):
+    """Writes <directory>/summary.csv and returns its rows."""
+    by_id = {row['run_id']: row for row in rows}
+    table = []
+    for name, kwargs in named:
+        row = by_id.get(run_id(kwargs), {'run_id': run_id(kwargs), 'kpis': {}, 'error': 'not run'})
+        line = {'scenario': name, 'run_id': row['run_id'], 'error': row['error'] or ''}
+        line.update({kpi: row['kpis'].get(kpi, '') for kpi in kpi_names})
+        if balance_names and row['error'] is None:
+            values = balance_kpis(balances(load_vectors(directory, row), kwargs.get('q_E0', 20)), balance_names)
+            for kpi, series in values.items():
+                line[f'{kpi}:final'] = float(series[-1])
+                line[f'{kpi}:mean'] = float(series.mean())
+        table.append(line)
+
+    columns = ['scenario', 'run_id', 'error', *kpi_names]
+    columns += [f'{kpi}:{reduction}' for kpi in balance_names for reduction in ('final', 'mean')]
+    with open(os.path.join(directory, 'summary.csv'), 'w', newline='') as file:
+        writer = csv.DictWriter(file, columns, restval='')
+        writer.writeheader()
+        writer.writerows(table)
+    return table
+
+
+def save_plots(directory, named, rows, vectors):
+    """One PNG of `vectors` per finished scenario under <directory>/plots/."""
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+
+    os.makedirs(os.path.join(directory, 'plots'), exist_ok=True)
+    by_id = {row['run_id']: row for row in rows}
+    for name, kwargs in named:
+        row = by_id.get(run_id(kwargs))
+        if row is None or row['error'] is not None:
+            continue
+        run = load_vectors(directory, row)
+        figure, axes = plt.subplots()
+        for vector in vectors:
+            axes.plot(run.time, run[vector], label=vector)
+        axes.set_xlabel('Time [s]')
+        axes.set_title(name)
+        axes.legend()
+        figure.savefig(os.path.join(directory, 'plots', f'{name}.png'))
+        plt.close(figure)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Runs the ALM() scenarios of a JSON/YAML file, headless.')
+    parser.add_argument('scenario_file')
+    parser.add_argument('--output', help='result directory (default: the file name without extension)')
+    parser.add_argument('--backend', choices=['ngspice', 'numpy'])
+    parser.add_argument('--end-time', type=float)
+    parser.add_argument('--processes', type=int)
+    parser.add_argument('--plots', action='store_true', help="also plot the file's `plots` (or vectors)")
+    args = parser.parse_args()
+
+    spec = load_scenario_file(args.scenario_file)
+    directory = args.output or spec.get('output') or os.path.splitext(args.scenario_file)[0]
+    named = scenarios(spec)
+    kpi_specs = dict(spec.get('kpis') or {})
+    balance_names = list(spec.get('balance_kpis') or [])
+    plots = spec.get('plots') or []
+    if args.plots and not plots:
+        plots = spec.get('vectors') or DEFAULT_VECTORS
+    vectors = sorted({*(spec.get('vectors') or DEFAULT_VECTORS), *plots,
+                      *(KPI_VECTORS if balance_names else ())})
+
+    rows = sweep([kwargs for _, kwargs in named], directory, vectors=vectors, kpis=kpi_specs,
+                 processes=args.processes or spec.get('processes'),
+                 backend=args.backend or spec.get('backend', 'ngspice'),
+                 end_time=args.end_time or spec.get('end_time', 5000),
+                 compiled=spec.get('compiled', True))
+    table = summarise(directory, named, rows, list(kpi_specs), balance_names)
+    if plots:
+        save_plots(directory, named, rows, plots)
+
+    failed = [line for line in table if line['error']]
+    print(f'{len(table) - len(failed)}/{len(table)} scenarios finished, results in {directory}')
+    for line in failed:
+        print(f"  {line['scenario']}: {line['error']}")
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
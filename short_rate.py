@@ -0,0 +1,156 @@
+#!/usr/bin/env python3
+"""
+Short-rate paths (Vasicek, CIR, Hull-White) driving ALM()'s T_rate, all in one pass.
+
+rate_paths() draws N paths at once with Euler-Maruyama, as one (N, steps)
+array. alm_paths() builds ALM() once and compiles it for the state-space
+backend with the preset T_rate source (and the delayed FTP copy of it that
+control_premium uses) replaced by one path per state column
+(compile_circuit(paths=...)). All N balance sheets then advance together,
+one RK4 step at a time, in one process. distributions() turns the result
+into percentile bands of net interest income and total equity.
+
+    times, rates = rate_paths('cir', paths=2000, seed=7)
+    bands = distributions(alm_paths(times, rates, save=PATH_VECTORS))
+    bands['total_equity']                  # (percentiles, time)
+
+Rates are in the same units as preset_T_rates, time in ALM() seconds. The
+parameters of each model are keyword arguments of its function below.
+"""
+import argparse
+import contextlib
+import io
+import time as timer
+
+import numpy as np
+
+from instrumentation import phase
+from kpi import KPI_VECTORS, balances, kpis
+
+PATH_VECTORS = KPI_VECTORS + ['v_bt_rate', 'v_bftp_rate', 'v_bspread']
+
+PERCENTILES = (5, 25, 50, 75, 95)
+
+
+# ─────────────── Short-rate models ───────────────
+
+def vasicek(rng, paths, times, r0=0.035, a=2e-3, b=0.02, sigma=2e-4):
+    """dr = a (b - r) dt + sigma dW."""
+    rates = np.empty((paths, times.size))
+    rates[:, 0] = r0
+    for k, dt in enumerate(np.diff(times)):
+        r = rates[:, k]
+        rates[:, k + 1] = r + a * (b - r) * dt + sigma * np.sqrt(dt) * rng.standard_normal(paths)
+    return rates
+
+
+def cir(rng, paths, times, r0=0.035, a=2e-3, b=0.02, sigma=1.5e-3):
+    """dr = a (b - r) dt + sigma sqrt(r) dW, full truncation so rates stay >= 0."""
+    rates = np.empty((paths, times.size))
+    rates[:, 0] = r0
+    for k, dt in enumerate(np.diff(times)):
+        r = np.maximum(rates[:, k], 0.0)
+        rates[:, k + 1] = np.maximum(
+            rates[:, k] + a * (b - r) * dt + sigma * np.sqrt(r * dt) * rng.standard_normal(paths), 0.0)
+    return rates
+
+
+def preset_curve(times, rates=None, change_times=None):
+    """ALM()'s preset T_rate staircase on `times`, holding the last rate."""
+    from alm_template import DEFAULTS
+    rates = np.asarray(DEFAULTS['preset_T_rates'] if rates is None else rates, dtype=float)
+    change_times = np.asarray(DEFAULTS['preset_T_times'] if change_times is None else change_times, dtype=float)
+    return rates[np.minimum(np.searchsorted(change_times, times, side='right'), rates.size - 1)]
+
+
+def hull_white(rng, paths, times, r0=None, a=2e-3, sigma=2e-4, curve=None):
+    """
+    dr = (theta(t) - a r) dt + sigma dW, with theta fitted so the mean follows `curve`.
+
+    curve is an array of rates on `times` (default: the preset T_rate
+    staircase); theta dt is df + a f dt, so steps in the curve move every
+    path by the same amount.
+    """
+    curve = preset_curve(times) if curve is None else np.asarray(curve, dtype=float)
+    rates = np.empty((paths, times.size))
+    rates[:, 0] = curve[0] if r0 is None else r0
+    for k, dt in enumerate(np.diff(times)):
+        r = rates[:, k]
+        rates[:, k + 1] = (r + (curve[k + 1] - curve[k]) + a * (curve[k] - r) * dt
+                           + sigma * np.sqrt(dt) * rng.standard_normal(paths))
+    return rates
+
+
+MODELS = {'vasicek': vasicek, 'cir': cir, 'hull_white': hull_white}
+
+
+def rate_paths(model='vasicek', paths=1000, end_time=5000, step_time=1.0, seed=0, **parameters):
+    """(times, rates of shape (paths, len(times))) of one MODELS entry."""
+    times = np.linspace(0.0, float(end_time), int(round(end_time / step_time)) + 1)
+    rng = np.random.default_rng(seed)
+    return times, MODELS[model](rng, paths, times, **parameters)
+
+
+# ─────────────── ALM over all paths ───────────────
+
+def alm_paths(times, rates, end_time=None, step_time=1.0, record_step=10.0, save=PATH_VECTORS, **kwargs):
+    """
+    ALM(**kwargs) driven by every row of `rates` as its T_rate path.
+
+    Returns a StateSpaceAnalysis whose vectors have shape (paths, records).
+    T_rate still adds the t_rate_shock source, so Trate_shock works on top
+    of the paths. With control_premium and use_time_delay, the FTP path is
+    the same path shifted by time_delay (and held at its first rate before
+    that).
+    """
+    from BEP_alm_v12 import ALM
+    from alm_template import DEFAULTS
+    from state_space import compile_circuit
+
+    kwargs = {'use_preset_Trate': True, **kwargs}
+    values = {**DEFAULTS, **kwargs}
+    if not values['use_preset_Trate']:
+        raise ValueError('the rate paths replace the preset T_rate source; use_preset_Trate must be True')
+    with contextlib.redirect_stdout(io.StringIO()):   # ALM() prints its netlist
+        circuit = ALM(**kwargs)
+    times, rates = np.asarray(times, dtype=float), np.atleast_2d(rates)
+    sources = {'VTrate_path': (times, rates)}
+    if values['control_premium'] and values['use_time_delay'] == True and not values['use_preset_FTP']:
+        sources['VFTP_path'] = (times + values['time_delay'], rates)
+    with phase('compile'):
+        model = compile_circuit(circuit, paths=sources)
+    with phase('solve'):
+        return model.simulate_paths(step_time, times[-1] if end_time is None else end_time,
+                                    record_step=record_step, save=save)
+
+
+def distributions(analysis, initial_equity=20.0, percentiles=PERCENTILES):
+    """{'net_interest_income', 'total_equity', 'Return_on_Equity': (percentiles, time)} over the paths."""
+    values = kpis(balances(analysis, initial_equity), ['total_equity', 'Return_on_Equity'])
+    values['net_interest_income'] = np.asarray(analysis['lnii'], dtype=float)
+    return {name: np.nanpercentile(value, percentiles, axis=0) for name, value in values.items()}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Short-rate paths through ALM(), all paths in one pass.')
+    parser.add_argument('--model', default='vasicek', choices=sorted(MODELS))
+    parser.add_argument('--paths', type=int, default=1000)
+    parser.add_argument('--end-time', type=float, default=5000)
+    parser.add_argument('--step-time', type=float, default=1.0)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    start = timer.perf_counter()
+    times, rates = rate_paths(args.model, args.paths, args.end_time, args.step_time, args.seed)
+    analysis = alm_paths(times, rates, step_time=args.step_time)
+    bands = distributions(analysis)
+    elapsed = timer.perf_counter() - start
+
+    print(f'{args.paths} {args.model} paths to t={args.end_time:g} in {elapsed:.2f} s, final values:')
+    print(f"{'':<24}" + ''.join(f'{f"p{p:g}":>10}' for p in PERCENTILES))
+    for name, band in bands.items():
+        print(f'{name:<24}' + ''.join(f'{value:>10.4g}' for value in band[:, -1]))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,908 @@
+"""
+NumPy/SciPy state-space backend for the PySpice circuits in this repo.
+
+compile_circuit() turns the inductors, K couplings, capacitors, resistors,
+behavioral sources and XSPICE int/d_dt blocks of a Circuit into an ODE
+system; StateSpaceModel.simulate() integrates it in-process with a stiff
+SciPy solver and returns an analysis-like object keyed by the same vector
+names ngspice produces ('v_btotal_assets', 'lloans', 'n001', ...).
+
+Formulation (modified nodal analysis, reduced to an ODE):
+
+  * nodes driven by a voltage source (V, PULSE, B v=..., XSPICE outputs)
+    are known functions of state and time;
+  * nodes with a capacitor carry their voltage as a state;
+  * nodes with a resistor are solved from KCL as a linear system;
+  * nodes that only touch inductors and current sources (inductor cutsets,
+    e.g. N007 or N009 in the ALM) turn KCL into a constraint on the
+    inductor currents. The currents are split into a particular part fixed
+    by the sources and a free part in the nullspace of the constraint, and
+    the free part is integrated as generalized flux psi = N^T M i, so that
+    no derivative of the source currents is ever needed.
+
+compile_circuit(paths=...) replaces the waveform of chosen PWL/V sources by
+one row per state column, so a (n, K) state carries K scenarios of the same
+circuit (e.g. K short-rate paths driving T_rate) and
+StateSpaceModel.simulate_paths() advances all of them together, one
+fixed RK4 step at a time.
+
+The derivative blocks (XSPICE d_dt) are realised as a first-order filtered
+derivative with time constant tau_d. Branch currents of voltage sources
+('v1', 'bincentive_to_borrow', ...) follow from KCL at one of their
+terminals, with ngspice's sign: positive into the + terminal.
+"""
+import re
+
+import numpy as np
+
+from instrumentation import add_stats, phase
+
+
+SPICE_SUFFIXES = {
+    't': 1e12, 'g': 1e9, 'meg': 1e6, 'k': 1e3,
+    'm': 1e-3, 'u': 1e-6, 'n': 1e-9, 'p': 1e-12, 'f': 1e-15,
+}
+
+FUNCTIONS = {
+    'abs': 'np.abs', 'sqrt': 'np.sqrt', 'exp': 'np.exp', 'ln': 'np.log',
+    'log': 'np.log', 'log10': 'np.log10', 'sin': 'np.sin', 'cos': 'np.cos',
+    'tan': 'np.tan', 'tanh': 'np.tanh', 'atan': 'np.arctan',
+    'min': 'np.minimum', 'max': 'np.maximum', 'pow': 'np.power',
+}
+
+_TOKEN = re.compile(r"""
+    \s*(?:
+      (?P<number>(?:\d+\.?\d*|\.\d+)(?:[eE][+-]?\d+)?)(?P<suffix>[a-zA-Z]*)
+    | (?P<probe>[IiVv])\s*\(\s*(?P<arg1>[^,()\s]+)\s*(?:,\s*(?P<arg2>[^,()\s]+)\s*)?\)
+    | (?P<name>[A-Za-z_][A-Za-z_0-9]*)
+    | (?P<op>\*\*|\^|[-+*/(),{}])
+    )""", re.VERBOSE)
+
+
+def spice_number(text):
+    """Parses a SPICE number such as '1Meg', '0.5', '10u' into a float."""
+    text = str(text).strip()
+    sign = -1.0 if text.startswith('-') else 1.0
+    match = _TOKEN.fullmatch(text.lstrip('+-'))
+    if match is None or match.group('number') is None:
+        raise ValueError(f"not a SPICE number: {text!r}")
+    return sign * float(match.group('number')) * _suffix_scale(match.group('suffix'))
+
+
+def _suffix_scale(suffix):
+    suffix = suffix.lower()
+    if suffix.startswith('meg'):
+        return SPICE_SUFFIXES['meg']
+    if suffix[:1] in SPICE_SUFFIXES:
+        return SPICE_SUFFIXES[suffix[:1]]
+    return 1.0
+
+
+def translate_expression(expression, parameters, probe):
+    """
+    Translates an ngspice behavioral expression into Python source.
+
+    Args:
+      expression   str        – e.g. '{q_C0} + I(BCurrent_Deposits_output)'
+      parameters   dict       – lower-case .param name -> float
+      probe        callable   – probe(kind, name) -> Python source for
+                                I(name) (kind 'i') or V(name) (kind 'v')
+    """
+    out = []
+    position = 0
+    expression = str(expression).strip()
+    while position < len(expression):
+        match = _TOKEN.match(expression, position)
+        if match is None or match.end() == position:
+            raise ValueError(f"cannot parse {expression[position:]!r} in {expression!r}")
+        position = match.end()
+        if match.group('number') is not None:
+            value = float(match.group('number')) * _suffix_scale(match.group('suffix'))
+            out.append(repr(value))
+        elif match.group('probe') is not None:
+            kind = match.group('probe').lower()
+            if kind == 'v' and match.group('arg2') is not None:
+                out.append(f"({probe('v', match.group('arg1'))} - {probe('v', match.group('arg2'))})")
+            elif kind == 'i' and match.group('arg2') is not None:
+                raise ValueError(f"I() takes a single element name in {expression!r}")
+            else:
+                out.append(probe(kind, match.group('arg1')))
+        elif match.group('name') is not None:
+            name = match.group('name').lower()
+            if name in parameters:
+                out.append(repr(parameters[name]))
+            elif name == 'time':
+                out.append('t')
+            elif name in FUNCTIONS:
+                out.append(FUNCTIONS[name])
+            else:
+                raise ValueError(f"unknown name {match.group('name')!r} in {expression!r}")
+        else:
+            op = match.group('op')
+            out.append({'^': '**', '{': '(', '}': ')'}.get(op, op))
+    return ' '.join(out)
+
+
+def evaluate_parameters(circuit):
+    """Returns the circuit's .param values as a lower-case name -> float dict."""
+    parameters = {}
+    for name, value in circuit._parameters.items():
+        source = translate_expression(value, parameters, _no_probe)
+        parameters[name.lower()] = float(eval(source, {'np': np}))
+    return parameters
+
+
+def _no_probe(kind, name):
+    raise ValueError(f"{kind.upper()}({name}) is not allowed in a parameter")
+
+
+def pulse(t, v1, v2, td, tr, tf, pw, per):
+    """ngspice PULSE waveform, vectorised over t."""
+    if np.ndim(t) == 0:
+        tt = t - td
+        if tt > 0:
+            tt %= per
+        if tt < 0 or tt >= tr + pw + tf:
+            return v1
+        if tt < tr:
+            return v1 + (v2 - v1) * tt / tr
+        if tt < tr + pw:
+            return v2
+        return v2 + (v1 - v2) * (tt - tr - pw) / tf
+    tt = np.asarray(t, dtype=float) - td
+    tt = np.where(tt > 0, np.mod(tt, per), tt)
+    high = tr + pw
+    value = np.where(tt < 0, v1, v2)
+    if tr > 0:
+        value = np.where((tt >= 0) & (tt < tr), v1 + (v2 - v1) * tt / tr, value)
+    if tf > 0:
+        value = np.where((tt >= high) & (tt < high + tf), v2 + (v1 - v2) * (tt - high) / tf, value)
+    value = np.where(tt >= high + tf, v1, value)
+    return value
+
+
+def pwl(t, times, values):
+    """ngspice PWL waveform without repeat: linear between corners, held outside them."""
+    return np.interp(t, times, values)
+
+
+def pwl_paths(t, times, values, columns=None):
+    """
+    K PWL waveforms sharing their corner times; values has shape (K, len(times)).
+
+    A scalar t gives every path at t, shape (K,); an array t of shape (K,)
+    gives path k at t[k] (one time per state column, as outputs() passes).
+    columns is values.T as a contiguous array, to be read once per solver step.
+    """
+    if np.ndim(t) == 0:
+        # the solver's path: one corner pair for all paths, read from the contiguous (T, K) copy
+        position = min(max(int(np.searchsorted(times, t, side='right')) - 1, 0), len(times) - 2)
+        weight = min(max((t - times[position]) / (times[position + 1] - times[position]), 0.0), 1.0)
+        columns = values.T if columns is None else columns
+        return columns[position] * (1 - weight) + columns[position + 1] * weight
+    position = np.clip(np.searchsorted(times, t, side='right') - 1, 0, len(times) - 2)
+    weight = np.clip((t - times[position]) / (times[position + 1] - times[position]), 0.0, 1.0)
+    rows = np.arange(values.shape[0])
+    return values[rows, position] * (1 - weight) + values[rows, position + 1] * weight
+
+
+def pulse_breakpoints(td, tr, tf, pw, per, end_time):
+    """Times at which a PULSE source has a corner, up to end_time."""
+    points = []
+    start = td
+    while start < end_time:
+        points.extend([start, start + tr, start + tr + pw, start + tr + pw + tf])
+        start += per
+    return [p for p in points if 0 < p < end_time]
+
+
+def _stack(values, like):
+    """Stacks scalars/arrays into a (k,) or (k, K) block shaped like `like`."""
+    if not values:
+        return np.zeros((0,) + np.shape(like))
+    if np.ndim(like) == 0:
+        return np.array(values, dtype=float)
+    return np.stack(np.broadcast_arrays(like, *values)[1:])
+
+
+def _scalars(array):
+    """Python floats for a single state (fast scalar maths), else the array."""
+    return array.tolist() if array.ndim == 1 else array
+
+
+def _parse_raw_spice(raw_spice):
+    """Splits raw SPICE text into A-devices, .model cards and resistors."""
+    lines = []
+    for line in raw_spice.splitlines():
+        line = line.strip()
+        if not line or line.startswith('*'):
+            continue
+        if line.startswith('+') and lines:
+            lines[-1] += ' ' + line[1:]
+        else:
+            lines.append(line)
+
+    devices, models, resistors = [], {}, []
+    for line in lines:
+        lower = line.lower()
+        if lower.startswith('.model'):
+            match = re.match(r'\.model\s+(\S+)\s+(\w+)\s*\((.*)\)\s*$', line, re.IGNORECASE | re.DOTALL)
+            if match is None:
+                raise NotImplementedError(f"unsupported .model card: {line}")
+            settings = dict(re.findall(r'(\w+)\s*=\s*(\S+)', match.group(3)))
+            models[match.group(1).lower()] = (match.group(2).lower(),
+                                              {k.lower(): spice_number(v) for k, v in settings.items()})
+        elif lower.startswith('a'):
+            name, node_in, node_out, model = line.split()[:4]
+            devices.append((name, node_in, node_out, model.lower()))
+        elif lower.startswith('r'):
+            name, node_a, node_b, value = line.split()[:4]
+            resistors.append((name, node_a, node_b, spice_number(value)))
+        else:
+            raise NotImplementedError(f"unsupported raw SPICE line: {line}")
+    return devices, models, resistors
+
+
+def _initial_condition(element, parameters):
+    """Reads an 'IC=...' setting from an element's raw_spice, default 0."""
+    match = re.search(r'IC\s*=\s*(\S+)', element.raw_spice or '', re.IGNORECASE)
+    if match is None:
+        return 0.0
+    return float(eval(translate_expression(match.group(1), parameters, _no_probe), {'np': np}))
+
+
+class StateSpaceAnalysis:
+    """
+    Transient result of the state-space backend.
+
+    Mirrors the parts of PySpice's TransientAnalysis that plotting() uses:
+    `time`, `nodes`, `branches` and case-insensitive item access.
+    """
+
+    def __init__(self, time, nodes, branches):
+        self.time = time
+        self.nodes = nodes
+        self.branches = branches
+
+    def __getitem__(self, name):
+        for key in (name, name.lower()):
+            if key in self.nodes:
+                return self.nodes[key]
+            if key in self.branches:
+                return self.branches[key]
+        raise IndexError(name)
+
+    def __contains__(self, name):
+        try:
+            self[name]
+        except IndexError:
+            return False
+        return True
+
+
+_RK4_LIMIT = 2.5    # |h lambda| RK4 keeps stable, with margin (2.79 on the real axis, 2.83 on the imaginary)
+
+
+class StateSpaceModel:
+    """ODE form of a Circuit, built by compile_circuit()."""
+
+    def __init__(self, rhs, outputs, x0, breakpoints):
+        self._rhs = rhs
+        self._outputs = outputs
+        self.x0 = x0
+        self._breakpoints = breakpoints
+
+    def rhs(self, t, x):
+        """dx/dt for x of shape (n,) or (n, K); single columns take the scalar path."""
+        if x.ndim == 2 and x.shape[1] == 1:
+            return self._rhs(t, x[:, 0])[:, None]
+        return self._rhs(t, x)
+
+    def outputs(self, t, x):
+        """Evaluates every named vector for states x of shape (n, len(t))."""
+        return self._outputs(t, x)
+
+    def simulate_paths(self, step_time, end_time, record_step=None, save=None):
+        """
+        Advances every column of a compile_circuit(paths=...) model together.
+
+        Classic RK4 with a fixed step_time. The ALM's modes are slow (|lambda|
+        about 1/s), but a short tau_d or a large Kd adds fast ones, so each
+        step is split into as many equal substeps as the fastest eigenvalue
+        of the Jacobian at x0 needs to stay inside RK4's stability region.
+        Vectors are recorded every record_step (default step_time) as
+        (K, records) arrays; `save` keeps only the listed ones. Raises
+        RuntimeError when a path stops being finite.
+        """
+        step_time, end_time = float(step_time), float(end_time)
+        record_step = step_time if record_step is None else float(record_step)
+        every = max(1, int(round(record_step / step_time)))
+        steps = int(round(end_time / step_time))
+        x = np.array(self.x0 if np.ndim(self.x0) == 2 else self.x0[:, None], dtype=float)
+        columns = x.shape[1]
+        wanted = None if not save else {name.lower() for name in save}
+        substeps = max(1, int(np.ceil(step_time * self._spectral_radius(x) / _RK4_LIMIT)))
+        h = step_time / substeps
+
+        time = step_time * np.arange(0, steps + 1, every)
+        nodes, branches = {}, {}
+
+        def record(k, t, x):
+            if not np.isfinite(x).all():
+                raise RuntimeError(f'RK4 paths are no longer finite at t={t:g}; try a smaller step_time')
+            new_nodes, new_branches = self.outputs(np.full(columns, t), x)
+            for values, new in (nodes, new_nodes), (branches, new_branches):
+                for name, value in new.items():
+                    if wanted is None or name.lower() in wanted:
+                        if name not in values:
+                            values[name] = np.empty((columns, time.size))
+                        values[name][:, k] = value
+
+        record(0, 0.0, x)
+        for k in range(1, steps + 1):
+            for j in range(substeps):
+                t = (k - 1) * step_time + j * h
+                k1 = self._rhs(t, x)
+                k2 = self._rhs(t + h / 2, x + h / 2 * k1)
+                k3 = self._rhs(t + h / 2, x + h / 2 * k2)
+                k4 = self._rhs(t + h, x + h * k3)
+                x = x + h / 6 * (k1 + 2 * k2 + 2 * k3 + k4)
+            if k % every == 0:
+                record(k // every, k * step_time, x)
+        if not np.isfinite(x).all():
+            raise RuntimeError(f'RK4 paths are no longer finite at t={steps * step_time:g}; try a smaller step_time')
+        add_stats(states=x.shape[0], columns=columns, substeps=substeps,
+                  rhs_evaluations=4 * steps * substeps + x.shape[0] + 1)
+        return StateSpaceAnalysis(time, nodes, branches)
+
+    def _spectral_radius(self, x, t=0.0):
+        """Largest |eigenvalue| over the columns' finite-difference Jacobians at (t, x)."""
+        base = self._rhs(t, x)
+        jacobian = np.empty((x.shape[1], x.shape[0], x.shape[0]))
+        for j in range(x.shape[0]):
+            delta = 1e-7 * np.maximum(np.abs(x[j]), 1.0)
+            moved = x.copy()
+            moved[j] += delta
+            jacobian[:, :, j] = ((self._rhs(t, moved) - base) / delta).T
+        return float(np.max(np.abs(np.linalg.eigvals(jacobian)), initial=0.0))
+
+    def simulate(self, step_time, end_time, method='LSODA', rtol=1e-6, atol=1e-9, x0=None, save=None):
+        """
+        Integrates the model from 0 to end_time and samples it every step_time.
+
+        `save` keeps only the listed vectors in the result, like .save in ngspice.
+
+        The solver is restarted at every source breakpoint, as ngspice does,
+        so step changes in the rate paths never straddle an integration step.
+        """
+        from scipy.integrate import solve_ivp   # SciPy loads on the first solve, not on import
+        step_time, end_time = float(step_time), float(end_time)
+        time = np.linspace(0, end_time, int(round(end_time / step_time)) + 1)
+        x = np.array(self.x0 if x0 is None else x0, dtype=float)
+        edges = [0.0]
+        for point in sorted(self._breakpoints(end_time)) + [end_time]:
+            # corners of different sources that only differ by rounding are one breakpoint
+            if point - edges[-1] > 1e-9 * max(1.0, abs(point)):
+                edges.append(point)
+        edges[-1] = end_time
+
+        states = np.empty((x.size, time.size))
+        counts = {'segments': 0, 'rhs_evaluations': 0, 'jacobian_evaluations': 0, 'lu_decompositions': 0}
+        for k, (start, stop) in enumerate(zip(edges[:-1], edges[1:])):
+            if stop <= start:
+                continue
+            last = k == len(edges) - 2
+            mask = (time >= start) & ((time <= stop) if last else (time < stop))
+            solution = solve_ivp(self.rhs, (start, stop), x, method=method, rtol=rtol, atol=atol,
+                                 vectorized=True, dense_output=True)
+            if not solution.success:
+                raise RuntimeError(f"state-space solve failed at t={solution.t[-1]}: {solution.message}")
+            if mask.any():
+                states[:, mask] = solution.sol(time[mask])
+            x = solution.y[:, -1]
+            counts['segments'] += 1
+            counts['rhs_evaluations'] += int(solution.nfev)
+            counts['jacobian_evaluations'] += int(solution.njev)
+            counts['lu_decompositions'] += int(solution.nlu)
+        add_stats(states=x.size, **counts)
+
+        nodes, branches = self.outputs(time, states)
+        if save:
+            wanted = {name.lower() for name in save}
+            nodes = {name: value for name, value in nodes.items() if name.lower() in wanted}
+            branches = {name: value for name, value in branches.items() if name.lower() in wanted}
+        return StateSpaceAnalysis(time, nodes, branches)
+
+
+def compile_circuit(circuit, initial_condition=None, tau_d=None, paths=None):
+    """
+    Compiles a PySpice Circuit into a StateSpaceModel.
+
+    Args:
+      circuit            Circuit – as built by ALM(), RLC(), VRLC(), ...
+      initial_condition  dict    – node name -> voltage for capacitor nodes,
+                                   like simulator.initial_condition(...)
+      tau_d              float   – filter time constant of d_dt blocks;
+                                   defaults to the circuit's tau_d parameter
+      paths              dict    – source name -> (times, values of shape (K, len(times))):
+                                   that PWL/V source follows one row per state column,
+                                   and x0 gets shape (n, K) (see simulate_paths())
+    """
+    gnd = str(circuit.gnd)
+    parameters = evaluate_parameters(circuit)
+    paths = {name.lower(): (np.asarray(times, dtype=float), np.atleast_2d(np.asarray(values, dtype=float)))
+             for name, (times, values) in (paths or {}).items()}
+    columns = {values.shape[0] for _, values in paths.values()}
+    if len(columns) > 1:
+        raise ValueError(f"paths with different numbers of rows: {sorted(columns)}")
+    columns = columns.pop() if columns else 1
+    if tau_d is None:
+        tau_d = parameters.get('tau_d', 1e-3)
+
+    inductors, couplings, capacitors, resistors = [], [], [], []
+    current_sources, voltage_sources = [], []
+    voltage_branches = []                         # (name, plus, minus) of every voltage source
+    for element in circuit.elements:
+        kind = type(element).__name__
+        nodes = [str(node) for node in element.node_names]
+        if kind == 'Inductor':
+            inductors.append((element.name.lower(), nodes[0], nodes[1],
+                              float(element.inductance), _initial_condition(element, parameters)))
+        elif kind == 'CoupledInductor':
+            couplings.append((element.inductor1.lower(), element.inductor2.lower(),
+                              float(element.coupling_factor)))
+        elif kind == 'Capacitor':
+            capacitors.append((nodes[0], nodes[1], float(element.capacitance),
+                               _initial_condition(element, parameters)))
+        elif kind == 'Resistor':
+            resistors.append((nodes[0], nodes[1], float(element.resistance)))
+        elif kind == 'BehavioralSource':
+            if element.current_expression is not None:
+                current_sources.append((element.name.lower(), nodes[0], nodes[1], element.current_expression))
+            else:
+                voltage_sources.append((nodes[0], nodes[1], ('expr', element.voltage_expression)))
+        elif kind == 'PulseVoltageSource':
+            voltage_sources.append((nodes[0], nodes[1], ('pulse', (
+                float(element.initial_value), float(element.pulsed_value), float(element.delay_time),
+                float(element.rise_time), float(element.fall_time), float(element.pulse_width),
+                float(element.period)))))
+        elif element.name.lower() in paths:
+            if kind not in ('PieceWiseLinearVoltageSource', 'VoltageSource'):
+                raise NotImplementedError(f"paths can only replace PWL or DC sources, not {kind} {element.name}")
+            times, values = paths[element.name.lower()]
+            voltage_sources.append((nodes[0], nodes[1], ('paths', (times, values, np.ascontiguousarray(values.T)))))
+        elif kind == 'PieceWiseLinearVoltageSource':
+            if element.repeat_time is not None:
+                raise NotImplementedError(f"PWL repeat in {element.name} is not supported by the state-space backend")
+            delay = float(element.delay_time) if element.delay_time is not None else 0.0
+            corners = np.array([float(value) for value in element.values]).reshape(-1, 2)
+            voltage_sources.append((nodes[0], nodes[1], ('pwl', (corners[:, 0] + delay, corners[:, 1]))))
+        elif kind == 'VoltageSource':
+            value = element.dc_value
+            value = spice_number(value) if isinstance(value, str) else float(value)
+            voltage_sources.append((nodes[0], nodes[1], ('dc', value)))
+        else:
+            raise NotImplementedError(f"{kind} {element.name} is not supported by the state-space backend")
+        if len(voltage_sources) > len(voltage_branches):
+            voltage_branches.append((element.name.lower(), nodes[0], nodes[1]))
+
+    devices, models, raw_resistors = _parse_raw_spice(circuit.raw_spice)
+    resistors += [(a, b, value) for _, a, b, value in raw_resistors]
+
+    # ─────────────── Node classification ───────────────
+    driven = {}                                   # node -> (sign, source, reference node)
+    integrators, derivatives = [], []
+    for name, node_in, node_out, model in devices:
+        model_type, settings = models[model]
+        if model_type == 'int':
+            integrators.append((node_in, node_out, settings))
+        elif model_type == 'd_dt':
+            derivatives.append((node_in, node_out, settings))
+        else:
+            raise NotImplementedError(f"XSPICE model {model_type} ({name}) is not supported")
+        driven[node_out] = (1.0, ('device', model_type), None)
+
+    pending = list(voltage_sources)
+    while pending:
+        remaining = []
+        for plus, minus, source in pending:
+            if minus == gnd or minus in driven:
+                driven[plus] = (1.0, source, None if minus == gnd else minus)
+            elif plus == gnd or plus in driven:
+                driven[minus] = (-1.0, source, None if plus == gnd else plus)
+            else:
+                remaining.append((plus, minus, source))
+        if len(remaining) == len(pending):
+            plus, minus, _ = remaining[0]
+            raise NotImplementedError(f"floating voltage source between {plus} and {minus}")
+        pending = remaining
+
+    known = list(driven)
+    cap_nodes = sorted({n for a, b, _, _ in capacitors for n in (a, b)} - {gnd})
+    for node in cap_nodes:
+        if node in driven:
+            raise NotImplementedError(f"capacitor on driven node {node}")
+    res_nodes = sorted({n for a, b, _ in resistors for n in (a, b)} - {gnd} - set(known) - set(cap_nodes))
+    touched = {n for _, a, b, _, _ in inductors for n in (a, b)}
+    cut_nodes = sorted(touched - {gnd} - set(known) - set(cap_nodes) - set(res_nodes))
+
+    order = cap_nodes + res_nodes + cut_nodes + known
+    index = {node: k for k, node in enumerate(order)}
+    n_c, n_r, n_z = len(cap_nodes), len(res_nodes), len(cut_nodes)
+    c_, r_, z_, k_ = (slice(0, n_c), slice(n_c, n_c + n_r),
+                      slice(n_c + n_r, n_c + n_r + n_z), slice(n_c + n_r + n_z, len(order)))
+
+    # ─────────────── MNA stamps ───────────────
+    size = len(order)
+    G = np.zeros((size, size))
+    for a, b, value in resistors:
+        for p, q in ((a, b), (b, a)):
+            if p in index:
+                G[index[p], index[p]] += 1 / value
+                if q in index:
+                    G[index[p], index[q]] -= 1 / value
+    Cn = np.zeros((size, size))
+    for a, b, value, _ in capacitors:
+        for p, q in ((a, b), (b, a)):
+            if p in index:
+                Cn[index[p], index[p]] += value
+                if q in index:
+                    Cn[index[p], index[q]] -= value
+
+    inductor_index = {name: k for k, (name, *_rest) in enumerate(inductors)}
+    A_L = np.zeros((size, len(inductors)))
+    for k, (_, a, b, _, _) in enumerate(inductors):
+        if a in index:
+            A_L[index[a], k] += 1
+        if b in index:
+            A_L[index[b], k] -= 1
+    M = np.diag([value for _, _, _, value, _ in inductors]).astype(float)
+    for name1, name2, k in couplings:
+        p, q = inductor_index[name1], inductor_index[name2]
+        M[p, q] = M[q, p] = k * np.sqrt(M[p, p] * M[q, q])
+
+    source_index = {name: k for k, (name, *_rest) in enumerate(current_sources)}
+    A_I = np.zeros((size, len(current_sources)))
+    for k, (_, a, b, _) in enumerate(current_sources):
+        if a in index:
+            A_I[index[a], k] += 1
+        if b in index:
+            A_I[index[b], k] -= 1
+
+    # Inductor cutsets: A_Lz i + A_Iz u = 0, i = P u + N xi, psi = N^T M i
+    A_Lz = A_L[z_]
+    if n_z:
+        _, sv, vt = np.linalg.svd(A_Lz)
+        rank = int((sv > 1e-12 * max(1.0, sv.max())).sum())
+        N = vt[rank:].T
+        P = -np.linalg.pinv(A_Lz) @ A_I[z_]
+    else:
+        N = np.eye(len(inductors))
+        P = np.zeros((len(inductors), len(current_sources)))
+    W = np.linalg.inv(N.T @ M @ N)
+    Q_psi = N @ W
+    Q_u = (np.eye(len(inductors)) - N @ W @ N.T @ M) @ P
+
+    Grr = G[r_, r_]
+    if n_r and np.linalg.matrix_rank(Grr) < n_r:
+        raise NotImplementedError("resistive nodes without a DC path cannot be solved")
+    Grr_inv = np.linalg.inv(Grr) if n_r else np.zeros((0, 0))
+    Ccc = Cn[c_, c_]
+    Ccc_inv = np.linalg.inv(Ccc) if n_c else np.zeros((0, 0))
+
+    # ─────────────── Code generation ───────────────
+    n_psi = N.shape[1]
+    n_int, n_dt = len(integrators), len(derivatives)
+    offsets = np.cumsum([0, n_psi, n_c, n_int, n_dt])
+    x_psi, x_c, x_int, x_dt = (slice(offsets[k], offsets[k + 1]) for k in range(4))
+
+    namespace = {'np': np, '_stack': _stack, '_scalars': _scalars, '_pulse': pulse, '_pwl': pwl,
+                 '_pwl_paths': pwl_paths}
+    items = {}                                    # item -> (code lines, dependencies)
+    device_state = {}
+    for j, (_, node_out, _) in enumerate(integrators):
+        device_state[node_out] = f"xs[{x_int.start + j}]"
+
+    def probe_for(dependencies):
+        def probe(kind, name):
+            name_l = name.lower()
+            if kind == 'i':
+                if name_l in source_index:
+                    dependencies.add(('s', name_l))
+                    return f"s{source_index[name_l]}"
+                if name_l in inductor_index:
+                    dependencies.add(('il',))
+                    return f"ils[{inductor_index[name_l]}]"
+                raise NotImplementedError(f"I({name}) is not available in the state-space backend")
+            node = _match_node(name, index, gnd)
+            if node == gnd:
+                return '0.0'
+            if node in cut_nodes or node not in index:
+                raise NotImplementedError(f"V({name}) sits on an inductor cutset and has no state-space value")
+            position = index[node]
+            if position < n_c:
+                return f"xs[{x_c.start + position}]"
+            if position < n_c + n_r:
+                dependencies.add(('vr',))
+                return f"vrs[{position - n_c}]"
+            dependencies.add(('n', node))
+            return f"n{position}"
+        return probe
+
+    for name, _, _, expression in current_sources:
+        dependencies = set()
+        code = translate_expression(expression, parameters, probe_for(dependencies))
+        items[('s', name)] = ([f"s{source_index[name]} = {code}"], dependencies)
+
+    for node, (sign, source, reference) in driven.items():
+        dependencies = set()
+        target = f"n{index[node]}"
+        if source[0] == 'expr':
+            code = translate_expression(source[1], parameters, probe_for(dependencies))
+            lines = [f"{target} = {sign!r} * ({code})"]
+        elif source[0] == 'dc':
+            lines = [f"{target} = {sign * source[1]!r}"]
+        elif source[0] == 'pulse':
+            namespace[f"_p{index[node]}"] = source[1]
+            lines = [f"{target} = {sign!r} * _pulse(t, *_p{index[node]})"]
+        elif source[0] == 'pwl':
+            namespace[f"_p{index[node]}"] = source[1]
+            lines = [f"{target} = {sign!r} * _pwl(t, *_p{index[node]})"]
+        elif source[0] == 'paths':
+            namespace[f"_p{index[node]}"] = source[1]
+            lines = [f"{target} = {sign!r} * _pwl_paths(t, *_p{index[node]})"]
+        elif source[1] == 'int':
+            lines = [f"{target} = {device_state[node]}"]
+        else:
+            j = [d[1] for d in derivatives].index(node)
+            node_in, _, settings = derivatives[j]
+            gain = settings.get('gain', 1.0)
+            offset = settings.get('out_offset', 0.0)
+            dependencies.add(('n', node_in))
+            lines = [f"{target} = {gain!r} * (n{index[node_in]} - xs[{x_dt.start + j}]) / {tau_d!r} + {offset!r}"]
+        if reference is not None:
+            dependencies.add(('n', reference))
+            lines.append(f"{target} = {target} + n{index[reference]}")
+        items[('n', node)] = (lines, dependencies)
+
+    def block(matrix, variable_codes):
+        """Python source for matrix @ stack(columns), skipping zero columns."""
+        used = [k for k in range(matrix.shape[1]) if np.any(matrix[:, k])]
+        if not used:
+            return None, []
+        name = f"_m{len(namespace)}"
+        namespace[name] = matrix[:, used]
+        return f"{name} @ _stack([{', '.join(variable_codes[k] for k in used)}], x[0])", used
+
+    # voltage source branch currents, from KCL at a terminal where every other current is known
+    def node_code(node, dependencies):
+        position = index[node]
+        if position < n_c:
+            return f"xs[{x_c.start + position}]"
+        if position < n_c + n_r:
+            dependencies.add(('vr',))
+            return f"vrs[{position - n_c}]"
+        dependencies.add(('n', node))
+        return f"n{position}"
+
+    device_outputs = {node_out for _, node_out, _ in integrators + derivatives}
+    branch_index = {}
+    unresolved = list(voltage_branches)
+    while unresolved:
+        remaining = []
+        for name, plus, minus in unresolved:
+            for node, sign in ((plus, -1.0), (minus, 1.0)):
+                # ngspice's branch current flows into the + terminal: I = -(leaving plus) = leaving minus
+                others = [branch for branch in voltage_branches if branch[0] != name and node in branch[1:]]
+                if (node == gnd or node not in index or node in device_outputs
+                        or any(other[0] not in branch_index for other in others)):
+                    continue
+                dependencies = set()
+                p = index[node]
+                terms = [f"{G[p, q]!r} * {node_code(order[q], dependencies)}"
+                         for q in range(size) if G[p, q] and order[q] not in cut_nodes]
+                terms += [f"{A_L[p, k]!r} * ils[{k}]" for k in range(len(inductors)) if A_L[p, k]]
+                if any(A_L[p]):
+                    dependencies.add(('il',))
+                for k, (source, *_rest) in enumerate(current_sources):
+                    if A_I[p, k]:
+                        terms.append(f"{A_I[p, k]!r} * s{k}")
+                        dependencies.add(('s', source))
+                for other, other_plus, _ in others:
+                    terms.append(f"{1.0 if other_plus == node else -1.0!r} * b{branch_index[other]}")
+                    dependencies.add(('b', other))
+                branch_index[name] = len(branch_index)
+                code = ' + '.join(terms) or '0.0'
+                items[('b', name)] = ([f"b{branch_index[name]} = {sign!r} * ({code})"], dependencies)
+                break
+            else:
+                remaining.append((name, plus, minus))
+        if len(remaining) == len(unresolved):
+            break  # left out: e.g. a source in parallel with another or with an XSPICE output
+        unresolved = remaining
+
+    u_codes = [f"s{k}" for k in range(len(current_sources))]
+    k_nodes = order[k_]
+    k_codes = [f"n{index[node]}" for node in k_nodes]
+
+    # inductor currents
+    namespace['_Q_psi'] = Q_psi
+    terms, dependencies = [f"_Q_psi @ x[{x_psi.start}:{x_psi.stop}]"], set()
+    code, used = block(Q_u, u_codes)
+    if code:
+        terms.append(code)
+        dependencies |= {('s', current_sources[k][0]) for k in used}
+    items[('il',)] = ([f"il = {' + '.join(terms)}", "ils = _scalars(il)"], dependencies)
+
+    # resistive node voltages
+    if n_r:
+        namespace['_R_c'] = -Grr_inv @ G[r_, c_]
+        terms, dependencies = [f"_R_c @ x[{x_c.start}:{x_c.stop}]"], {('il',)}
+        for matrix, codes, deps in (
+            (-Grr_inv @ G[r_, k_], k_codes, 'n'),
+            (-Grr_inv @ A_I[r_], u_codes, 's'),
+        ):
+            code, used = block(matrix, codes)
+            if code:
+                terms.append(code)
+                if deps == 'n':
+                    dependencies |= {('n', k_nodes[k]) for k in used}
+                elif deps == 's':
+                    dependencies |= {('s', current_sources[k][0]) for k in used}
+        namespace['_R_il'] = -Grr_inv @ A_L[r_]
+        terms.append("_R_il @ il")
+        items[('vr',)] = ([f"vr = {' + '.join(terms)}", "vrs = _scalars(vr)"], dependencies)
+
+    # derivatives
+    lines, dependencies = [], set()
+    psi_terms = []
+    if n_c:
+        namespace['_psi_c'] = N.T @ A_L[c_].T
+        psi_terms.append(f"_psi_c @ x[{x_c.start}:{x_c.stop}]")
+    if n_r:
+        namespace['_psi_r'] = N.T @ A_L[r_].T
+        psi_terms.append("_psi_r @ vr")
+        dependencies.add(('vr',))
+    code, used = block(N.T @ A_L[k_].T, k_codes)
+    if code:
+        psi_terms.append(code)
+        dependencies |= {('n', k_nodes[k]) for k in used}
+    if psi_terms:
+        lines.append(f"d_psi = {' + '.join(psi_terms)}")
+    else:
+        lines.append(f"d_psi = np.zeros(({n_psi},) + np.shape(x[0]))")
+
+    if n_c:
+        namespace['_c_c'] = -Ccc_inv @ G[c_, c_]
+        namespace['_c_il'] = -Ccc_inv @ A_L[c_]
+        c_terms = ["_c_c @ x[{0}:{1}]".format(x_c.start, x_c.stop), "_c_il @ il"]
+        dependencies.add(('il',))
+        if n_r:
+            namespace['_c_r'] = -Ccc_inv @ G[c_, r_]
+            c_terms.append("_c_r @ vr")
+            dependencies.add(('vr',))
+        code, used = block(-Ccc_inv @ G[c_, k_], k_codes)
+        if code:
+            c_terms.append(code)
+            dependencies |= {('n', k_nodes[k]) for k in used}
+        code, used = block(-Ccc_inv @ A_I[c_], u_codes)
+        if code:
+            c_terms.append(code)
+            dependencies |= {('s', current_sources[k][0]) for k in used}
+        lines.append(f"d_c = {' + '.join(c_terms)}")
+    else:
+        lines.append("d_c = _stack([], x[0])")
+
+    int_terms = []
+    for node_in, _, settings in integrators:
+        node_in = _match_node(node_in, index, gnd)
+        dependencies.add(('n', node_in))
+        int_terms.append(f"{settings.get('gain', 1.0)!r} * (n{index[node_in]} + {settings.get('in_offset', 0.0)!r})")
+    lines.append(f"d_int = _stack([{', '.join(int_terms)}], x[0])")
+
+    dt_terms = []
+    for j, (node_in, _, _) in enumerate(derivatives):
+        dependencies.add(('n', node_in))
+        dt_terms.append(f"(n{index[node_in]} - xs[{x_dt.start + j}]) / {tau_d!r}")
+    lines.append(f"d_dt = _stack([{', '.join(dt_terms)}], x[0])")
+    lines.append("dx = np.concatenate([d_psi, d_c, d_int, d_dt])")
+    items[('dx',)] = (lines, dependencies)
+
+    def ordered(targets):
+        result, state = [], {}
+
+        def visit(item):
+            if state.get(item) == 'done':
+                return
+            if state.get(item) == 'busy':
+                raise ValueError(f"algebraic loop through {item}")
+            state[item] = 'busy'
+            for dependency in sorted(items[item][1]):
+                visit(dependency)
+            state[item] = 'done'
+            result.append(item)
+
+        for target in targets:
+            visit(target)
+        return result
+
+    body = [line for item in ordered([('dx',)]) for line in items[item][0]]
+    rhs_source = "def _rhs(t, x):\n    " + "\n    ".join(["xs = _scalars(x)"] + body + ["return dx"])
+
+    out_items = ordered(sorted(items))
+    body = [line for item in out_items if item != ('dx',) for line in items[item][0]]
+    node_codes, branch_codes = {}, {}
+    for node in cap_nodes:
+        node_codes[node.lower()] = f"xs[{x_c.start + index[node]}]"
+    for j, node in enumerate(res_nodes):
+        node_codes[node.lower()] = f"vrs[{j}]"
+    for node in known:
+        node_codes[node.lower()] = f"n{index[node]}"
+    for name, k in inductor_index.items():
+        branch_codes[name] = f"ils[{k}]"
+    for name, k in source_index.items():
+        branch_codes['v_' + name] = f"s{k}"
+    for name, k in branch_index.items():
+        branch_codes[name] = f"b{k}"
+    shape = "np.shape(t)"
+    body.append("nodes = {" + ", ".join(f"{key!r}: np.broadcast_to({code}, {shape})"
+                                          for key, code in node_codes.items()) + "}")
+    body.append("branches = {" + ", ".join(f"{key!r}: np.broadcast_to({code}, {shape})"
+                                             for key, code in branch_codes.items()) + "}")
+    outputs_source = "def _outputs(t, x):\n    " + "\n    ".join(["xs = _scalars(x)"] + body + ["return nodes, branches"])
+
+    exec(rhs_source, namespace)
+    exec(outputs_source, namespace)
+
+    # ─────────────── Initial state (use_initial_condition=True) ───────────────
+    x0 = np.zeros(offsets[-1])
+    i0 = np.array([ic for *_rest, ic in inductors], dtype=float)
+    x0[x_psi] = N.T @ M @ i0
+    v0 = np.zeros(size)
+    for a, b, _, ic in capacitors:
+        if ic and b == gnd and a in index:
+            v0[index[a]] = ic
+        elif ic and a == gnd and b in index:
+            v0[index[b]] = -ic
+    for node, value in (initial_condition or {}).items():
+        node = _match_node(node, index, gnd)
+        if node in index:
+            v0[index[node]] = float(value)
+    x0[x_c] = v0[c_]
+    x0[x_int] = [settings.get('out_ic', 0.0) for _, _, settings in integrators]
+    x0 = np.tile(x0[:, None], (1, columns))
+    for _ in range(3):                                  # settle d_dt filters so they start at rest
+        if not n_dt:
+            break
+        nodes, _ = namespace['_outputs'](np.zeros(columns), x0)
+        x0[x_dt] = [nodes[node_in.lower()] for node_in, _, _ in derivatives]
+    if not paths:
+        x0 = x0[:, 0]
+
+    pulses = [source[1] for _, source, _ in driven.values() if source[0] == 'pulse']
+    corners = [source[1][0] for _, source, _ in driven.values() if source[0] == 'pwl']
+
+    def breakpoints(end_time):
+        points = [p for parameters_ in pulses for p in pulse_breakpoints(*parameters_[2:], end_time)]
+        points += [p for times in corners for p in times.tolist() if 0 < p < end_time]
+        return points
+
+    return StateSpaceModel(namespace['_rhs'], namespace['_outputs'], x0, breakpoints)
+
+
+def _match_node(name, index, gnd):
+    """Finds a node by SPICE's case-insensitive name matching."""
+    if name in index or name == gnd:
+        return name
+    for node in index:
+        if node.lower() == name.lower():
+            return node
+    return name
+
+
+def run_state_space(circuit, step_time, end_time, initial_condition=None, **options):
+    """Drop-in for run_transient(): compiles and simulates in one call."""
+    with phase('compile'):
+        model = compile_circuit(circuit, initial_condition=initial_condition)
+    with phase('solve'):
+        return model.simulate(step_time, end_time, **options)
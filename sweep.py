@@ -0,0 +1,171 @@
+#!/usr/bin/env python3
+"""
+Parallel, resumable parameter sweeps over ALM() keyword arguments.
+
+Every run is one kwargs dict for ALM() in BEP_alm_v12.py. Runs are fanned
+out over a process pool; each finished run is appended straight away to
+<directory>/results.jsonl (parameters, scalar KPIs, error) and its selected
+vectors go to <directory>/vectors/<run_id>/ (see result_store.py). The run id is a hash of the
+kwargs, so calling sweep() again with the same directory skips everything
+already finished and only retries the rest.
+
+    runs = grid(Kp=[0.005, 0.015, 0.03], Ki=[0.0005, 0.001])
+    rows = sweep(runs, 'sweeps/gains', kpis={'final_spread': 'final:v_bspread'})
+    table = results_table(rows)
+"""
+import concurrent.futures
+import contextlib
+import hashlib
+import io
+import itertools
+import json
+import os
+
+import numpy as np
+
+from result_store import StoredRun, save_run
+from state_space import StateSpaceAnalysis
+
+KPI_REDUCTIONS = {
+    'final': lambda values: values[-1],
+    'max': np.max,
+    'min': np.min,
+    'mean': np.mean,
+    'absmax': lambda values: np.max(np.abs(values)),
+}
+
+
+def grid(**axes):
+    """Cartesian product of keyword axes, e.g. grid(Kp=[...], Ki=[...])."""
+    names = list(axes)
+    return [dict(zip(names, values)) for values in itertools.product(*axes.values())]
+
+
+def run_id(kwargs):
+    text = json.dumps(kwargs, sort_keys=True, default=float)
+    return hashlib.sha1(text.encode()).hexdigest()[:16]
+
+
+def kpi_value(analysis, spec):
+    """A KPI is a callable(analysis) or a '<reduction>:<vector>' string such as 'max:v_bspread'."""
+    if callable(spec):
+        return float(spec(analysis))
+    reduction, vector = spec.split(':', 1)
+    return float(KPI_REDUCTIONS[reduction](np.asarray(analysis[vector])))
+
+
+def saved_vectors(vectors, kpis):
+    """Everything a run has to record, or None when a callable KPI may read anything."""
+    if any(callable(spec) for spec in kpis.values()):
+        return None
+    return sorted({*vectors, *(spec.split(':', 1)[1] for spec in kpis.values())}) or None
+
+
+def _run_one(kwargs, vectors, kpis, backend, end_time, vector_path, quiet, compiled):
+    # Runs in a worker process; imported here so the pool children pay for it once.
+    from BEP_alm_v12 import ALM, run_transient
+    from PySpice.Unit import u_s
+
+    row = {'run_id': run_id(kwargs), 'params': kwargs, 'kpis': {}, 'error': None}
+    save = saved_vectors(vectors, kpis)
+    try:
+        with contextlib.redirect_stdout(io.StringIO()) if quiet else contextlib.nullcontext():
+            if compiled:
+                # one ALM() build per topology and worker (see alm_template.py)
+                from alm_template import template_transient
+                analysis = template_transient(end_time=end_time, backend=backend, save=save, **kwargs)
+            else:
+                circuit = ALM(**kwargs)
+                analysis = run_transient(circuit, end_time=end_time @ u_s, backend=backend, save=save)
+        row['kpis'] = {name: kpi_value(analysis, spec) for name, spec in kpis.items()}
+        if vectors:
+            selected = StateSpaceAnalysis(analysis.time, {name.lower(): analysis[name] for name in vectors}, {})
+            save_run(vector_path, selected, metadata={'params': kwargs})
+    except Exception as error:
+        row['error'] = f'{type(error).__name__}: {error}'
+    return row
+
+
+def load_results(directory):
+    """Rows finished so far; a later row for the same run id replaces an earlier one."""
+    rows = {}
+    path = os.path.join(directory, 'results.jsonl')
+    if os.path.exists(path):
+        with open(path) as file:
+            for line in file:
+                if line.strip():
+                    row = json.loads(line)
+                    rows[row['run_id']] = row
+    return list(rows.values())
+
+
+def load_vectors(directory, row):
+    """The saved vectors of one result row, memory-mapped on access."""
+    return StoredRun(os.path.join(directory, 'vectors', row['run_id']))
+
+
+def sweep(runs, directory, vectors=(), kpis=None, processes=None, backend='ngspice',
+          end_time=5000, quiet=True, compiled=True):
+    """
+    Runs ALM(**kwargs) for every dict in `runs` and returns all result rows.
+
+    `vectors` are analysis names saved per run, `kpis` maps column names to
+    kpi_value() specs. With `compiled`, runs sharing a topology rebind one
+    ALMTemplate instead of rebuilding ALM(). Runs whose id already has an
+    error-free row in `directory` are not repeated.
+    """
+    kpis = dict(kpis or {})
+    os.makedirs(os.path.join(directory, 'vectors'), exist_ok=True)
+    done = {row['run_id'] for row in load_results(directory) if row['error'] is None}
+    pending = {}
+    for kwargs in runs:
+        key = run_id(kwargs)
+        if key not in done:
+            pending[key] = kwargs
+
+    initializer = None
+    if backend == 'ngspice':
+        from ngspice_pool import warm_up
+        initializer = warm_up
+
+    with open(os.path.join(directory, 'results.jsonl'), 'a') as table, \
+            concurrent.futures.ProcessPoolExecutor(processes, initializer=initializer) as executor:
+        futures = [
+            executor.submit(_run_one, kwargs, tuple(vectors), kpis, backend, end_time,
+                            os.path.join(directory, 'vectors', key), quiet, compiled)
+            for key, kwargs in pending.items()
+        ]
+        try:
+            for future in concurrent.futures.as_completed(futures):
+                table.write(json.dumps(future.result(), default=float) + '\n')
+                table.flush()
+        except KeyboardInterrupt:
+            executor.shutdown(wait=False, cancel_futures=True)
+            raise
+    return load_results(directory)
+
+
+def results_table(rows):
+    """Column-wise view of result rows: one array per parameter and KPI."""
+    rows = [row for row in rows if row['error'] is None]
+    params = sorted({name for row in rows for name in row['params']})
+    kpis = sorted({name for row in rows for name in row['kpis']})
+    table = {'run_id': np.array([row['run_id'] for row in rows])}
+    for name in params:
+        table[name] = np.array([row['params'].get(name) for row in rows], dtype=object)
+    for name in kpis:
+        table[name] = np.array([row['kpis'].get(name, np.nan) for row in rows], dtype=float)
+    return table
+
+
+def main():
+    runs = grid(Kp=[0.005, 0.015, 0.03], Ki=[0.0005, 0.001, 0.002])
+    rows = sweep(runs, 'sweeps/gains', vectors=['v_bspread'],
+                 kpis={'final_spread': 'final:v_bspread', 'max_spread': 'max:v_bspread'})
+    table = results_table(rows)
+    for i, key in enumerate(table['run_id']):
+        print(key, table['Kp'][i], table['Ki'][i], table['final_spread'][i], table['max_spread'][i])
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,74 @@
+"""
+Append-only trajectory buffers for the co-simulation loops.
+
+np.append copies the whole history on every control step, which makes a
+forloop() quadratic in the number of steps. A Trajectory keeps one
+preallocated float buffer per named signal, doubles it when full and
+hands back views of the filled part, so appending is amortised O(1) and
+reading the result copies nothing.
+"""
+import numpy as np
+
+
+class Trajectory:
+    """
+    Named, independently growing 1-D float buffers.
+
+    `capacity` preallocates every signal, e.g. number_of_steps * points per
+    step for the raw waveforms; signals listed in `sizes` get their own
+    capacity (number_of_steps for the once-per-step control values).
+    """
+
+    def __init__(self, *names, capacity=1024, sizes=None):
+        self._buffers = {}
+        self._lengths = {}
+        sizes = sizes or {}
+        for name in (*names, *sizes):
+            self.add(name, sizes.get(name, capacity))
+
+    def add(self, name, capacity=1024):
+        self._buffers[name] = np.empty(max(int(capacity), 1))
+        self._lengths[name] = 0
+
+    def _reserve(self, name, extra):
+        buffer = self._buffers[name]
+        needed = self._lengths[name] + extra
+        if needed > len(buffer):
+            grown = np.empty(max(needed, 2 * len(buffer)))
+            grown[:self._lengths[name]] = buffer[:self._lengths[name]]
+            self._buffers[name] = grown
+        return self._buffers[name]
+
+    def append(self, name, value):
+        """Appends one sample."""
+        buffer = self._reserve(name, 1)
+        buffer[self._lengths[name]] = value
+        self._lengths[name] += 1
+
+    def extend(self, name, values, offset=0.0):
+        """Appends a block of samples, optionally shifted by `offset`."""
+        values = np.asarray(values, dtype=float)
+        start = self._lengths[name]
+        buffer = self._reserve(name, len(values))
+        np.add(values, offset, out=buffer[start:start + len(values)])
+        self._lengths[name] += len(values)
+
+    def last(self, name, default=None):
+        """Latest sample of `name`, or `default` while it is still empty."""
+        length = self._lengths[name]
+        if length == 0:
+            if default is None:
+                raise IndexError(f'{name} is empty')
+            return default
+        return self._buffers[name][length - 1]
+
+    def __contains__(self, name):
+        return name in self._buffers
+
+    def __getitem__(self, name):
+        """View of the samples recorded so far (invalidated by the next growth)."""
+        return self._buffers[name][:self._lengths[name]]
+
+    def arrays(self, *names):
+        """Views of `names`, in order, for returning from a forloop()."""
+        return tuple(self[name] for name in names)